@@ -69,14 +69,26 @@ def nesting_inspection(org, grey, compos, ffl_block):
 
 
 def compo_detection(input_img_path, output_root, uied_params,
-                    resize_by_height=800, classifier=None, show=False, wai_key=0):
+                    resize_by_height=800, classifier=None, show=False, wai_key=0, input_img=None):
+    '''
+    :param input_img: optional already decoded BGR image; when given it is used instead of
+                      reading input_img_path (which then only names the outputs)
+    :param output_root: directory for the ip/ outputs, or None to keep the results in memory only
+    :param uied_params: may set 'output-format' (file_utils.OUTPUT_FORMATS) for the ip/<name> result file
+    :return: detected components; with output_root=None, file_utils.corners_dict(compos) gives
+             the same structure as the saved JSON
+    '''
 
     start = time.perf_counter()
+    input_img_path = str(input_img_path or 'image.png')
     name = input_img_path.split('/')[-1][:-4] if '/' in input_img_path else input_img_path.split('\\')[-1][:-4]
-    ip_root = file.build_directory(pjoin(output_root, "ip"))
+    ip_root = file.build_directory(pjoin(output_root, "ip")) if output_root is not None else None
 
     # *** Step 1 *** pre-processing: read img -> get binary map
-    org, grey = pre.read_img(input_img_path, resize_by_height)
+    if input_img is not None:
+        org, grey = pre.prepare_img(input_img, resize_by_height)
+    else:
+        org, grey = pre.read_img(input_img_path, resize_by_height)
     binary = pre.binarization(org, grad_min=int(uied_params['min-grad']))
 
     # *** Step 2 *** element detection
@@ -95,7 +107,8 @@ def compo_detection(input_img_path, output_root, uied_params,
     # *** Step 4 ** nesting inspection: check if big compos have nesting element
     uicompos += nesting_inspection(org, grey, uicompos, ffl_block=uied_params['ffl-block'])
     Compo.compos_update(uicompos, org.shape)
-    draw.draw_bounding_box(org, uicompos, show=show, name='merged compo', write_path=pjoin(ip_root, name + '.jpg'), wait_key=wai_key)
+    draw.draw_bounding_box(org, uicompos, show=show, name='merged compo',
+                           write_path=pjoin(ip_root, name + '.jpg') if ip_root else None, wait_key=wai_key)
 
     # *** Step 5 *** image inspection: recognize image -> remove noise in image -> binarize with larger threshold and reverse -> rectangular compo detection
     # if classifier is not None:
@@ -122,6 +135,9 @@ def compo_detection(input_img_path, output_root, uied_params,
     # *** Step 8 *** resolve containment issues among UI components
     uicompos = resolve_uicompo_containment(uicompos)
 
-    file.save_corners_json(pjoin(ip_root, name + '.json'), uicompos)
-    print("[Compo Detection Completed in %.3f s] Input: %s Output: %s" % (time.perf_counter() - start, input_img_path, pjoin(ip_root, name + '.json')))
+    if ip_root is not None:
+        result_path = file.save_corners_json(pjoin(ip_root, name + '.json'), uicompos, uied_params.get('output-format'))
+        print("[Compo Detection Completed in %.3f s] Input: %s Output: %s" % (time.perf_counter() - start, input_img_path, result_path))
+    else:
+        print("[Compo Detection Completed in %.3f s] Input: %s (in memory)" % (time.perf_counter() - start, input_img_path))
     return uicompos
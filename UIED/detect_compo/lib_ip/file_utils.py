@@ -4,6 +4,25 @@ import json
 from os.path import join as pjoin
 import time
 import cv2
+import numpy as np
+
+# Output formats of the ip/ocr/merge result files:
+#   json     indented JSON (default)
+#   orjson   compact JSON written with orjson (needs the orjson package)
+#   msgpack  MessagePack (needs the msgpack package), for other tools to read
+#   records  fixed-width NumPy record arrays behind a small JSON header, see save_records
+# load_output reads any of them; the writers pick the suffix, so ip/<name>.json may be ip/<name>.uied
+OUTPUT_FORMATS = ('json', 'orjson', 'msgpack', 'records')
+OUTPUT_SUFFIXES = {'json': '.json', 'orjson': '.json', 'msgpack': '.msgpack', 'records': '.uied'}
+DEFAULT_OUTPUT_FORMAT = os.environ.get('UIED_OUTPUT_FORMAT', 'json')
+
+RECORDS_MAGIC = b'UIEDREC1'
+RECORDS_ALIGN = 64
+
+BOX_FIELDS = [('column_min', '<i4'), ('row_min', '<i4'), ('column_max', '<i4'), ('row_max', '<i4'),
+              ('width', '<i4'), ('height', '<i4')]
+# ip/<name>: one row per component (also ScreenCoder's mapping.UIED_DTYPE)
+COMPO_DTYPE = np.dtype([('id', '<i4'), ('class', 'S16')] + BOX_FIELDS)
 
 
 def save_corners(file_path, corners, compo_name, clear=True):
@@ -25,10 +44,10 @@ def save_corners(file_path, corners, compo_name, clear=True):
     df.to_csv(file_path)
 
 
-def save_corners_json(file_path, compos):
-    img_shape = compos[0].image_shape
-    output = {'img_shape': img_shape, 'compos': []}
-    f_out = open(file_path, 'w')
+def corners_dict(compos, img_shape=None):
+    """The structure save_corners_json writes, kept in memory"""
+    img_shape = compos[0].image_shape if compos else img_shape
+    output = {'img_shape': list(img_shape) if img_shape is not None else None, 'compos': []}
 
     for compo in compos:
         c = {'id': compo.id, 'class': compo.category}
@@ -36,8 +55,205 @@ def save_corners_json(file_path, compos):
         c['width'] = compo.width
         c['height'] = compo.height
         output['compos'].append(c)
+    return output
+
+
+def save_corners_json(file_path, compos, output_format=None):
+    return save_output(file_path, corners_dict(compos), output_format)
+
+
+def text_dtype(width):
+    """ocr/<name>: one row per text; content is fixed-width unicode of the longest text"""
+    return np.dtype([('id', '<i4'), ('content', 'U%d' % max(width, 1))] + BOX_FIELDS)
+
+
+def element_dtype(width):
+    """merge/<name>: one row per element; children are a slice of a separate id array"""
+    return np.dtype([('id', '<i4'), ('class', 'S16')] + BOX_FIELDS +
+                    [('text_content', 'U%d' % max(width, 1)), ('has_text', '?'), ('parent', '<i4'),
+                     ('children_start', '<i4'), ('children_count', '<i4')])
+
+
+def output_to_records(output):
+    """ip/ocr/merge output dict -> (kind, rows, children, header fields)"""
+    if 'texts' in output:
+        texts = output['texts']
+        rows = np.zeros(len(texts), dtype=text_dtype(max([len(t['content']) for t in texts] or [1])))
+        for i, t in enumerate(texts):
+            rows[i] = (t['id'], t['content'], t['column_min'], t['row_min'], t['column_max'], t['row_max'],
+                       t['width'], t['height'])
+        return 'texts', rows, None
+
+    compos = output['compos']
+    if not any('position' in c for c in compos):
+        rows = np.zeros(len(compos), dtype=COMPO_DTYPE)
+        for i, c in enumerate(compos):
+            rows[i] = (c['id'], c['class'].encode()[:16], c['column_min'], c['row_min'], c['column_max'],
+                       c['row_max'], c['width'], c['height'])
+        return 'compos', rows, None
+
+    rows = np.zeros(len(compos), dtype=element_dtype(max([len(c.get('text_content', '')) for c in compos] or [1])))
+    children = []
+    for i, c in enumerate(compos):
+        pos = c['position']
+        kids = c.get('children', [])
+        rows[i] = (c['id'], c['class'].encode()[:16], pos['column_min'], pos['row_min'], pos['column_max'],
+                   pos['row_max'], c['width'], c['height'], c.get('text_content', ''), 'text_content' in c,
+                   c.get('parent', -1), len(children), len(kids))
+        children.extend(kids)
+    return 'elements', rows, np.asarray(children, dtype='<i4')
+
+
+def records_to_output(kind, rows, children, img_shape):
+    """Inverse of output_to_records: the dict the json writers produce"""
+    if kind == 'texts':
+        texts = [{'id': i, 'content': content, 'column_min': x1, 'row_min': y1, 'column_max': x2, 'row_max': y2,
+                  'width': w, 'height': h}
+                 for i, content, x1, y1, x2, y2, w, h in rows.tolist()]
+        return {'img_shape': img_shape, 'texts': texts}
+
+    if kind == 'compos':
+        compos = [{'id': i, 'class': cls.decode(), 'column_min': x1, 'row_min': y1, 'column_max': x2,
+                   'row_max': y2, 'width': w, 'height': h}
+                  for i, cls, x1, y1, x2, y2, w, h in rows.tolist()]
+        return {'img_shape': img_shape, 'compos': compos}
+
+    children = children.tolist() if children is not None else []
+    compos = []
+    for i, cls, x1, y1, x2, y2, w, h, text, has_text, parent, start, count in rows.tolist():
+        c = {'id': i, 'class': cls.decode(), 'height': h, 'width': w,
+             'position': {'column_min': x1, 'row_min': y1, 'column_max': x2, 'row_max': y2}}
+        if has_text:
+            c['text_content'] = text
+        if count:
+            c['children'] = children[start:start + count]
+        if parent >= 0:
+            c['parent'] = parent
+        compos.append(c)
+    return {'compos': compos, 'img_shape': img_shape}
+
+
+def _pad(offset):
+    return -offset % RECORDS_ALIGN
+
+
+def save_records(file_path, output):
+    """
+    Binary result file: magic, <u4 header length, JSON header, then each array's raw bytes
+    (64-byte aligned). The header holds img_shape, the kind and every array's dtype/shape/offset,
+    so load_records can memory-map the rows without parsing them.
+    """
+    kind, rows, children = output_to_records(output)
+    arrays = {'rows': rows}
+    if children is not None:
+        arrays['children'] = children
+    img_shape = output.get('img_shape')
+    header = {'kind': kind, 'img_shape': list(img_shape) if img_shape is not None else None, 'arrays': {}}
+
+    # offsets depend on the header length, which depends on the offsets: reserve room for them first
+    prefix = len(RECORDS_MAGIC) + 4
+    for name, array in arrays.items():
+        header['arrays'][name] = {'dtype': np.lib.format.dtype_to_descr(array.dtype), 'shape': list(array.shape), 'offset': 10 ** 12}
+    data_start = prefix + len(json.dumps(header).encode())
+    data_start += _pad(data_start)
+    offset = data_start
+    for name, array in arrays.items():
+        header['arrays'][name]['offset'] = offset
+        offset += array.nbytes + _pad(array.nbytes)
+    header_bytes = json.dumps(header).encode()
+    header_bytes += b' ' * (data_start - prefix - len(header_bytes))
+
+    with open(file_path, 'wb') as f_out:
+        f_out.write(RECORDS_MAGIC)
+        f_out.write(np.uint32(len(header_bytes)).tobytes())
+        f_out.write(header_bytes)
+        for array in arrays.values():
+            f_out.write(array.tobytes())
+            f_out.write(b'\0' * _pad(array.nbytes))
+
+
+def load_records(file_path, mmap=True):
+    """(header, {name: array}) of a save_records file; arrays are read-only memory maps unless mmap=False"""
+    with open(file_path, 'rb') as f_in:
+        if f_in.read(len(RECORDS_MAGIC)) != RECORDS_MAGIC:
+            raise ValueError('Not a UIED records file: %s' % file_path)
+        header_len = int(np.frombuffer(f_in.read(4), dtype='<u4')[0])
+        header = json.loads(f_in.read(header_len))
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        descr = spec['dtype']
+        dtype = np.dtype([tuple(field) for field in descr] if isinstance(descr, list) else descr)
+        shape = tuple(spec['shape'])
+        if mmap and int(np.prod(shape)) > 0:
+            arrays[name] = np.memmap(file_path, dtype=dtype, mode='r', offset=spec['offset'], shape=shape)
+        else:
+            arrays[name] = np.fromfile(file_path, dtype=dtype, count=int(np.prod(shape)),
+                                       offset=spec['offset']).reshape(shape)
+    return header, arrays
+
+
+def output_path(file_path, output_format=None):
+    """file_path with the suffix of output_format"""
+    output_format = output_format or DEFAULT_OUTPUT_FORMAT
+    if output_format not in OUTPUT_SUFFIXES:
+        raise ValueError('Output format has to be one of %s' % ', '.join(OUTPUT_FORMATS))
+    return os.path.splitext(file_path)[0] + OUTPUT_SUFFIXES[output_format]
+
+
+def save_output(file_path, output, output_format=None):
+    """Write an ip/ocr/merge result in output_format; returns the path written (suffix per format)"""
+    output_format = output_format or DEFAULT_OUTPUT_FORMAT
+    file_path = output_path(file_path, output_format)
+    if output_format == 'json':
+        with open(file_path, 'w') as f_out:
+            json.dump(output, f_out, indent=4)
+    elif output_format == 'orjson':
+        import orjson
+        with open(file_path, 'wb') as f_out:
+            f_out.write(orjson.dumps(output, option=orjson.OPT_SERIALIZE_NUMPY))
+    elif output_format == 'msgpack':
+        import msgpack
+        with open(file_path, 'wb') as f_out:
+            f_out.write(msgpack.packb(output, use_bin_type=True))
+    else:
+        save_records(file_path, output)
+    return file_path
+
+
+def find_output(file_path):
+    """
+    The newest of file_path and the same result written in other formats (ip/<name>.json, ip/<name>.uied, ...),
+    so a stale file left by an earlier run in another format is not picked over a fresh one
+    """
+    stem = os.path.splitext(file_path)[0]
+    candidates = [file_path] + [stem + suffix for suffix in dict.fromkeys(OUTPUT_SUFFIXES.values())]
+    existing = [candidate for candidate in dict.fromkeys(candidates) if os.path.exists(candidate)]
+    if not existing:
+        raise FileNotFoundError(file_path)
+    return max(existing, key=os.path.getmtime)
+
+
+def load_output(file_path):
+    """Read an ip/ocr/merge result in any output format into the dict the json format holds"""
+    file_path = find_output(str(file_path))
+    with open(file_path, 'rb') as f_in:
+        head = f_in.read(len(RECORDS_MAGIC))
+        if head == RECORDS_MAGIC:
+            data = None
+        else:
+            data = head + f_in.read()
 
-    json.dump(output, f_out, indent=4)
+    if data is None:
+        header, arrays = load_records(file_path)
+        return records_to_output(header['kind'], arrays['rows'], arrays.get('children'), header['img_shape'])
+    if data.lstrip()[:1] in (b'{', b'['):
+        try:
+            import orjson
+            return orjson.loads(data)
+        except ImportError:
+            return json.loads(data)
+    import msgpack
+    return msgpack.unpackb(data, raw=False)
 
 
 def save_clipping(org, output_root, corners, compo_classes, compo_index):
@@ -6,23 +6,12 @@ C = Config()
 
 def read_img(path, resize_height=None, kernel_size=None):
 
-    def resize_by_height(org):
-        w_h_ratio = org.shape[1] / org.shape[0]
-        resize_w = resize_height * w_h_ratio
-        re = cv2.resize(org, (int(resize_w), int(resize_height)))
-        return re
-
     try:
         img = cv2.imread(path)
-        if kernel_size is not None:
-            img = cv2.medianBlur(img, kernel_size)
         if img is None:
             print("*** Image does not exist ***")
             return None, None
-        if resize_height is not None:
-            img = resize_by_height(img)
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        return img, gray
+        return prepare_img(img, resize_height, kernel_size)
 
     except Exception as e:
         print(e)
@@ -30,6 +19,26 @@ def read_img(path, resize_height=None, kernel_size=None):
         return None, None
 
 
+def prepare_img(img, resize_height=None, kernel_size=None):
+    """
+    Same as read_img for an already decoded BGR array (the caller's buffer is not modified)
+    :return: (resized BGR image, grey image)
+    """
+
+    def resize_by_height(org):
+        w_h_ratio = org.shape[1] / org.shape[0]
+        resize_w = resize_height * w_h_ratio
+        re = cv2.resize(org, (int(resize_w), int(resize_height)))
+        return re
+
+    if kernel_size is not None:
+        img = cv2.medianBlur(img, kernel_size)
+    if resize_height is not None:
+        img = resize_by_height(img)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return img, gray
+
+
 def gray_to_gradient(img):
     if len(img.shape) == 3:
         img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
@@ -7,6 +7,7 @@ import time
 import shutil
 
 from detect_merge.Element import Element
+import detect_compo.lib_ip.file_utils as file
 
 
 def show_elements(org_img, eles, show=False, win_name='element', wait_key=0, shown_resize=None, line=2):
@@ -26,13 +27,13 @@ def show_elements(org_img, eles, show=False, win_name='element', wait_key=0, sho
     return img_resize
 
 
-def save_elements(output_file, elements, img_shape):
+def save_elements(output_file, elements, img_shape, output_format=None):
     components = {'compos': [], 'img_shape': img_shape}
     for i, ele in enumerate(elements):
         c = ele.wrap_info()
         # c['id'] = i
         components['compos'].append(c)
-    json.dump(components, open(output_file, 'w'), indent=4)
+    file.save_output(output_file, components, output_format)
     return components
 
 
@@ -189,9 +190,10 @@ def compos_clip_and_fill(clip_root, org, compos):
     cv2.imwrite(pjoin(clip_root, 'bkg.png'), bkg)
 
 
-def merge(img_path, compo_path, text_path, merge_root=None, is_paragraph=False, is_remove_bar=True, show=False, wait_key=0):
-    compo_json = json.load(open(compo_path, 'r'))
-    text_json = json.load(open(text_path, 'r'))
+def merge(img_path, compo_path, text_path, merge_root=None, is_paragraph=False, is_remove_bar=True, show=False, wait_key=0, img=None, output_format=None):
+    # either result file may be in any file_utils output format
+    compo_json = file.load_output(compo_path)
+    text_json = file.load_output(text_path)
 
     # load text and non-text compo
     ele_id = 0
@@ -211,7 +213,8 @@ def merge(img_path, compo_path, text_path, merge_root=None, is_paragraph=False,
             text.resize(resize_ratio)
 
     # check the original detected elements
-    img = cv2.imread(img_path)
+    if img is None:
+        img = cv2.imread(img_path)
     img_resize = cv2.resize(img, (compo_json['img_shape'][1], compo_json['img_shape'][0]))
     show_elements(img_resize, texts + compos, show=show, win_name='all elements before merging', wait_key=wait_key)
 
@@ -229,7 +232,7 @@ def merge(img_path, compo_path, text_path, merge_root=None, is_paragraph=False,
 
     # save all merged elements, clips and blank background
     name = img_path.replace('\\', '/').split('/')[-1][:-4]
-    components = save_elements(pjoin(merge_root, name + '.json'), elements, img_resize.shape)
+    components = save_elements(pjoin(merge_root, name + '.json'), elements, img_resize.shape, output_format)
     cv2.imwrite(pjoin(merge_root, name + '.jpg'), board)
     print('[Merge Completed] Input: %s Output: %s' % (img_path, pjoin(merge_root, name + '.jpg')))
     return board, components
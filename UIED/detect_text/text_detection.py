@@ -1,5 +1,6 @@
 import detect_text.ocr as ocr
 from detect_text.Text import Text
+import detect_compo.lib_ip.file_utils as file
 import numpy as np
 import cv2
 import json
@@ -8,8 +9,7 @@ import os
 from os.path import join as pjoin
 
 
-def save_detection_json(file_path, texts, img_shape):
-    f_out = open(file_path, 'w')
+def save_detection_json(file_path, texts, img_shape, output_format=None):
     output = {'img_shape': img_shape, 'texts': []}
     for text in texts:
         c = {'id': text.id, 'content': text.content}
@@ -18,7 +18,7 @@ def save_detection_json(file_path, texts, img_shape):
         c['width'] = text.width
         c['height'] = text.height
         output['texts'].append(c)
-    json.dump(output, f_out, indent=4)
+    return file.save_output(file_path, output, output_format)
 
 
 def visualize_texts(org_img, texts, shown_resize_height=None, show=False, write_path=None):
@@ -139,15 +139,18 @@ def text_filter_noise(texts):
     return valid_texts
 
 
-def text_detection(input_file='../data/input/30800.jpg', output_file='../data/output', show=False, method='paddle', paddle_model=None):
+def text_detection(input_file='../data/input/30800.jpg', output_file='../data/output', show=False, method='paddle', paddle_model=None, input_img=None, output_format=None):
     '''
     :param method: google or paddle
     :param paddle_model: the preload paddle model for paddle ocr
+    :param input_img: the already decoded BGR image of input_file, to avoid reading it again
+    :param output_format: format of ocr/<name> (file_utils.OUTPUT_FORMATS), default json
+    :return: path of the saved result
     '''
     start = time.perf_counter()
     name = input_file.split('/')[-1][:-4]
     ocr_root = pjoin(output_file, 'ocr')
-    img = cv2.imread(input_file)
+    img = input_img if input_img is not None else cv2.imread(input_file)
 
     if method == 'google':
         print('*** Detect Text through Google OCR ***')
@@ -162,14 +165,15 @@ def text_detection(input_file='../data/input/30800.jpg', output_file='../data/ou
         print('*** Detect Text through Paddle OCR ***')
         if paddle_model is None:
             paddle_model = PaddleOCR(use_angle_cls=True, lang="ch")
-        result = paddle_model.ocr(input_file)
+        result = paddle_model.ocr(img)
         texts = text_cvt_orc_format_paddle(result)
     else:
         raise ValueError('Method has to be "google" or "paddle"')
 
     visualize_texts(img, texts, shown_resize_height=800, show=show, write_path=pjoin(ocr_root, name+'.png'))
-    save_detection_json(pjoin(ocr_root, name+'.json'), texts, img.shape)
-    print("[Text Detection Completed in %.3f s] Input: %s Output: %s" % (time.perf_counter() - start, input_file, pjoin(ocr_root, name+'.json')))
+    result_path = save_detection_json(pjoin(ocr_root, name+'.json'), texts, img.shape, output_format)
+    print("[Text Detection Completed in %.3f s] Input: %s Output: %s" % (time.perf_counter() - start, input_file, result_path))
+    return result_path
 
 
 # text_detection()
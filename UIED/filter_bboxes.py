@@ -4,6 +4,8 @@ import json
 import argparse
 from pathlib import Path
 
+from detect_compo.lib_ip.file_utils import load_output
+
 
 def filter_contained_bboxes(bboxes):
     """
@@ -69,16 +71,15 @@ def main():
         return
 
     print(f"Reading bounding boxes from: {args.input_file}")
-    with open(args.input_file, 'r') as f:
-        # The JSON format from compo_detection is a dictionary with a 'compos' key.
-        data = json.load(f)
-        if isinstance(data, dict) and 'compos' in data:
-            initial_bboxes = data['compos']
-        elif isinstance(data, list):
-            initial_bboxes = data
-        else:
-            print(f"Error: Unexpected JSON format in {args.input_file}")
-            return
+    # The result of compo_detection is a dictionary with a 'compos' key, in any UIED output format.
+    data = load_output(args.input_file)
+    if isinstance(data, dict) and 'compos' in data:
+        initial_bboxes = data['compos']
+    elif isinstance(data, list):
+        initial_bboxes = data
+    else:
+        print(f"Error: Unexpected JSON format in {args.input_file}")
+        return
 
     print(f"Found {len(initial_bboxes)} bounding boxes.")
 
@@ -0,0 +1,172 @@
+"""
+Content-addressed store for intermediate pipeline artifacts.
+
+Artifacts of one screenshot live under <root>/<content key>/, where the key is a
+hash of the decoded pixels, so runs on different screenshots never share a
+directory even when the files are named alike, and a repeated run on the same
+screenshot finds what an earlier one produced. Stage outputs are named after the
+stage and a digest of its parameters (`artifact_name`).
+
+- tables: NumPy record arrays in .npy files, opened memory-mapped (no JSON parsing)
+- crops: encoded images concatenated in one .pack file with an .idx.npy offset table
+- json: small metadata / debugging output
+
+Every file is written to a temporary name and renamed into place; an artifact's
+.meta.json is written last and marks it complete. Artifact names are derived from
+their inputs, so concurrent writers of one name write identical content, and
+readers never see a partial file.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple, Union
+
+import numpy as np
+
+DEFAULT_ARTIFACT_ROOT = Path(__file__).resolve().parent / "data" / "artifacts"
+
+PACK_INDEX_DTYPE = np.dtype([("id", "U64"), ("offset", "<i8"), ("length", "<i8")])
+
+
+def atomic_write(path, data: Union[bytes, str, Any]):
+    """Write bytes/str, or call data(file) to write, then rename into place"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if isinstance(data, str):
+                f.write(data.encode("utf-8"))
+            elif isinstance(data, (bytes, bytearray, memoryview)):
+                f.write(data)
+            else:
+                data(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return path
+
+
+def digest(data: Union[bytes, memoryview, str], size: int = 16) -> str:
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.blake2b(data, digest_size=size).hexdigest()
+
+
+def content_key(image) -> str:
+    """Hash of an ImageHandle's decoded pixels (mode and shape included)"""
+    base = np.ascontiguousarray(image.base)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{image.mode}:{base.shape}:{base.dtype.str}".encode())
+    h.update(memoryview(base).cast("B"))
+    return h.hexdigest()
+
+
+def artifact_name(stage: str, params: Any = None) -> str:
+    """'<stage>-<digest of params>' so outputs of different settings do not mix"""
+    if params is None:
+        return stage
+    return f"{stage}-{digest(json.dumps(params, sort_keys=True, default=str), 6)}"
+
+
+class ArtifactStore:
+    """Artifacts of one screenshot under root/key"""
+
+    def __init__(self, key: str, root=DEFAULT_ARTIFACT_ROOT):
+        self.key = key
+        self.root = Path(root)
+        self.dir = self.root / key
+
+    @classmethod
+    def for_image(cls, image, root=DEFAULT_ARTIFACT_ROOT) -> "ArtifactStore":
+        return cls(content_key(image), root)
+
+    def path(self, name: str, suffix: str) -> Path:
+        return self.dir / f"{name}{suffix}"
+
+    def has(self, name: str) -> bool:
+        return self.path(name, ".meta.json").exists()
+
+    def meta(self, name: str) -> Dict[str, Any]:
+        return json.loads(self.path(name, ".meta.json").read_text())
+
+    def _commit(self, name: str, kind: str, **meta):
+        atomic_write(self.path(name, ".meta.json"), json.dumps({"kind": kind, **meta}))
+
+    # json
+
+    def put_json(self, name: str, obj: Any):
+        atomic_write(self.path(name, ".json"), json.dumps(obj, ensure_ascii=False))
+        self._commit(name, "json")
+
+    def get_json(self, name: str) -> Any:
+        return json.loads(self.path(name, ".json").read_text())
+
+    # tables
+
+    def put_table(self, name: str, records: np.ndarray, **meta):
+        """Store a (record) array; `meta` must be JSON-serializable"""
+        atomic_write(self.path(name, ".npy"), lambda f: np.save(f, np.ascontiguousarray(records), allow_pickle=False))
+        self._commit(name, "table", rows=int(len(records)), **meta)
+
+    def get_table(self, name: str, mmap: bool = True) -> Tuple[np.ndarray, Dict[str, Any]]:
+        """(array, meta); the array is a read-only memory map unless mmap=False"""
+        meta = self.meta(name)
+        records = np.load(self.path(name, ".npy"), mmap_mode="r" if mmap else None, allow_pickle=False)
+        return records, meta
+
+    # crop packs
+
+    def put_pack(self, name: str, blobs: Dict[str, bytes], **meta):
+        """Concatenate encoded blobs into one pack file with an (id, offset, length) index"""
+        index = np.zeros(len(blobs), dtype=PACK_INDEX_DTYPE)
+        offset = 0
+        for i, (blob_id, blob) in enumerate(blobs.items()):
+            index[i] = (blob_id, offset, len(blob))
+            offset += len(blob)
+
+        def write_pack(f):
+            for blob in blobs.values():
+                f.write(blob)
+
+        atomic_write(self.path(name, ".pack"), write_pack)
+        atomic_write(self.path(name, ".idx.npy"), lambda f: np.save(f, index, allow_pickle=False))
+        self._commit(name, "pack", count=len(blobs), size=offset, **meta)
+
+    def iter_pack(self, name: str) -> Iterator[Tuple[str, memoryview]]:
+        """(id, bytes) for every blob, sliced from a memory map of the pack"""
+        index = np.load(self.path(name, ".idx.npy"), allow_pickle=False)
+        if not len(index):
+            return
+        pack = np.memmap(self.path(name, ".pack"), dtype=np.uint8, mode="r")
+        for blob_id, offset, length in index.tolist():
+            yield blob_id, memoryview(pack[offset:offset + length])
+
+    def get_blob(self, name: str, blob_id: str) -> Optional[bytes]:
+        index = np.load(self.path(name, ".idx.npy"), allow_pickle=False)
+        rows = np.flatnonzero(index["id"] == blob_id)
+        if not len(rows):
+            return None
+        _, offset, length = index[rows[0]].tolist()
+        with open(self.path(name, ".pack"), "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def extract_pack(self, name: str, dest_dir, suffix: str = "") -> int:
+        """Write every blob to dest_dir/<id><suffix>; returns the count"""
+        dest_dir = Path(dest_dir)
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        count = 0
+        for blob_id, blob in self.iter_pack(name):
+            (dest_dir / f"{blob_id}{suffix}").write_bytes(blob)
+            count += 1
+        return count
@@ -1,7 +1,9 @@
 import os
 import cv2
 import json
-from utils import Doubao, Qwen, GPT, Gemini, encode_image, image_mask
+from utils import Doubao, Qwen, GPT, Gemini, encode_image, encoding_policy_for, image_mask
+from llm_cache import ResponseCache
+from image_handle import ImageHandle, image_name
 
 DEFAULT_IMAGE_PATH = "data/input/test1.png"
 DEFAULT_API_PATH = "doubao_api.txt"  # Change the API key path for different models (i.e. doubao, qwen, gpt, gemini).
@@ -91,67 +93,66 @@ def resolve_containment(bboxes: dict[str, tuple[int, int, int, int]]) -> dict[st
 #     box2_area = (x4 - x3) * (y4 - y3)
 #     return intersection_area / (box1_area + box2_area - intersection_area)
 
+def parse_bbox_line(line: str):
+    """Parse one '<label>: <bbox>x1 y1 x2 y2</bbox>' line; returns (name, bbox) or None"""
+    component = line.strip()
+    if not component:
+        return None
+        
+    if ':' in component:
+        name, bbox_str = component.split(':', 1)
+    else:
+        bbox_str = component
+        if 'sidebar' in component.lower():
+            name = 'sidebar'
+        elif 'header' in component.lower():
+            name = 'header'
+        elif 'navigation' in component.lower():
+            name = 'navigation'
+        elif 'main content' in component.lower():
+            name = 'main content'
+        else:
+            name = 'unknown'
+    
+    name = name.strip().lower()
+    bbox_str = bbox_str.strip()
+    
+    if BBOX_TAG_START in bbox_str and BBOX_TAG_END in bbox_str:
+        start_idx = bbox_str.find(BBOX_TAG_START) + len(BBOX_TAG_START)
+        end_idx = bbox_str.find(BBOX_TAG_END)
+        coords_str = bbox_str[start_idx:end_idx].strip()
+        
+        try:
+            norm_coords = list(map(int, coords_str.split()))
+            if len(norm_coords) == 4:
+                return name, tuple(norm_coords)
+            print(f"Invalid number of coordinates for {name}: {norm_coords}")
+        except ValueError as e:
+            print(f"Failed to parse coordinates for {name}: {e}")
+    else:
+        print(f"No bbox tags found in: {bbox_str}")
+    return None
+
 # simple version of bbox parsing
-def parse_bboxes(bbox_input: str, image_path: str) -> dict[str, tuple[int, int, int, int]]:
-    """Parse bounding box string to dictionary of named coordinate tuples"""
+def parse_bboxes(bbox_input: str, image_path) -> dict[str, tuple[int, int, int, int]]:
+    """Parse bounding box string to dictionary of named coordinate tuples (image_path may be an ImageHandle)"""
     bboxes = {}
     # print("Raw bbox input:", bbox_input) # Debug print
 
-    image = cv2.imread(image_path)
-    if image is None:
+    try:
+        image = ImageHandle.coerce(image_path)
+    except ValueError:
         print(f"Error: Failed to read image {image_path}")
         return bboxes
-    h, w = image.shape[:2]
+    w, h = image.size
     
     try:
-        components = bbox_input.strip().split('\n')
-        # print("Split components:", components)  # Debug print
-        
-        for component in components:
-            component = component.strip()
-            if not component:
-                continue
-                
-            if ':' in component:
-                name, bbox_str = component.split(':', 1)
-            else:
-                bbox_str = component
-                if 'sidebar' in component.lower():
-                    name = 'sidebar'
-                elif 'header' in component.lower():
-                    name = 'header'
-                elif 'navigation' in component.lower():
-                    name = 'navigation'
-                elif 'main content' in component.lower():
-                    name = 'main content'
-                else:
-                    name = 'unknown'
-            
-            name = name.strip().lower()
-            bbox_str = bbox_str.strip()
-            
-            # print(f"Processing component: {name}, bbox_str: {bbox_str}")  # Debug print
-            
-            if BBOX_TAG_START in bbox_str and BBOX_TAG_END in bbox_str:
-                start_idx = bbox_str.find(BBOX_TAG_START) + len(BBOX_TAG_START)
-                end_idx = bbox_str.find(BBOX_TAG_END)
-                coords_str = bbox_str[start_idx:end_idx].strip()
-                
-                try:
-                    norm_coords = list(map(int, coords_str.split()))
-                    if len(norm_coords) == 4:
-                        x_min = int(norm_coords[0])
-                        y_min = int(norm_coords[1])
-                        x_max = int(norm_coords[2])
-                        y_max = int(norm_coords[3])
-                        bboxes[name] = (x_min, y_min, x_max, y_max)
-                        print(f"Successfully parsed {name}: {bboxes[name]}")
-                    else:
-                        print(f"Invalid number of coordinates for {name}: {norm_coords}")
-                except ValueError as e:
-                    print(f"Failed to parse coordinates for {name}: {e}")
-            else:
-                print(f"No bbox tags found in: {bbox_str}")
+        for component in bbox_input.strip().split('\n'):
+            parsed = parse_bbox_line(component)
+            if parsed is not None:
+                name, bbox = parsed
+                bboxes[name] = bbox
+                print(f"Successfully parsed {name}: {bboxes[name]}")
                 
     except Exception as e:
         print(f"Coordinate parsing failed: {str(e)}")
@@ -161,10 +162,54 @@ def parse_bboxes(bbox_input: str, image_path: str) -> dict[str, tuple[int, int,
     print("Final parsed bboxes:", bboxes)
     return bboxes
 
-def draw_bboxes(image_path: str, bboxes: dict[str, tuple[int, int, int, int]]) -> str:
-    """Draw bounding boxes on image and save with different colors for each component"""
-    image = cv2.imread(image_path)
-    if image is None:
+class BBoxStreamParser:
+    """
+    Incremental version of parse_bboxes for streamed answers.
+    `feed` takes text chunks and returns the (name, bbox) pairs whose line just completed,
+    so downstream work on a region can start before the rest of the answer arrives.
+    Later lines for an already emitted name override it in `bboxes`, as in parse_bboxes.
+    """
+
+    def __init__(self):
+        self.bboxes = {}
+        self._buffer = ""
+
+    def feed(self, chunk: str) -> list:
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split('\n')
+        return self._parse(lines)
+
+    def close(self) -> list:
+        lines, self._buffer = [self._buffer], ""
+        return self._parse(lines)
+
+    def _parse(self, lines) -> list:
+        completed = []
+        for line in lines:
+            # thinking models stream a long preamble first; skip it without logging every line
+            if BBOX_TAG_START not in line:
+                continue
+            parsed = parse_bbox_line(line)
+            if parsed is not None:
+                name, bbox = parsed
+                self.bboxes[name] = bbox
+                completed.append(parsed)
+        return completed
+
+async def stream_bboxes(client, prompt: str, image_encoding: str):
+    """Ask for the layout with a streaming request and yield (name, bbox) as each line completes"""
+    parser = BBoxStreamParser()
+    async for chunk in client.ask_stream_async(prompt, image_encoding):
+        for parsed in parser.feed(chunk):
+            yield parsed
+    for parsed in parser.close():
+        yield parsed
+
+def draw_bboxes(image_path, bboxes: dict[str, tuple[int, int, int, int]], output_dir: str = "data/tmp") -> str:
+    """Draw bounding boxes on image and save with different colors for each component (image_path may be an ImageHandle)"""
+    try:
+        image = ImageHandle.coerce(image_path).bgr.copy()
+    except ValueError:
         print(f"Error: Failed to read image {image_path}")
         return ""    
     
@@ -191,13 +236,10 @@ def draw_bboxes(image_path: str, bboxes: dict[str, tuple[int, int, int, int]]) -
         cv2.putText(image, component, (x_min, y_min - 10),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.9, color, 2)
     
-    # Output directory
-    output_dir = "data/tmp"
     os.makedirs(output_dir, exist_ok=True)
     
     # Get the original filename without path
-    original_filename = os.path.basename(image_path)
-    output_path = os.path.join(output_dir, os.path.splitext(original_filename)[0] + "_with_bboxes.png")
+    output_path = os.path.join(output_dir, image_name(image_path) + "_with_bboxes.png")
     
     if cv2.imwrite(output_path, image):
         print(f"Successfully saved annotated image: {output_path}")
@@ -205,14 +247,11 @@ def draw_bboxes(image_path: str, bboxes: dict[str, tuple[int, int, int, int]]) -
     print("Error: Failed to save image")
     return ""
 
-def save_bboxes_to_json(bboxes: dict[str, tuple[int, int, int, int]], image_path: str) -> str:
+def save_bboxes_to_json(bboxes: dict[str, tuple[int, int, int, int]], image_path, output_dir: str = "data/tmp") -> str:
     """Save bounding boxes information to a JSON file"""
-    # Output directory
-    output_dir = "data/tmp"
     os.makedirs(output_dir, exist_ok=True)
     
-    original_filename = os.path.basename(image_path)
-    json_path = os.path.join(output_dir, os.path.splitext(original_filename)[0] + "_bboxes.json")
+    json_path = os.path.join(output_dir, image_name(image_path) + "_bboxes.json")
     
     bboxes_dict = {k: list(v) for k, v in bboxes.items()}
     
@@ -316,10 +355,22 @@ if __name__ == "__main__":
     print("=== Starting Simple Component Detection ===")
     print(f"Input image: {image_path}")
     print(f"API path: {api_path}")
-    client = Doubao(api_path) # Change your models according to your needs: Qwen(api_path), GPT(api_path), Gemini(api_path)
-    bbox_content = client.ask(PROMPT_MERGE, encode_image(image_path))
-    print(f"Model response: {bbox_content}\n")
-    bboxes = parse_bboxes(bbox_content, image_path)
+    # Decode once; the upload and the overlay both use this handle
+    image = ImageHandle.open(image_path)
+    cache = ResponseCache(disk_path="data/cache/llm_responses.sqlite")
+    client = Doubao(api_path, cache=cache) # Change your models according to your needs: Qwen(api_path), GPT(api_path), Gemini(api_path)
+    # Downscaling is safe here: the model answers in 0-1000 normalized coordinates
+    # Stream the answer and report each region as soon as its line completes
+    parser = BBoxStreamParser()
+    for chunk in client.ask_stream(PROMPT_MERGE, encode_image(image.to_pil(), encoding_policy_for(client.provider, "layout"))):
+        for name, bbox in parser.feed(chunk):
+            print(f"Region ready: {name} {bbox}")
+    for name, bbox in parser.close():
+        print(f"Region ready: {name} {bbox}")
+    bboxes = parser.bboxes
+    # Non-streaming alternative:
+    # bbox_content = client.ask(PROMPT_MERGE, encode_image(image_path, encoding_policy_for(client.provider, "layout")))
+    # bboxes = parse_bboxes(bbox_content, image_path)
 
     # print("=== Starting Sequential Component Detection ===")
     # print(f"Input image: {image_path}")
@@ -334,7 +385,7 @@ if __name__ == "__main__":
         print(f"Total components detected: {len(bboxes)}")
         
         json_path = save_bboxes_to_json(bboxes, image_path)
-        draw_bboxes(image_path, bboxes)
+        draw_bboxes(image, bboxes)
         
         print(f"\n=== Results ===")
         for component, bbox in bboxes.items():
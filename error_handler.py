@@ -3,11 +3,15 @@ ScreenCoder 错误处理和状态管理系统
 """
 
 import asyncio
+import functools
+import heapq
+import itertools
 import logging
 import traceback
+from collections import OrderedDict
 from enum import Enum
-from typing import Dict, Any, Optional, Callable
-from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Callable
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 import json
 
@@ -42,6 +46,8 @@ class TaskInfo:
     error_type: Optional[ErrorType] = None
     progress: float = 0.0
     result: Optional[Dict[str, Any]] = None
+    message: Optional[str] = None
+    metadata: Dict[str, Any] = field(default_factory=dict)
 
 class ScreenCoderError(Exception):
     """ScreenCoder 基础异常类"""
@@ -69,16 +75,33 @@ class ProcessingError(ScreenCoderError):
         self.stage = stage
 
 class TaskManager:
-    """任务管理器"""
-    
-    def __init__(self, max_concurrent_tasks: int = 3):
-        self.tasks: Dict[str, TaskInfo] = {}
+    """
+    任务管理器：按优先级排队的任务调度器
+
+    - 超过 max_concurrent_tasks 的任务排队等待名额，而不是直接拒绝；
+      名额按优先级（数值越小越先）、同优先级先来先得的顺序分配
+    - 已结束的任务超过 finished_ttl 秒或超过 max_finished_tasks 个时自动淘汰（最久未访问的先淘汰）
+    - 任务可以通过 report_progress / progress_callback 上报 0-1 的进度
+    - 订阅者用 subscribe 异步迭代状态和进度事件，不需要轮询
+    """
+
+    FINISHED = (TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED)
+
+    def __init__(self, max_concurrent_tasks: int = 3, max_finished_tasks: int = 256,
+                 finished_ttl: float = 3600):
+        self.tasks: "OrderedDict[str, TaskInfo]" = OrderedDict()
         self.max_concurrent_tasks = max_concurrent_tasks
+        self.max_finished_tasks = max_finished_tasks
+        self.finished_ttl = finished_ttl
         self.running_tasks: Dict[str, asyncio.Task] = {}
         self.task_counter = 0
-        self._lock = asyncio.Lock()
+        self._active = 0
+        self._waiting: List[tuple] = []  # (priority, seq, task_id, future) 小根堆
+        self._seq = itertools.count()
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
     
-    def create_task(self, task_id: Optional[str] = None) -> str:
+    def create_task(self, task_id: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None) -> str:
         """创建新任务"""
         if not task_id:
             self.task_counter += 1
@@ -87,86 +110,234 @@ class TaskManager:
         self.tasks[task_id] = TaskInfo(
             task_id=task_id,
             status=TaskStatus.PENDING,
-            created_at=datetime.now()
+            created_at=datetime.now(),
+            metadata=dict(metadata or {})
         )
+        self._evict_finished()
         
         logger.info(f"Created task: {task_id}")
         return task_id
     
-    async def start_task(self, task_id: str, coro, timeout: Optional[int] = None):
-        """启动任务"""
-        async with self._lock:
-            if task_id not in self.tasks:
-                raise ValueError(f"Task {task_id} not found")
-            
-            if len(self.running_tasks) >= self.max_concurrent_tasks:
-                raise RuntimeError("Too many concurrent tasks")
-            
-            task_info = self.tasks[task_id]
-            task_info.status = TaskStatus.RUNNING
-            task_info.started_at = datetime.now()
-            
-            # 创建异步任务
-            async_task = asyncio.create_task(self._run_task_with_timeout(task_id, coro, timeout))
-            self.running_tasks[task_id] = async_task
-            
-            logger.info(f"Started task: {task_id}")
-            return async_task
+    async def start_task(self, task_id: str, coro, timeout: Optional[float] = None, priority: int = 5) -> asyncio.Task:
+        """启动任务：立即返回 asyncio.Task，任务在拿到名额后才开始执行"""
+        if task_id not in self.tasks:
+            raise ValueError(f"Task {task_id} not found")
+        
+        self._loop = asyncio.get_running_loop()
+        admission = self._admit(priority, task_id)
+        async_task = asyncio.create_task(self._run_task_with_timeout(task_id, coro, timeout, admission))
+        async_task.add_done_callback(functools.partial(self._task_done, task_id, coro, admission))
+        self.running_tasks[task_id] = async_task
+        
+        logger.info(f"Queued task: {task_id} (priority {priority})")
+        return async_task
     
-    async def _run_task_with_timeout(self, task_id: str, coro, timeout: Optional[int]):
-        """运行带超时的任务"""
+    def _admit(self, priority: int, task_id: str) -> Optional[asyncio.Future]:
+        """占用一个并发名额；没有空闲名额时进入等待堆，返回拿到名额时完成的 future"""
+        if self._active < self.max_concurrent_tasks and not self.pending_count():
+            self._active += 1
+            return None
+        
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._seq), task_id, future))
+        return future
+    
+    def _task_done(self, task_id: str, coro, admission: Optional[asyncio.Future], async_task: asyncio.Task):
+        """
+        任务结束后的清理：归还名额（还在排队的直接出队）、关闭协程、淘汰已结束任务。
+        在第一次调度前就被取消的任务不会进入 _run_task_with_timeout，所以放在完成回调里做
+        """
+        if admission is None or (admission.done() and not admission.cancelled()):
+            self._release()
+        else:
+            admission.cancel()
+        coro.close()  # 从未开始执行的协程需要显式关闭，否则会报 "never awaited"
+        if async_task.cancelled():
+            self._cancelled_task(task_id)
+        self.running_tasks.pop(task_id, None)
+        self._evict_finished()
+        # 后台任务的异常记录在 TaskInfo 中，这里取走异常，避免 "exception was never retrieved"
+        async_task.cancelled() or async_task.exception()
+    
+    def _release(self):
+        """归还名额：直接交给排在最前面的等待者"""
+        while self._waiting:
+            future = heapq.heappop(self._waiting)[3]
+            if not future.done():
+                future.set_result(None)
+                return
+        self._active -= 1
+    
+    async def _run_task_with_timeout(self, task_id: str, coro, timeout: Optional[float],
+                                     admission: Optional[asyncio.Future] = None):
+        """排队等待名额，然后运行带超时的任务；名额和协程由 _task_done 清理"""
         try:
+            if admission is not None:
+                await admission
+            
+            task_info = self.tasks.get(task_id)
+            if task_info is not None:
+                task_info.status = TaskStatus.RUNNING
+                task_info.started_at = datetime.now()
+                self._publish(task_info)
+            logger.info(f"Started task: {task_id}")
+            
             if timeout:
                 result = await asyncio.wait_for(coro, timeout=timeout)
             else:
                 result = await coro
             
-            await self._complete_task(task_id, result)
+            self._complete_task(task_id, result)
             return result
             
         except asyncio.TimeoutError:
-            await self._fail_task(task_id, "Task timeout", ErrorType.TIMEOUT_ERROR)
+            self._fail_task(task_id, "Task timeout", ErrorType.TIMEOUT_ERROR)
             raise ScreenCoderError("Task timeout", ErrorType.TIMEOUT_ERROR)
+        except asyncio.CancelledError:
+            self._cancelled_task(task_id)
+            raise
         except Exception as e:
-            await self._fail_task(task_id, str(e), self._get_error_type(e))
+            self._fail_task(task_id, str(e), self._get_error_type(e))
             raise
-        finally:
-            async with self._lock:
-                if task_id in self.running_tasks:
-                    del self.running_tasks[task_id]
     
-    async def _complete_task(self, task_id: str, result: Any):
+    def _complete_task(self, task_id: str, result: Any):
         """完成任务"""
-        async with self._lock:
-            if task_id in self.tasks:
-                task_info = self.tasks[task_id]
-                task_info.status = TaskStatus.COMPLETED
-                task_info.completed_at = datetime.now()
-                task_info.progress = 1.0
-                task_info.result = result
-                
-                logger.info(f"Completed task: {task_id}")
+        if task_id in self.tasks:
+            task_info = self.tasks[task_id]
+            task_info.status = TaskStatus.COMPLETED
+            task_info.completed_at = datetime.now()
+            task_info.progress = 1.0
+            task_info.result = result
+            self._publish(task_info)
+            
+            logger.info(f"Completed task: {task_id}")
     
-    async def _fail_task(self, task_id: str, error_message: str, error_type: ErrorType):
+    def _fail_task(self, task_id: str, error_message: str, error_type: ErrorType):
         """任务失败"""
-        async with self._lock:
-            if task_id in self.tasks:
-                task_info = self.tasks[task_id]
-                task_info.status = TaskStatus.FAILED
-                task_info.completed_at = datetime.now()
-                task_info.error_message = error_message
-                task_info.error_type = error_type
-                
-                logger.error(f"Failed task {task_id}: {error_message}")
+        if task_id in self.tasks:
+            task_info = self.tasks[task_id]
+            task_info.status = TaskStatus.FAILED
+            task_info.completed_at = datetime.now()
+            task_info.error_message = error_message
+            task_info.error_type = error_type
+            self._publish(task_info)
+            
+            logger.error(f"Failed task {task_id}: {error_message}")
+    
+    def _cancelled_task(self, task_id: str):
+        """任务被取消"""
+        if task_id in self.tasks:
+            task_info = self.tasks[task_id]
+            task_info.status = TaskStatus.CANCELLED
+            task_info.completed_at = task_info.completed_at or datetime.now()
+            self._publish(task_info)
+    
+    def report_progress(self, task_id: str, fraction: float, message: Optional[str] = None):
+        """上报 0-1 之间的进度和可选的说明；可以在工作线程中调用"""
+        try:
+            in_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            in_loop = False
+        if not in_loop and self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self.report_progress, task_id, fraction, message)
+            return
+        
+        task_info = self.tasks.get(task_id)
+        if task_info is None or task_info.status in self.FINISHED:
+            return
+        task_info.progress = min(1.0, max(0.0, float(fraction)))
+        if message is not None:
+            task_info.message = message
+        self._publish(task_info)
+    
+    def progress_callback(self, task_id: str) -> Callable[..., None]:
+        """返回 callback(fraction, message=None)，交给各个阶段上报进度"""
+        return functools.partial(self.report_progress, task_id)
+    
+    def _event(self, task_info: TaskInfo) -> Dict[str, Any]:
+        return {
+            "task_id": task_info.task_id,
+            "status": task_info.status.value,
+            "progress": task_info.progress,
+            "message": task_info.message,
+            "time": datetime.now().isoformat()
+        }
+    
+    def _publish(self, task_info: TaskInfo):
+        """把状态/进度事件推给订阅者；订阅者处理不过来时丢弃最旧的事件"""
+        event = self._event(task_info)
+        for queue in self._subscribers.get(task_info.task_id, []):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+    
+    async def subscribe(self, task_id: str):
+        """
+        异步迭代任务事件：先给出当前状态，之后每次状态或进度变化给出一个事件，任务结束后停止
+
+            async for event in task_manager.subscribe(task_id):
+                print(event["status"], event["progress"], event["message"])
+        """
+        task_info = self.get_task_status(task_id)
+        if task_info is None:
+            raise ValueError(f"Task {task_id} not found")
+        
+        queue: asyncio.Queue = asyncio.Queue(maxsize=100)
+        self._subscribers.setdefault(task_id, []).append(queue)
+        try:
+            event = self._event(task_info)
+            while True:
+                yield event
+                if event["status"] in {status.value for status in self.FINISHED}:
+                    return
+                event = await queue.get()
+        finally:
+            queues = self._subscribers.get(task_id, [])
+            if queue in queues:
+                queues.remove(queue)
+            if not queues:
+                self._subscribers.pop(task_id, None)
+    
+    async def wait(self, task_id: str, timeout: Optional[float] = None) -> TaskInfo:
+        """等待任务结束（最多 timeout 秒）；超时不抛异常，返回的状态仍为 pending/running"""
+        task_info = self.get_task_status(task_id)
+        if task_info is None:
+            raise ValueError(f"Task {task_id} not found")
+        async_task = self.running_tasks.get(task_id)
+        if async_task is not None:
+            await asyncio.wait({async_task}, timeout=timeout)
+        return task_info
+    
+    def pending_count(self) -> int:
+        """在等待堆中排队、还没拿到名额的任务数"""
+        return sum(1 for entry in self._waiting if not entry[3].done())
+    
+    def running_count(self) -> int:
+        """占用名额的任务数"""
+        return self._active
+    
+    def queue_position(self, task_id: str) -> Optional[int]:
+        """排队位置（从 1 开始）；不在排队时返回 None"""
+        waiting = sorted(entry[:3] for entry in self._waiting if not entry[3].done())
+        for position, (_, _, waiting_id) in enumerate(waiting, 1):
+            if waiting_id == task_id:
+                return position
+        return None
     
     def get_task_status(self, task_id: str) -> Optional[TaskInfo]:
         """获取任务状态"""
-        return self.tasks.get(task_id)
+        task_info = self.tasks.get(task_id)
+        if task_info is not None:
+            self.tasks.move_to_end(task_id)
+        return task_info
     
     def cancel_task(self, task_id: str) -> bool:
-        """取消任务"""
+        """取消排队中或运行中的任务"""
         if task_id in self.running_tasks:
             self.running_tasks[task_id].cancel()
+            for entry in self._waiting:
+                if entry[2] == task_id:
+                    entry[3].cancel()  # 立即让出排队位置
             
             if task_id in self.tasks:
                 self.tasks[task_id].status = TaskStatus.CANCELLED
@@ -177,13 +348,32 @@ class TaskManager:
         
         return False
     
+    async def shutdown(self):
+        """取消所有未结束的任务并等待它们退出"""
+        pending = list(self.running_tasks.values())
+        for task_id in list(self.running_tasks):
+            self.cancel_task(task_id)
+        await asyncio.gather(*pending, return_exceptions=True)
+    
+    def _evict_finished(self):
+        """淘汰过期（TTL）的已结束任务，并把已结束任务的数量限制在 max_finished_tasks 内（LRU）"""
+        cutoff_time = datetime.now() - timedelta(seconds=self.finished_ttl)
+        finished = [task_id for task_id, task_info in self.tasks.items()
+                    if task_info.status in self.FINISHED and task_id not in self.running_tasks]
+        expired = [task_id for task_id in finished if self.tasks[task_id].completed_at
+                   and self.tasks[task_id].completed_at < cutoff_time]
+        remaining = [task_id for task_id in finished if task_id not in expired]
+        for task_id in expired + remaining[:max(0, len(remaining) - self.max_finished_tasks)]:
+            del self.tasks[task_id]
+            logger.debug(f"Evicted finished task: {task_id}")
+    
     def cleanup_old_tasks(self, max_age_hours: int = 24):
         """清理旧任务"""
         cutoff_time = datetime.now() - timedelta(hours=max_age_hours)
         
         to_remove = []
         for task_id, task_info in self.tasks.items():
-            if task_info.created_at < cutoff_time and task_info.status in [TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED]:
+            if task_info.created_at < cutoff_time and task_info.status in self.FINISHED:
                 to_remove.append(task_id)
         
         for task_id in to_remove:
@@ -1,8 +1,11 @@
-from utils import encode_image, Doubao, Qwen, GPT, Gemini
+from utils import encode_image, encoding_policy_for, EncodingReport, Doubao, Qwen, GPT, Gemini
 from PIL import Image
+from image_handle import ImageHandle
 import bs4
-from threading import Thread
-import time
+import re
+import asyncio
+from llm_scheduler import RequestScheduler, ask_bot
+from llm_cache import ResponseCache, NearDuplicateCache, near_duplicate_context
 
 # user instruction for each component
 user_instruction = {
@@ -98,13 +101,31 @@ PROMPT_DICT = {
 #     Only return the code within the <div> and </div> tags."""
 # }
 
+# Batch prompt: several region crops in one request, one delimited answer section per region
+PROMPT_BATCH = """下面依次给出{count}张container的截图，每张截图对应页面中的一个区域。请分别为每张截图填写一段完整的HTML和tail-wind CSS代码以准确再现对应的容器。
+
+各类型区域的要求如下：
+{requirements}
+
+截图与区域的对应关系：
+{regions}
+
+请严格按照以下格式依次返回每个区域的代码，不要输出其他内容：
+<<<REGION 区域编号>>>
+<div>
+your code here
+</div>
+<<<END>>>"""
+
+BATCH_SECTION_RE = re.compile(r"<<<REGION\s+([^>\s]+)\s*>>>(.*?)<<<END>>>", re.S)
+
 # Support refining the generated code.
 # PROMPT_refinement = """Here is a prototype image of a webpage. I have an draft HTML file that contains most of the elements and their correct positions, but it has *inaccurate background*, and some missing or wrong elements. Please compare the draft and the prototype image, then revise the draft implementation. Return a single piece of accurate HTML+tail-wind CSS code to reproduce the website. Respond with the content of the HTML+tail-wind CSS code. The current implementation I have is: \n\n [CODE]"""
 
 # Generate code for each component
 def generate_code(bbox_tree, img_path, bot):
     """generate code for all the leaf nodes in the bounding box tree, return a dictionary: {'id': 'code'}"""
-    img = Image.open(img_path)
+    img = load_image(img_path)
     code_dict = {}
     
     def _generate_code(node):
@@ -143,126 +164,333 @@ def generate_code(bbox_tree, img_path, bot):
     _generate_code(bbox_tree)
     return code_dict
 
-# Generate code for each component in parallel
-def generate_code_parallel(bbox_tree, img_path, bot):
-    """generate code for all the leaf nodes in the bounding box tree, return a dictionary: {'id': 'code'}"""
+def collect_leaves(bbox_tree):
+    """leaf nodes of the bounding box tree, in document order"""
+    if not bbox_tree.get("children"):
+        return [bbox_tree]
+    leaves = []
+    for child in bbox_tree["children"]:
+        leaves.extend(collect_leaves(child))
+    return leaves
+
+def select_prompt(node):
+    """prompt for a leaf node, or None (with a placeholder comment) if its type is unusable"""
+    if "type" not in node:
+        print("Node type not found")
+        return None, f"<!-- Node type not found -->"
+    if node["type"] not in PROMPT_DICT:
+        print(f"Unknown component type: {node['type']}")
+        return None, f"<!-- Unknown component type: {node['type']} -->"
+    return PROMPT_DICT[node["type"]], None
+
+def load_image(image):
+    """decode the screenshot once; accepts a path, an ImageHandle or an already opened PIL image"""
+    if isinstance(image, ImageHandle):
+        return image.to_pil()
+    if isinstance(image, Image.Image):
+        image.load()
+        return image
+    with Image.open(image) as img:
+        img.load()
+        return img.copy()
+
+def build_batch_prompt(nodes):
+    """one prompt for several leaves; each region type's instructions appear once"""
+    requirements, regions = [], []
+    for region_type in dict.fromkeys(node["type"] for node in nodes):
+        instruction = PROMPT_DICT[region_type].split("以下是供填写的代码")[0]
+        requirements.append(f"- {region_type}：{instruction}")
+    for index, node in enumerate(nodes, 1):
+        regions.append(f"- 第{index}张截图：区域编号 {node['id']}，类型 {node['type']}")
+    return PROMPT_BATCH.format(count=len(nodes), requirements="\n".join(requirements),
+                               regions="\n".join(regions))
+
+def parse_batch_response(response, nodes):
+    """split a batch answer into {id: code}; None unless every region has a non-empty section"""
+    sections = {region_id: code.strip() for region_id, code in BATCH_SECTION_RE.findall(response or "")}
     code_dict = {}
-    t_list = []
-    
-    def _generate_code_with_retry(node, max_retries=3, retry_delay=2):
-        """Generate code with retry mechanism for rate limit errors"""
+    for node in nodes:
+        code = sections.get(str(node["id"]))
+        if not code:
+            return None
+        code_dict[node["id"]] = code
+    return code_dict
+
+def plan_batches(leaves, batch_size, max_crop_pixels):
+    """group small, promptable leaves into batches; everything else is requested alone"""
+    small, single = [], []
+    for node in leaves:
+        x1, y1, x2, y2 = node["bbox"]
+        if batch_size > 1 and node.get("type") in PROMPT_DICT and (x2 - x1) * (y2 - y1) <= max_crop_pixels:
+            small.append(node)
+        else:
+            single.append(node)
+    batches = [small[i:i + batch_size] for i in range(0, len(small), batch_size)]
+    # a batch of one is just a single request
+    single.extend(batch[0] for batch in batches if len(batch) == 1)
+    return [batch for batch in batches if len(batch) > 1], single
+
+# Crops up to this many pixels are small enough to share a batch request
+BATCH_MAX_CROP_PIXELS = 512 * 512
+
+# Generate code for each component concurrently, yielding results as they arrive
+async def aiter_generate_code(bbox_tree, image, bot, scheduler=None, deadline=None, near_duplicates=None,
+                              encoding_report=None, batch_size=1, max_batch_crop_pixels=BATCH_MAX_CROP_PIXELS):
+    """
+    generate code for all the leaf nodes and yield (node, code) in completion order.
+
+    The screenshot is decoded once and every region is cropped from memory. Requests go
+    through a RequestScheduler (per-provider concurrency cap, token bucket, jittered
+    backoff on 429/5xx); `deadline` is an absolute time.monotonic() timestamp for the page.
+    With a `near_duplicates` cache, crops that look like one seen before reuse its code.
+    Crops are compacted with the provider/region encoding policy before upload.
+    With `batch_size` > 1, up to that many crops of at most `max_batch_crop_pixels`
+    share one request; a batch whose answer cannot be split falls back to single requests.
+    """
+    img = load_image(image)
+    scheduler = scheduler or RequestScheduler()
+    provider = bot.provider or type(bot).__name__.lower()
+
+    async def _encode(node, cropped_img):
+        policy = encoding_policy_for(provider, node["type"])
+        return await asyncio.to_thread(encode_image, cropped_img, policy, encoding_report)
+
+    def _context(node):
+        # near-duplicate entries are only shared between identical provider/model/prompt
+        return near_duplicate_context(bot, select_prompt(node)[0] or "")
+
+    async def _generate(node):
+        prompt, fallback = select_prompt(node)
+        if prompt is None:
+            return [(node, fallback)]
         try:
-            # Create a new image instance for each thread
-            with Image.open(img_path) as img:
-                bbox = node["bbox"]
-                cropped_img = img.crop(bbox)
-
-                # Select prompt based on node type
-                if "type" in node:
-                    if node["type"] in PROMPT_DICT:
-                        prompt = PROMPT_DICT[node["type"]]
-                    else:
-                        print(f"Unknown component type: {node['type']}")
-                        code_dict[node["id"]] = f"<!-- Unknown component type: {node['type']} -->"
-                        return
-                else:
-                    print("Node type not found")
-                    code_dict[node["id"]] = f"<!-- Node type not found -->"
-                    return
-                
-                for attempt in range(max_retries):
-                    try:
-                        code = bot.ask(prompt, encode_image(cropped_img))
-                        code_dict[node["id"]] = code
-                        return
-                    except Exception as e:
-                        if "rate_limit" in str(e).lower() and attempt < max_retries - 1:
-                            print(f"Rate limit hit, retrying in {retry_delay} seconds... (Attempt {attempt + 1}/{max_retries})")
-                            time.sleep(retry_delay)
-                            retry_delay *= 2  # Exponential backoff
-                        else:
-                            print(f"Error generating code for node {node['id']}: {str(e)}")
-                            code_dict[node["id"]] = f"<!-- Error: {str(e)} -->"
-                            return
+            cropped_img = img.crop(node["bbox"])
+            if near_duplicates is not None:
+                reused = near_duplicates.lookup(node["type"], cropped_img, _context(node))
+                if reused is not None:
+                    return [(node, reused)]
+            encoding = await _encode(node, cropped_img)
+            code = await scheduler.submit(provider, lambda: ask_bot(bot, prompt, encoding), deadline=deadline)
+            if near_duplicates is not None:
+                near_duplicates.store(node["type"], cropped_img, code, _context(node))
+            return [(node, code)]
         except Exception as e:
-            print(f"Error processing image for node {node['id']}: {str(e)}")
-            code_dict[node["id"]] = f"<!-- Error: {str(e)} -->"
+            print(f"Error generating code for node {node['id']}: {str(e) or type(e).__name__}")
+            return [(node, f"<!-- Error: {str(e) or type(e).__name__} -->")]
+
+    async def _generate_batch(nodes):
+        results, pending, crops = [], [], {}
+        for node in nodes:
+            cropped_img = img.crop(node["bbox"])
+            reused = (near_duplicates.lookup(node["type"], cropped_img, _context(node))
+                      if near_duplicates is not None else None)
+            if reused is not None:
+                results.append((node, reused))
+            else:
+                pending.append(node)
+                crops[node["id"]] = cropped_img
+        if len(pending) < 2:
+            return results + [item for node in pending for item in await _generate(node)]
 
-    def _generate_code(node):
-        if not node.get("children"):
-            t = Thread(target=_generate_code_with_retry, args=(node,))
-            t.start()
-            t_list.append(t)
-        else:
-            for child in node["children"]:
-                _generate_code(child)
+        code_dict = None
+        try:
+            encodings = [await _encode(node, crops[node["id"]]) for node in pending]
+            prompt = build_batch_prompt(pending)
+            response = await scheduler.submit(provider, lambda: ask_bot(bot, prompt, encodings), deadline=deadline)
+            code_dict = parse_batch_response(response, pending)
+            if code_dict is None:
+                print(f"Batch answer for nodes {[node['id'] for node in pending]} could not be parsed, "
+                      f"falling back to single requests")
+        except Exception as e:
+            print(f"Batch request for nodes {[node['id'] for node in pending]} failed ({str(e) or type(e).__name__}), "
+                  f"falling back to single requests")
+        if code_dict is None:
+            singles = await asyncio.gather(*(_generate(node) for node in pending))
+            return results + [item for items in singles for item in items]
+
+        for node in pending:
+            if near_duplicates is not None:
+                near_duplicates.store(node["type"], crops[node["id"]], code_dict[node["id"]], _context(node))
+            results.append((node, code_dict[node["id"]]))
+        return results
+
+    batches, singles = plan_batches(collect_leaves(bbox_tree), batch_size, max_batch_crop_pixels)
+    tasks = [asyncio.ensure_future(_generate_batch(batch)) for batch in batches]
+    tasks += [asyncio.ensure_future(_generate(node)) for node in singles]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            for item in await next_done:
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def generate_code_async(bbox_tree, image, bot, document=None, on_progress=None,
+                              scheduler=None, deadline=None, near_duplicates=None, encoding_report=None,
+                              batch_size=1):
+    """
+    Generate code for every leaf and, if `document` is given, splice each component into
+    it as soon as its response arrives instead of waiting for the slowest call.
 
-    _generate_code(bbox_tree)
-    
-    # Wait for all threads to complete
-    for t in t_list:
-        t.join()
-        
+    `on_progress` is called after every component with an event dict:
+    {'node_id', 'type', 'code', 'completed', 'total', 'document'}; call
+    `event['document'].render()` to get the partial page.
+    Returns the full {'id': 'code'} dictionary.
+    """
+    total = len(collect_leaves(bbox_tree))
+    code_dict = {}
+    async for node, code in aiter_generate_code(bbox_tree, image, bot, scheduler, deadline, near_duplicates,
+                                                encoding_report, batch_size):
+        code_dict[node["id"]] = code
+        if document is not None:
+            document.set_code(node["id"], code)
+        if on_progress is not None:
+            on_progress({
+                "node_id": node["id"],
+                "type": node.get("type"),
+                "code": code,
+                "completed": len(code_dict),
+                "total": total,
+                "document": document,
+            })
     return code_dict
 
-# Generate HTML from the bounding box tree
-def generate_html(bbox_tree, output_file="output.html", img_path="data/test1.png"):
+def generate_code_parallel(bbox_tree, img_path, bot, scheduler_limits=None, near_duplicates=None, batch_size=1):
+    """generate code for all the leaf nodes in the bounding box tree, return a dictionary: {'id': 'code'}"""
+    return asyncio.run(generate_code_async(bbox_tree, img_path, bot,
+                                           scheduler=RequestScheduler(scheduler_limits),
+                                           near_duplicates=near_duplicates,
+                                           batch_size=batch_size))
+
+def generate_code_incremental(bbox_tree, img_path, bot, document, on_progress=None, scheduler_limits=None,
+                              near_duplicates=None, encoding_report=None, batch_size=1):
+    """blocking wrapper around generate_code_async that splices into `document` as results arrive"""
+    return asyncio.run(generate_code_async(bbox_tree, img_path, bot, document, on_progress,
+                                           scheduler=RequestScheduler(scheduler_limits),
+                                           near_duplicates=near_duplicates,
+                                           encoding_report=encoding_report,
+                                           batch_size=batch_size))
+
+def generate_code_batch_job(bbox_tree, img_path, bot, poll_interval=30.0, timeout=None, scheduler_limits=None):
     """
-    Generates an HTML file with nested containers based on the bounding box tree.
-
-    :param bbox_tree: Dictionary representing the bounding box tree.
-    :param output_file: The name of the output HTML file.
+    offline bulk mode: send every leaf as one job to the provider's batch API
+    (GPT / Qwen), wait for it, and request whatever the job did not answer directly.
+    Return a dictionary: {'id': 'code'}
     """
-    # HTML and CSS templates
-    # the container class is used to create grid and position the boxes
-    # include the tailwind css in the head tag
-    html_template_start = """
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <title>Bounding Boxes Layout</title>
-        <style>
-            body, html {
-                margin: 0;
-                padding: 0;
-                width: 100%;
-                height: 100%;
-            }
-            .container { 
-                position: relative;
-                width: 100%;
-                height: 100%;
-                box-sizing: border-box;
-            }
-            .box {
-                position: absolute;
-                box-sizing: border-box;
-                overflow: hidden;
-            }
-            .box > .container {
-                display: grid;
-                width: 100%;
-                height: 100%;
-            }
-        </style>
-        <link href="https://cdn.jsdelivr.net/npm/tailwindcss@2.2.19/dist/tailwind.min.css" rel="stylesheet">
-    </head>
-    <body>
-        <div class="container">
+    if not getattr(bot, "supports_batch_api", False):
+        print(f"{type(bot).__name__} has no batch API, sending requests directly")
+        return generate_code_parallel(bbox_tree, img_path, bot, scheduler_limits)
+
+    img = load_image(img_path)
+    code_dict, items, nodes = {}, [], {}
+    for node in collect_leaves(bbox_tree):
+        prompt, fallback = select_prompt(node)
+        if prompt is None:
+            code_dict[node["id"]] = fallback
+            continue
+        encoding = encode_image(img.crop(node["bbox"]), encoding_policy_for(bot.provider, node["type"]))
+        items.append((node["id"], prompt, encoding))
+        nodes[str(node["id"])] = node
+
+    if items:
+        batch_id = bot.submit_batch(items)
+        print(f"Submitted batch {batch_id} with {len(items)} requests")
+        answers = bot.collect_batch(batch_id, poll_interval=poll_interval, timeout=timeout)
+        for custom_id, answer in answers.items():
+            if custom_id in nodes:
+                code_dict[nodes.pop(custom_id)["id"]] = answer
+
+    if nodes:
+        print(f"{len(nodes)} requests missing from the batch output, sending them directly")
+        code_dict.update(generate_code_parallel({"children": list(nodes.values())}, img, bot, scheduler_limits))
+    return code_dict
+
+HTML_TEMPLATE_START = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <title>Bounding Boxes Layout</title>
+    <style>
+        body, html {
+            margin: 0;
+            padding: 0;
+            width: 100%;
+            height: 100%;
+        }
+        .container {
+            position: relative;
+            width: 100%;
+            height: 100%;
+            box-sizing: border-box;
+        }
+        .box {
+            position: absolute;
+            box-sizing: border-box;
+            overflow: hidden;
+        }
+        .box > .container {
+            display: grid;
+            width: 100%;
+            height: 100%;
+        }
+    </style>
+    <link href="https://cdn.jsdelivr.net/npm/tailwindcss@2.2.19/dist/tailwind.min.css" rel="stylesheet">
+</head>
+<body>
+    <div class="container">
+"""
+
+HTML_TEMPLATE_END = """    </div>
+</body>
+</html>
+"""
+
+
+def clean_code(code):
+    """strip the markdown code fences the models wrap around their answer"""
+    return code.replace("```html", "").replace("```", "")
+
+
+class _Slot:
+    __slots__ = ("id",)
+
+    def __init__(self, id):
+        self.id = id
+
+
+class LayoutDocument:
     """
+    In-memory layout page built from the bounding box tree.
 
-    html_template_end = """
-        </div>
-    </body>
-    </html>
+    The skeleton is rendered to string fragments once; every box leaves a slot
+    right before its closing tag where component code is spliced in by node id.
+    Only the (small) generated snippets are parsed, and the whole page is
+    serialized once in `render()`.
     """
 
-    # Function to recursively generate HTML
-    def process_bbox(node, parent_width, parent_height, parent_left, parent_top, img):
+    def __init__(self, bbox_tree):
+        self._parts = []    # skeleton strings interleaved with slot ids
+        self._slots = {}    # node id -> parsed component snippet
+        self._slot_ids = set()
+        self._build(bbox_tree)
+
+    def _build(self, bbox_tree):
+        root_bbox = bbox_tree['bbox']
+        root_width = root_bbox[2]
+        root_height = root_bbox[3]
+        root_x = root_bbox[0]
+        root_y = root_bbox[1]
+
+        self._parts.append(HTML_TEMPLATE_START)
+        for child in bbox_tree.get('children', []):
+            self._process_bbox(child, root_width, root_height, root_x, root_y, depth=2)
+        self._parts.append(HTML_TEMPLATE_END)
+
+    def _process_bbox(self, node, parent_width, parent_height, parent_left, parent_top, depth):
         bbox = node['bbox']
         children = node.get('children', [])
-        id = node['id']
+        id = str(node['id'])
+        indent = "    " * depth
 
         # Calculate relative positions and sizes
         left = (bbox[0] - parent_left) / parent_width * 100
@@ -270,63 +498,94 @@ def generate_html(bbox_tree, output_file="output.html", img_path="data/test1.png
         width = (bbox[2] - bbox[0]) / parent_width * 100
         height = (bbox[3] - bbox[1]) / parent_height * 100
 
-        # Start the box div
-        html = f'''
-            <div id="{id}" class="box" style="left: {left}%; top: {top}%; width: {width}%; height: {height}%;">
-        '''
-
+        self._parts.append(
+            f'{indent}<div id="{id}" class="box" style="left: {left}%; top: {top}%; width: {width}%; height: {height}%;">\n'
+        )
         if children:
             # If there are children, add a nested container
-            html += '''
-                <div class="container">
-            '''
+            self._parts.append(f'{indent}    <div class="container">\n')
             # Get the current box's width and height in pixels for child calculations
             current_width = bbox[2] - bbox[0]
             current_height = bbox[3] - bbox[1]
             for child in children:
-                html += process_bbox(child, current_width, current_height, bbox[0], bbox[1], img)
-            html += '''
-                </div>
-            '''
-        
-        # Close the box div
-        html += '''
-            </div>
-        '''
-        return html
-
-    root_bbox = bbox_tree['bbox']
-    root_children = bbox_tree.get('children', [])
-    root_width = root_bbox[2]
-    root_height = root_bbox[3]
-    root_x = root_bbox[0]
-    root_y = root_bbox[1]
-
-    html_content = html_template_start
-    for child in root_children:
-        html_content += process_bbox(child, root_width, root_height, root_x, root_y, img)
-    html_content += html_template_end
-
-    soup = bs4.BeautifulSoup(html_content, 'html.parser')
-    html_content = soup.prettify()
-
-    with open(output_file, 'w') as f:
-        f.write(html_content)
+                self._process_bbox(child, current_width, current_height, bbox[0], bbox[1], depth + 2)
+            self._parts.append(f'{indent}    </div>\n')
+
+        # component code goes at the end of the box, like div.append() did
+        self._parts.append(_Slot(id))
+        self._slot_ids.add(id)
+        self._parts.append(f'{indent}</div>\n')
+
+    def set_code(self, node_id, code):
+        """splice the generated code into the box with the given id"""
+        node_id = str(node_id)
+        if node_id not in self._slot_ids:
+            print(f"Warning: no box with id {node_id} in the layout, skipping its code")
+            return
+        self._slots[node_id] = bs4.BeautifulSoup(clean_code(code), 'html.parser')
+
+    def update(self, code_dict):
+        for node_id, code in code_dict.items():
+            self.set_code(node_id, code)
+
+    def fragments(self):
+        """parsed component snippets in document order"""
+        return [self._slots[part.id] for part in self._parts
+                if isinstance(part, _Slot) and part.id in self._slots]
+
+    def render(self):
+        out = []
+        for part in self._parts:
+            if isinstance(part, _Slot):
+                fragment = self._slots.get(part.id)
+                if fragment is not None:
+                    out.append(str(fragment))
+                    out.append("\n")
+            else:
+                out.append(part)
+        return "".join(out)
+
+    def save(self, output_file):
+        with open(output_file, 'w') as f:
+            f.write(self.render())
+
+
+# Generate HTML from the bounding box tree
+def generate_html(bbox_tree, output_file=None):
+    """
+    Builds the layout document with nested containers based on the bounding box tree.
+
+    :param bbox_tree: Dictionary representing the bounding box tree.
+    :param output_file: If given, the skeleton is also written to this file.
+    :return: the in-memory LayoutDocument
+    """
+    document = LayoutDocument(bbox_tree)
+    if output_file is not None:
+        document.save(output_file)
+    return document
 
 # Substitute the code in the html file
 def code_substitution(html_file, code_dict):
-    """substitute the code in the html file"""
+    """
+    substitute the code into the layout.
+
+    `html_file` is either a LayoutDocument (spliced in memory, nothing is written)
+    or the path of a previously saved layout file, which is updated in place.
+    """
+    if isinstance(html_file, LayoutDocument):
+        html_file.update(code_dict)
+        return html_file
+
     with open(html_file, "r") as f:
         html = f.read()
     soup = bs4.BeautifulSoup(html, 'html.parser')
     for id, code in code_dict.items():
-        code = code.replace("```html", "").replace("```", "")
-        div = soup.find(id=id)
+        div = soup.find(id=str(id))
         # replace the inner html of the div
         if div:
-            div.append(bs4.BeautifulSoup(code, 'html.parser'))
+            div.append(bs4.BeautifulSoup(clean_code(code), 'html.parser'))
     with open(html_file, "w") as f:
-        f.write(soup.prettify())
+        f.write(str(soup))
 
 # def html_refinement(html_file, output_file, img_path, bot):
 #     """refine the html file"""
@@ -391,13 +650,19 @@ if __name__ == "__main__":
     
     assign_id(root, 0)
 
+    # Alternatively, derive a nested layout locally with recursive XY-cut (ids already assigned):
+    # from utils import projection_tree
+    # root = projection_tree(img_path)
+
     # print(root)
     # Generate initial HTML layout
-    generate_html(root, 'data/tmp/test1_layout.html')
+    document = generate_html(root)
 
     # Initialize the bot
     # Change your model & API ket path according to your needs
-    bot = Doubao("doubao_api.txt", model = "doubao-1.5-thinking-vision-pro-250428")
+    # Identical prompts and crops are answered from the response cache on re-runs
+    cache = ResponseCache(disk_path="data/cache/llm_responses.sqlite")
+    bot = Doubao("doubao_api.txt", model = "doubao-1.5-thinking-vision-pro-250428", cache=cache)
     # bot = Qwen("qwen_api.txt", model="qwen2.5-vl-72b-instruct")
     # bot = GPT("gpt_api.txt", model="gpt-4o")
     # bot = Gemini("gemini_api.txt", model="gemini-1.5-flash-latest")
@@ -405,10 +670,23 @@ if __name__ == "__main__":
     # Generate code for each component
     # code_dict = generate_code(root, img_path, bot)
 
-    code_dict = generate_code_parallel(root, img_path, bot)
-    
-    # Substitute the generated code into the HTML
-    code_substitution('data/tmp/test1_layout.html', code_dict)
+    # Each component is spliced into the document as soon as it is generated
+    def report(event):
+        print(f"[{event['completed']}/{event['total']}] {event['type']} ready")
+        document.save('data/tmp/test1_layout.html')
+
+    # Reuse code for header/navigation crops that barely changed since an earlier run
+    near_duplicates = NearDuplicateCache(["header", "navigation"], disk_path="data/cache/near_duplicates.sqlite")
+    encoding_report = EncodingReport()
+    code_dict = generate_code_incremental(root, img_path, bot, document, on_progress=report,
+                                          near_duplicates=near_duplicates, encoding_report=encoding_report)
+    print("Near-duplicate reuse:", near_duplicates.stats())
+    print(f"Image payloads: {encoding_report.encoded_bytes} bytes sent, {encoding_report.bytes_saved} bytes saved")
+
+    # Pages with many small regions: pack up to 4 small crops per request
+    # code_dict = generate_code_incremental(root, img_path, bot, document, on_progress=report, batch_size=4)
+    # Offline bulk conversion through the provider batch API (GPT / Qwen)
+    # code_dict = generate_code_batch_job(root, img_path, bot)
 
     # Refine the html file
     # html_refinement('data/tmp/test1_layout.html', 'data/tmp/test1_layout_refined.html', img_path, bot)
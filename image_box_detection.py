@@ -1,19 +1,146 @@
 import argparse, asyncio, cv2, json, os, sys
 from pathlib import Path
+import httpx
 import numpy as np
 from playwright.async_api import async_playwright
 
+from artifact_store import atomic_write
+
+TAILWIND_CDN_URL = "https://cdn.jsdelivr.net/npm/tailwindcss@2.2.19/dist/tailwind.min.css"
+DEFAULT_TAILWIND_CACHE = Path(__file__).resolve().parent / "data" / "cache" / "tailwind-2.2.19.min.css"
+
+# Resolves once every <link rel="stylesheet"> has either loaded or failed, so
+# layout is measured with Tailwind applied without waiting for the full load event.
+WAIT_FOR_STYLESHEETS_JS = """
+    () => Promise.all(
+        Array.from(document.querySelectorAll('link[rel="stylesheet"]'))
+            .filter(link => !link.sheet)
+            .map(link => new Promise(resolve => {
+                link.addEventListener('load', resolve, { once: true });
+                link.addEventListener('error', resolve, { once: true });
+            }))
+    )
+"""
+
+
+def check_tailwind_css(css_path) -> Path:
+    """
+    Make sure the local Tailwind stylesheet for offline rendering exists. Offline mode
+    never downloads it: call this at startup so a missing copy fails before any work
+    is done. Placeholder geometry measured without Tailwind would put every crop in
+    the wrong place.
+    """
+    if css_path is None:
+        raise ValueError("Offline rendering needs tailwind_css_path (a local copy of "
+                         f"{TAILWIND_CDN_URL})")
+    css_path = Path(css_path)
+    if not css_path.is_file() or css_path.stat().st_size == 0:
+        raise FileNotFoundError(f"Tailwind stylesheet {css_path} not found. Offline rendering serves it "
+                                f"instead of {TAILWIND_CDN_URL}; fetch it once with "
+                                f"`python image_box_detection.py --fetch-tailwind --tailwind-css {css_path}` "
+                                "on a machine with network access and copy it there.")
+    return css_path
+
+
+def load_tailwind_css(css_path) -> bytes:
+    return check_tailwind_css(css_path).read_bytes()
+
+
+def fetch_tailwind_css(css_path=DEFAULT_TAILWIND_CACHE) -> Path:
+    """Download the pinned Tailwind stylesheet to `css_path` (a one-off setup step, not used when rendering)"""
+    response = httpx.get(TAILWIND_CDN_URL, timeout=30.0, follow_redirects=True)
+    response.raise_for_status()
+    return atomic_write(css_path, response.content)
+
+
+async def _route_offline(route, tailwind_css: bytes):
+    """Serve the pinned Tailwind sheet from the local copy and block every other network request."""
+    url = route.request.url
+    if url.startswith("data:") or url == "about:blank":
+        await route.continue_()
+    elif url == TAILWIND_CDN_URL:
+        await route.fulfill(status=200, content_type="text/css", body=tailwind_css)
+    else:
+        await route.abort("blockedbyclient")
+
+
+class ReusableBrowser:
+    """
+    One Chromium instance shared by many extractions, launched on first use.
+
+    Every extraction gets its own browser context, so pages never share state; only
+    the browser start-up (the slow part) is paid once.
+    """
+
+    def __init__(self):
+        self._playwright = None
+        self._browser = None
+        self._lock = asyncio.Lock()
+
+    async def get(self):
+        async with self._lock:
+            if self._browser is None or not self._browser.is_connected():
+                if self._playwright is None:
+                    self._playwright = await async_playwright().start()
+                self._browser = await self._playwright.chromium.launch()
+            return self._browser
+
+    async def close(self):
+        async with self._lock:
+            if self._browser is not None:
+                await self._browser.close()
+                self._browser = None
+            if self._playwright is not None:
+                await self._playwright.stop()
+                self._playwright = None
+
+
 # ---------- Main logic ----------
-async def extract_bboxes_from_html(html_path: Path):
+async def extract_bboxes_from_html(html_path: Path = None, html_content: str = None,
+                                   tailwind_css_path: Path = None, browser=None):
+    """
+    Render the layout HTML and return region/placeholder bboxes plus the layout size.
+
+    By default the file at `html_path` is loaded with `page.goto`. When `html_content`
+    is given the page is rendered from memory with `page.set_content` instead: Tailwind
+    is served from `tailwind_css_path` (required, see check_tailwind_css), all other
+    requests are blocked, and we only wait for the DOM and its stylesheets rather
+    than the full load event.
+
+    `browser` is a ReusableBrowser (or a launched Playwright browser) to render in;
+    without it a browser is launched and closed for this call.
+    """
+    if html_path is None and html_content is None:
+        raise ValueError("Either html_path or html_content must be provided")
+    if html_content is not None:
+        check_tailwind_css(tailwind_css_path)
+
+    if browser is not None:
+        if isinstance(browser, ReusableBrowser):
+            browser = await browser.get()
+        return await _measure_layout(browser, html_path, html_content, tailwind_css_path)
+
     async with async_playwright() as p:
         browser = await p.chromium.launch()
+        try:
+            return await _measure_layout(browser, html_path, html_content, tailwind_css_path)
+        finally:
+            await browser.close()
 
-        
-        ctx = await browser.new_context(
-            viewport={"width": 1280, "height": 720},
-        )
+
+async def _measure_layout(browser, html_path, html_content, tailwind_css_path):
+    ctx = await browser.new_context(
+        viewport={"width": 1280, "height": 720},
+    )
+    try:
         page = await ctx.new_page()
-        await page.goto(html_path.resolve().as_uri())
+        if html_content is not None:
+            tailwind_css = load_tailwind_css(tailwind_css_path)
+            await page.route("**/*", lambda route: _route_offline(route, tailwind_css))
+            await page.set_content(html_content, wait_until="domcontentloaded")
+            await page.evaluate(WAIT_FOR_STYLESHEETS_JS)
+        else:
+            await page.goto(html_path.resolve().as_uri())
 
         metrics = await page.evaluate("""
             () => {
@@ -34,10 +161,10 @@ async def extract_bboxes_from_html(html_path: Path):
                     // Apply the same filters as before
                     if (el.tagName === 'SVG') continue;
                     if (el.innerText && el.innerText.trim() !== '') continue;
-                    
+                
                     const el_rect = el.getBoundingClientRect();
                     const el_center = { x: el_rect.left + el_rect.width / 2, y: el_rect.top + el_rect.height / 2 };
-                    
+                
                     // Find which region this placeholder is inside
                     let containing_region_id = null;
                     for (const region_el of region_containers) {
@@ -48,7 +175,7 @@ async def extract_bboxes_from_html(html_path: Path):
                             break; // Assume non-overlapping regions
                         }
                     }
-                    
+                
                     // Only include placeholders that are inside a detected region
                     if (containing_region_id) {
                         placeholder_bboxes.push({
@@ -71,7 +198,8 @@ async def extract_bboxes_from_html(html_path: Path):
                 };
             }
         """)
-        await browser.close()
+    finally:
+        await ctx.close()
     return metrics['region_bboxes'], metrics['placeholder_bboxes'], metrics['layout_width'], metrics['layout_height']
 
 
@@ -117,23 +245,8 @@ def draw_bboxes_on_image(img, region_bboxes, placeholder_bboxes):
     return boxed
 
 
-def main(args):
-    # Read original screenshot
-    img = cv2.imread(str(args.screenshot))
-    if img is None:
-        sys.exit(f"Error: Cannot read image {args.screenshot}")
-    if img.std() < 5:
-        print("Warning: The screenshot is almost pure color, it may not be the original screenshot with real thumbnails.")
-
-    H, W = img.shape[:2]
-
-    # Parse HTML → Get bboxes
-    region_bboxes, placeholder_bboxes, layout_width, layout_height = asyncio.run(
-        extract_bboxes_from_html(args.html)
-    )
-    if not placeholder_bboxes:
-        sys.exit("Error: No gray placeholder blocks found!")
-
+def scale_to_screenshot(region_bboxes, placeholder_bboxes, layout_width, layout_height, W, H):
+    """Scale layout-space boxes to screenshot pixels (separate X/Y factors)"""
     # Calculate separate scale factors for X and Y to handle aspect ratio differences
     scale_x = W / layout_width if layout_width > 0 else 1
     scale_y = H / layout_height if layout_height > 0 else 1
@@ -143,23 +256,61 @@ def main(args):
     elif abs(scale_x - 1.0) > 0.05:
         print(f"[*] Detected uniform scale: {scale_x:.2f}")
 
-
-    # Scale all bboxes to the original image coordinate system
-    scaled_regions = []
-    for b in region_bboxes:
-        scaled_regions.append({
+    def scale(b):
+        return {
             **b,
             "x": int(b['x'] * scale_x), "y": int(b['y'] * scale_y),
             "w": int(b['w'] * scale_x), "h": int(b['h'] * scale_y)
-        })
+        }
 
-    scaled_placeholders = []
-    for b in placeholder_bboxes:
-        scaled_placeholders.append({
+    return [scale(b) for b in region_bboxes], [scale(b) for b in placeholder_bboxes]
+
+
+def to_proportional(scaled_regions, scaled_placeholders, W, H):
+    """Pixel boxes -> {'regions', 'placeholders'} with proportional coordinates (the JSON mapping.py reads)"""
+    def proportional(b):
+        return {
             **b,
-            "x": int(b['x'] * scale_x), "y": int(b['y'] * scale_y),
-            "w": int(b['w'] * scale_x), "h": int(b['h'] * scale_y)
-        })
+            "x": b["x"] / W, "y": b["y"] / H,
+            "w": b["w"] / W, "h": b["h"] / H
+        }
+
+    return {
+        "regions": [proportional(b) for b in scaled_regions],
+        "placeholders": [proportional(b) for b in scaled_placeholders],
+    }
+
+
+async def extract_placeholder_layout(W, H, html_path: Path = None, html_content: str = None,
+                                     tailwind_css_path: Path = None, browser=None):
+    """
+    Render the layout HTML and return (scaled_regions, scaled_placeholders) in the pixel
+    space of a W x H screenshot. In-process counterpart of running this script.
+    """
+    region_bboxes, placeholder_bboxes, layout_width, layout_height = await extract_bboxes_from_html(
+        html_path, html_content, tailwind_css_path, browser=browser)
+    return scale_to_screenshot(region_bboxes, placeholder_bboxes, layout_width, layout_height, W, H)
+
+
+def main(args):
+    # Read original screenshot
+    img = cv2.imread(str(args.screenshot))
+    if img is None:
+        sys.exit(f"Error: Cannot read image {args.screenshot}")
+    if img.std() < 5:
+        print("Warning: The screenshot is almost pure color, it may not be the original screenshot with real thumbnails.")
+
+    H, W = img.shape[:2]
+
+    # Parse HTML → Get bboxes scaled to the original image coordinate system
+    if args.offline:
+        extraction = extract_placeholder_layout(W, H, html_content=args.html.read_text(),
+                                                tailwind_css_path=args.tailwind_css)
+    else:
+        extraction = extract_placeholder_layout(W, H, args.html)
+    scaled_regions, scaled_placeholders = asyncio.run(extraction)
+    if not scaled_placeholders:
+        sys.exit("Error: No gray placeholder blocks found!")
 
     # Draw boxes using the now-scaled data
     overlay = draw_bboxes_on_image(img, scaled_regions, scaled_placeholders)
@@ -172,28 +323,10 @@ def main(args):
 
 
     # Convert absolute pixel coordinates to proportions for the final JSON output
-    proportional_regions = []
-    for b in scaled_regions:
-        proportional_regions.append({
-            **b,
-            "x": b["x"] / W, "y": b["y"] / H,
-            "w": b["w"] / W, "h": b["h"] / H
-        })
-        
-    proportional_placeholders = []
-    for b in scaled_placeholders:
-        proportional_placeholders.append({
-            **b,
-            "x": b["x"] / W, "y": b["y"] / H,
-            "w": b["w"] / W, "h": b["h"] / H
-        })
+    output_data = to_proportional(scaled_regions, scaled_placeholders, W, H)
 
     # Print/save bbox array
     print("\n=== BBox (proportional to image dimensions) ===")
-    output_data = {
-        "regions": proportional_regions,
-        "placeholders": proportional_placeholders
-    }
     output_json = json.dumps(output_data, indent=2, ensure_ascii=False)
     print(output_json)
 
@@ -216,5 +349,17 @@ if __name__ == "__main__":
                         help="Output directory (save debug_gray_bboxes_test1.png)")
     parser.add_argument("--json", type=Path, default=Path("data/tmp/test1_bboxes.json"),
                         help="If provided, write BBox list to JSON file")
+    parser.add_argument("--offline", action="store_true",
+                        help="Render the HTML from memory and block all network access "
+                             "(Tailwind is served from --tailwind-css)")
+    parser.add_argument("--tailwind-css", type=Path, default=DEFAULT_TAILWIND_CACHE,
+                        help="Local copy of the pinned Tailwind stylesheet served in --offline mode")
+    parser.add_argument("--fetch-tailwind", action="store_true",
+                        help="Download the pinned Tailwind stylesheet to --tailwind-css and exit")
     args = parser.parse_args()
+    if args.fetch_tailwind:
+        print(f"Saved {TAILWIND_CDN_URL} to {fetch_tailwind_css(args.tailwind_css)}")
+        sys.exit(0)
+    if args.offline:
+        check_tailwind_css(args.tailwind_css)
     main(args)
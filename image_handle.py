@@ -0,0 +1,190 @@
+"""
+Decode-once screenshot handle shared by the pipeline stages.
+
+An ImageHandle holds the decoded pixels in one base array (optionally in shared
+memory) and derives RGB/BGR/gray/alpha views from it lazily, caching each one, so
+the layout pass, region crops, UIED and the image replacer all read the same
+buffer instead of calling cv2.imread / Image.open again. Pickling a handle moves
+the base into shared memory once; a worker process unpickles it by attaching to
+that segment, without copying the pixels.
+"""
+
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+MODES = ("BGR", "RGB", "BGRA", "RGBA", "GRAY")
+
+
+class HandleSpec(NamedTuple):
+    """What a process needs to attach to a shared handle"""
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+    mode: str
+    path: Optional[str]
+
+
+class ImageHandle:
+    """
+    Decoded pixels plus lazily computed colour views.
+
+    `base` is the array in `mode` as decoded; `view(mode)` (or the bgr/rgb/gray
+    properties) converts on first use and caches the result. All arrays are
+    read-only; copy before drawing on them.
+    """
+
+    def __init__(self, base: np.ndarray, mode: str, path=None,
+                 shm: Optional[shared_memory.SharedMemory] = None, owner: bool = True):
+        if mode not in MODES:
+            raise ValueError(f"Unsupported image mode: {mode}")
+        base.flags.writeable = False
+        self._base = base
+        self.mode = mode
+        self.path = str(path) if path is not None else None
+        self._shm = shm
+        self._owner = owner
+        self._lingering: Optional[shared_memory.SharedMemory] = None
+        self._views: Dict[str, np.ndarray] = {}
+
+    @classmethod
+    def open(cls, path, keep_alpha: bool = False, shared: bool = False) -> "ImageHandle":
+        """Decode an image file once (BGR, or BGRA when keep_alpha and the file has alpha)"""
+        image = cv2.imread(str(path), cv2.IMREAD_UNCHANGED if keep_alpha else cv2.IMREAD_COLOR)
+        if image is not None and keep_alpha and (image.ndim != 3 or image.shape[2] != 4 or image.dtype != np.uint8):
+            image = cv2.imread(str(path), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError(f"Could not load image from {path}")
+        return cls.from_array(image, "BGRA" if image.shape[2:] == (4,) else "BGR", path=path, shared=shared)
+
+    @classmethod
+    def from_array(cls, array: np.ndarray, mode: str = "BGR", path=None, shared: bool = False) -> "ImageHandle":
+        """Wrap an already decoded array; with shared=True it is copied into shared memory"""
+        handle = cls(np.asarray(array).view(), mode, path)  # a view, so the caller's array stays writeable
+        if shared:
+            handle.share()
+        return handle
+
+    @classmethod
+    def from_pil(cls, image: Image.Image, path=None, shared: bool = False) -> "ImageHandle":
+        """RGB (or RGBA when the image has alpha) base from a PIL image"""
+        mode = "RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB"
+        return cls.from_array(np.asarray(image.convert(mode)), mode,
+                              path=path or getattr(image, "filename", None) or None, shared=shared)
+
+    @classmethod
+    def coerce(cls, image) -> "ImageHandle":
+        """ImageHandle, PIL image or path -> ImageHandle (paths are decoded as BGR)"""
+        if isinstance(image, ImageHandle):
+            return image
+        if isinstance(image, Image.Image):
+            return cls.from_pil(image)
+        return cls.open(image)
+
+    @classmethod
+    def attach(cls, spec: HandleSpec) -> "ImageHandle":
+        """Map a handle shared by another process; close() detaches without freeing it"""
+        shm = shared_memory.SharedMemory(name=spec.name)
+        base = np.ndarray(spec.shape, np.dtype(spec.dtype), buffer=shm.buf)
+        return cls(base, spec.mode, spec.path, shm=shm, owner=False)
+
+    @property
+    def base(self) -> np.ndarray:
+        if self._base is None:
+            raise ValueError("Image handle is closed")
+        return self._base
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.base.shape
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """(width, height), like PIL"""
+        return self.base.shape[1], self.base.shape[0]
+
+    @property
+    def has_alpha(self) -> bool:
+        return self.mode in ("BGRA", "RGBA")
+
+    def view(self, mode: str) -> np.ndarray:
+        """The pixels in `mode`, converted on first use and cached"""
+        if mode == self.mode:
+            return self.base
+        if mode not in self._views:
+            if mode not in MODES:
+                raise ValueError(f"Unsupported image mode: {mode}")
+            converted = cv2.cvtColor(self.base, getattr(cv2, f"COLOR_{self.mode}2{mode}"))
+            converted.flags.writeable = False
+            self._views[mode] = converted
+        return self._views[mode]
+
+    @property
+    def bgr(self) -> np.ndarray:
+        return self.view("BGR")
+
+    @property
+    def rgb(self) -> np.ndarray:
+        return self.view("RGB")
+
+    @property
+    def gray(self) -> np.ndarray:
+        return self.view("GRAY")
+
+    def crop(self, bbox, mode: Optional[str] = None) -> np.ndarray:
+        """Zero-copy slice for a pixel [x1, y1, x2, y2] box, clipped at the top-left"""
+        x1, y1, x2, y2 = (int(v) for v in bbox)
+        return self.view(mode or self.mode)[max(0, y1):y2, max(0, x1):x2]
+
+    def to_pil(self) -> Image.Image:
+        """A new PIL image (RGB, or RGBA with alpha) that owns its pixels"""
+        mode = "RGBA" if self.has_alpha else "RGB"
+        return Image.fromarray(np.array(self.view(mode)), mode)
+
+    def share(self) -> HandleSpec:
+        """Move the base into shared memory (once) and return the spec to attach to it"""
+        if self._shm is None:
+            base = self.base
+            self._shm = shared_memory.SharedMemory(create=True, size=max(1, base.nbytes))
+            shared = np.ndarray(base.shape, base.dtype, buffer=self._shm.buf)
+            shared[...] = base
+            shared.flags.writeable = False
+            self._base = shared
+            self._owner = True
+        return HandleSpec(self._shm.name, self._base.shape, self._base.dtype.str, self.mode, self.path)
+
+    def __reduce__(self):
+        return ImageHandle.attach, (self.share(),)
+
+    def close(self):
+        """Drop the cached views and release shared memory (freed by the owner)"""
+        self._views.clear()
+        self._base = None
+        if self._shm is not None:
+            shm, self._shm = self._shm, None
+            try:
+                shm.close()
+            except BufferError:
+                self._lingering = shm  # a caller still holds a slice; unmapped when both are gone
+            if self._owner:
+                shm.unlink()
+
+    def __enter__(self) -> "ImageHandle":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __repr__(self):
+        state = "closed" if self._base is None else f"{self.size[0]}x{self.size[1]} {self.mode}"
+        return f"ImageHandle({state}{', shared' if self._shm is not None else ''})"
+
+
+def image_name(image, default: str = "screenshot") -> str:
+    """File stem of an image path or handle, for naming derived artifacts"""
+    path = image.path if isinstance(image, ImageHandle) else image
+    return Path(path).stem if path else default
@@ -3,19 +3,48 @@ import json
 from pathlib import Path
 from bs4 import BeautifulSoup
 import cv2
+import numpy as np
 import re
 
+from artifact_store import artifact_name, digest
+from mapping import load_uied_data
+
 def main(args):
     # --- Phase 1: Crop and Save All Images First ---
     
     # 1. Load data
     mapping_data = json.loads(args.mapping.read_text())
-    uied_data = json.loads(args.uied.read_text())
+    uied_data = load_uied_data(args.uied)
     original_image = cv2.imread(str(args.original_image))
     
     if original_image is None:
         raise ValueError(f"Could not load the original image from {args.original_image}")
 
+    # 2. Create a directory for cropped images
+    crop_dir = args.output_html.parent / "cropped_images"
+    crop_dir.mkdir(exist_ok=True)
+    print(f"Saving cropped images to: {crop_dir.resolve()}")
+
+    # 3. Crop every mapped UIED box and save it to a file
+    save_crops(crop_mapped_images(mapping_data, uied_data, original_image), crop_dir)
+
+    # --- Phase 2: Use BeautifulSoup to Replace Placeholders by Order ---
+    
+    print("\nStarting offline HTML processing with BeautifulSoup...")
+    html_content = args.gray_html.read_text()
+    soup = BeautifulSoup(html_content, 'html.parser')
+    replace_placeholders([soup], order_placeholder_ids(mapping_data), crop_dir.name)
+
+    # Save the modified HTML
+    args.output_html.write_text(str(soup))
+    print(f"Final HTML generated at {args.output_html.resolve()}")
+
+
+def crop_mapped_images(mapping_data, uied_data, original_image):
+    """
+    Crop the UIED box mapped to every placeholder out of the original screenshot.
+    Returns {placeholder_id: BGR array}; the arrays are views into `original_image`.
+    """
     # Get image shapes to calculate a simple, global scaling factor
     H_proc, W_proc, _ = uied_data['img_shape']
     H_orig, W_orig, _ = original_image.shape
@@ -28,12 +57,7 @@ def main(args):
         for comp in uied_data['compos']
     }
 
-    # 2. Create a directory for cropped images
-    crop_dir = args.output_html.parent / "cropped_images"
-    crop_dir.mkdir(exist_ok=True)
-    print(f"Saving cropped images to: {crop_dir.resolve()}")
-
-    # 3. Iterate through mappings and save cropped images to files
+    crops = {}
     for region_id, region_data in mapping_data.items():
         for placeholder_id, uied_id in region_data['mapping'].items():
             if uied_id not in uied_boxes:
@@ -51,9 +75,8 @@ def main(args):
             x1, y1 = int(x_tf), int(y_tf)
             x2, y2 = int(x_tf + w_tf), int(y_tf + h_tf)
             
-            h_img, w_img, _ = original_image.shape
             x1, y1 = max(0, x1), max(0, y1)
-            x2, y2 = min(w_img, x2), min(h_img, y2)
+            x2, y2 = min(W_orig, x2), min(H_orig, y2)
             
             cropped_img = original_image[y1:y2, x1:x2]
             
@@ -61,22 +84,51 @@ def main(args):
                 print(f"Warning: Cropped image for {placeholder_id} is empty. Skipping.")
                 continue
             
-            output_path = crop_dir / f"{placeholder_id}.png"
-            cv2.imwrite(str(output_path), cropped_img)
-
-    # --- Phase 2: Use BeautifulSoup to Replace Placeholders by Order ---
-    
-    print("\nStarting offline HTML processing with BeautifulSoup...")
-    html_content = args.gray_html.read_text()
-    soup = BeautifulSoup(html_content, 'html.parser')
-
-    # 1. Find all placeholder elements by their class, in document order.
-    placeholder_elements = soup.find_all(class_="bg-gray-400")
-
-    # 2. Get the placeholder IDs from the mapping file in the correct, sorted order.
-    def natural_sort_key(s):
-        return [int(text) if text.isdigit() else text.lower() for text in re.split('([0-9]+)', s)]
-
+            crops[placeholder_id] = cropped_img
+    return crops
+
+
+def encode_crops(crops):
+    """{placeholder_id: PNG bytes}"""
+    blobs = {}
+    for placeholder_id, cropped_img in crops.items():
+        ok, buffer = cv2.imencode(".png", cropped_img)
+        if ok:
+            blobs[placeholder_id] = buffer.tobytes()
+    return blobs
+
+
+def save_crops(crops, crop_dir):
+    """Write each crop to crop_dir/<placeholder_id>.png"""
+    for placeholder_id, blob in encode_crops(crops).items():
+        (crop_dir / f"{placeholder_id}.png").write_bytes(blob)
+
+
+def materialize_crops(crops, crop_dir, store=None):
+    """
+    save_crops, with the encoded PNGs cached in one pack file of an ArtifactStore.
+    The pack is named after the crops' pixels, so a repeated run only copies bytes out.
+    """
+    if store is None:
+        save_crops(crops, crop_dir)
+        return len(crops)
+    name = artifact_name("crops", {placeholder_id: [list(crop.shape), digest(np.ascontiguousarray(crop))]
+                                   for placeholder_id, crop in crops.items()})
+    if store.has(name):
+        return store.extract_pack(name, crop_dir, ".png")
+    blobs = encode_crops(crops)
+    store.put_pack(name, blobs, format="png")
+    for placeholder_id, blob in blobs.items():
+        (crop_dir / f"{placeholder_id}.png").write_bytes(blob)
+    return len(blobs)
+
+
+def natural_sort_key(s):
+    return [int(text) if text.isdigit() else text.lower() for text in re.split('([0-9]+)', s)]
+
+
+def order_placeholder_ids(mapping_data):
+    """Get the placeholder IDs from the mapping in document order."""
     ordered_placeholder_ids = []
     # Sort region IDs numerically to process them in order
     for region_id in sorted(mapping_data.keys(), key=int):
@@ -84,21 +136,36 @@ def main(args):
         # Sort the placeholder IDs within each region naturally (e.g., ph1, ph2, ph10)
         sorted_ph_ids = sorted(region_mapping.keys(), key=natural_sort_key)
         ordered_placeholder_ids.extend(sorted_ph_ids)
-    
-    # 3. Check for count mismatches
+    return ordered_placeholder_ids
+
+
+def replace_placeholders(roots, ordered_placeholder_ids, crop_dir_name):
+    """
+    Replace the gray placeholders with <img> tags, in document order.
+
+    `roots` is a list of parsed trees visited in order: either the whole page,
+    or the component fragments of an in-memory LayoutDocument, which avoids
+    re-parsing the full document.
+    """
+    # 1. Find all placeholder elements by their class, in document order.
+    placeholder_elements = []
+    for root in roots:
+        placeholder_elements.extend((root, el) for el in root.find_all(class_="bg-gray-400"))
+
+    # 2. Check for count mismatches
     if len(placeholder_elements) != len(ordered_placeholder_ids):
         print(f"Warning: Mismatch in counts! Found {len(placeholder_elements)} gray boxes in HTML, but {len(ordered_placeholder_ids)} mappings.")
     else:
         print(f"Found {len(placeholder_elements)} gray boxes to replace.")
 
-    # 4. Iterate through both lists, create a proper <img> tag, and replace the placeholder.
-    for i, ph_element in enumerate(placeholder_elements):
+    # 3. Iterate through both lists, create a proper <img> tag, and replace the placeholder.
+    for i, (root, ph_element) in enumerate(placeholder_elements):
         if i >= len(ordered_placeholder_ids):
             print(f"Warning: More gray boxes in HTML than mappings. Stopping at box {i+1}.")
             break
         
         ph_id = ordered_placeholder_ids[i]
-        relative_img_path = f"{crop_dir.name}/{ph_id}.png"
+        relative_img_path = f"{crop_dir_name}/{ph_id}.png"
         
         # --- Create a new <img> tag and replace the placeholder ---
 
@@ -108,23 +175,21 @@ def main(args):
             original_classes.remove('bg-gray-400') # Remove the placeholder background
 
         # b. Create the new <img> tag
-        img_tag = soup.new_tag("img", src=relative_img_path)
+        img_tag = root.new_tag("img", src=relative_img_path)
         img_tag['class'] = original_classes
         
         # c. Replace the placeholder with the new image tag.
         ph_element.replace_with(img_tag)
 
-    # Save the modified HTML
-    args.output_html.write_text(str(soup))
-    
-    print(f"\nSuccessfully replaced {min(len(placeholder_elements), len(ordered_placeholder_ids))} placeholders.")
-    print(f"Final HTML generated at {args.output_html.resolve()}")
+    replaced = min(len(placeholder_elements), len(ordered_placeholder_ids))
+    print(f"\nSuccessfully replaced {replaced} placeholders.")
+    return replaced
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Replace placeholder divs in an HTML file with cropped images based on UIED mappings.")
     parser.add_argument("--mapping", type=Path, required=False, help="Path to the mapping JSON file from mapping.py.")
-    parser.add_argument("--uied", type=Path, required=False, help="Path to the UIED JSON file.")
+    parser.add_argument("--uied", type=Path, required=False, help="Path to the UIED result file (JSON or another UIED output format).")
     parser.add_argument("--original-image", type=Path, required=False, help="Path to the original screenshot image.")
     parser.add_argument("--gray-html", type=Path, required=False, help="Path to the input HTML file with gray placeholders.")
     parser.add_argument("--output-html", type=Path, required=False, help="Path to save the final, modified HTML file.")
@@ -0,0 +1,111 @@
+"""
+MCP 服务器的图像处理进程池
+
+Canny、findContours、裁剪、绘制清单图和 PNG 编码都是 CPU 密集的操作，放在事件循环
+（或者受 GIL 限制的线程）里会让 stdio 会话卡住。这里提供：
+- 一个按需创建的进程池，多个请求可以在不同的 CPU 核上同时处理
+- 图片以 image_handle.ImageHandle 传递：首次发送时基础数组移入共享内存，工作进程按名字挂载，
+  不再序列化整张图；各进程按需得到 RGB/BGR/灰度视图
+- 在工作进程中执行的函数，第一个参数都是挂载好的 ImageHandle（只读使用）
+"""
+
+import asyncio
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import cv2
+from PIL import ImageDraw, ImageFont
+
+from image_handle import ImageHandle
+
+logger = logging.getLogger(__name__)
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _call_with_handle(func: Callable, image: ImageHandle, *args) -> Any:
+    """在工作进程中调用 func(image, *args)；image 反序列化时已挂载共享内存，用完后断开"""
+    try:
+        return func(image, *args)
+    finally:
+        image.close()
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """全局进程池，首次使用时创建"""
+    global _pool
+    if _pool is None:
+        workers = max(1, os.cpu_count() or 1)
+        _pool = ProcessPoolExecutor(max_workers=workers)
+        logger.info(f"图像处理进程池已启动: {workers} 个进程")
+    return _pool
+
+
+def shutdown_pool():
+    """关闭进程池（服务器退出时调用）"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+
+
+async def run_on_image(image: ImageHandle, func: Callable, *args) -> Any:
+    """在进程池中执行 func(image, *args)，不阻塞事件循环；图片按共享内存传递，不拷贝像素"""
+    image.share()  # 在事件循环线程中移入共享内存；之后的序列化只传名字
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_pool(), _call_with_handle, func, image, *args)
+
+
+# 以下函数在工作进程中执行，必须是模块级函数
+
+def detect_contour_regions(image: ImageHandle, min_area_ratio: float = 0.01, min_side: int = 50,
+                           limit: int = 5) -> List[Dict[str, int]]:
+    """Canny 边缘 + 外轮廓，返回面积最大的 limit 个区域 {x, y, width, height}"""
+    width, height = image.size
+    edges = cv2.Canny(image.gray, 50, 150)
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    regions = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if w * h > (width * height * min_area_ratio) and w > min_side and h > min_side:
+            regions.append({"x": x, "y": y, "width": w, "height": h})
+    regions.sort(key=lambda r: r["width"] * r["height"], reverse=True)
+    return regions[:limit]
+
+
+def save_crop(image: ImageHandle, box: Sequence[int], path: str) -> str:
+    """裁剪 (x1, y1, x2, y2) 并保存为 PNG（有透明通道时保留）"""
+    cv2.imwrite(path, image.crop(box, "BGRA" if image.has_alpha else "BGR"))
+    return path
+
+
+def draw_labeled_regions(image: ImageHandle, regions: List[Dict[str, Any]], path: str) -> str:
+    """清单图：红框 + 区域名（PIL 绘制）"""
+    manifest = image.to_pil()
+    draw = ImageDraw.Draw(manifest)
+    try:
+        font = ImageFont.truetype("arial.ttf", 40)
+    except IOError:
+        font = ImageFont.load_default()
+
+    for region in regions:
+        x, y, w, h = region["x"], region["y"], region["width"], region["height"]
+        draw.rectangle([x, y, x + w, y + h], outline="red", width=5)
+        draw.text((x + 10, y + 10), region["name"], fill="red", font=font)
+    manifest.save(path)
+    return path
+
+
+def draw_region_overlay(image: ImageHandle, regions: List[Dict[str, Any]], path: str) -> str:
+    """清单图：绿框 + "编号: 名称"（OpenCV 绘制）"""
+    manifest = image.bgr.copy()
+    for i, region in enumerate(regions):
+        x1, y1, x2, y2 = region["bbox"]
+        cv2.rectangle(manifest, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        cv2.putText(manifest, f"{i}: {region['name']}",
+                    (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+    cv2.imwrite(path, manifest)
+    return path
@@ -0,0 +1,171 @@
+"""
+ScreenCoder 异步作业队列
+
+MCP 工具不再在处理函数里直接跑完整个转换，而是把作业提交到这里：
+- 按资源类别（llm / browser / cpu）分别排队，每类的并发数有上限
+- 同一类别内按优先级出队（数值越小越先执行），同优先级先进先出
+- 某类排队的作业数达到上限时拒绝新作业（背压），调用方稍后重试
+- 作业可以上报进度，状态和结果可以轮询、订阅进度事件，也可以等待作业完成
+- 排队、名额分配、进度和已结束作业的淘汰由 error_handler.TaskManager 负责
+"""
+
+import asyncio
+import itertools
+import logging
+import os
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+from error_handler import ErrorType, ScreenCoderError, TaskInfo, TaskManager, TaskStatus
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 10
+
+DEFAULT_LIMITS = {
+    "llm": 4,                                   # 受模型服务的限流约束
+    "browser": 2,                               # 每个页面都要占用 Chromium 内存
+    "cpu": max(1, (os.cpu_count() or 2) // 2),  # UIED / OpenCV 检测
+}
+
+
+class QueueFullError(ScreenCoderError):
+    """作业队列已满"""
+    def __init__(self, resource: str, depth: int):
+        super().__init__(f"Job queue for '{resource}' is full ({depth} waiting), retry later",
+                         ErrorType.RESOURCE_ERROR, {"resource": resource, "depth": depth})
+        self.resource = resource
+
+
+class JobContext:
+    """传给作业函数，用来上报进度"""
+
+    def __init__(self, manager: TaskManager, job_id: str):
+        self.manager = manager
+        self.job_id = job_id
+
+    def progress(self, fraction: float, message: Optional[str] = None):
+        """上报 0-1 之间的进度和可选的说明；可以在工作线程中调用"""
+        self.manager.report_progress(self.job_id, fraction, message)
+
+
+class JobQueue:
+    """按资源类别限流的优先级作业队列，每个类别由一个 TaskManager 调度"""
+
+    def __init__(self, limits: Optional[Dict[str, int]] = None, max_queue_depth: int = 32,
+                 max_finished: int = 256, finished_ttl: float = 3600):
+        self.limits = {**DEFAULT_LIMITS, **(limits or {})}
+        self.max_queue_depth = max_queue_depth
+        self.managers: Dict[str, TaskManager] = {
+            resource: TaskManager(max(1, limit), max_finished, finished_ttl)
+            for resource, limit in self.limits.items()
+        }
+        self._ids = itertools.count(1)
+
+    async def submit(self, func: Callable[[JobContext], Awaitable[Any]], resource: str = "llm",
+                     priority: int = PRIORITY_NORMAL, name: Optional[str] = None) -> str:
+        """提交作业，返回作业ID；该类别排队已满时抛出 QueueFullError"""
+        manager = self.managers.get(resource)
+        if manager is None:
+            raise ValueError(f"Unknown resource class: {resource}")
+
+        depth = manager.pending_count()
+        if depth >= self.max_queue_depth:
+            raise QueueFullError(resource, depth)
+
+        name = name or getattr(func, "__name__", "job")
+        job_id = manager.create_task(f"job_{next(self._ids)}",
+                                     {"name": name, "resource": resource, "priority": priority})
+        await manager.start_task(job_id, func(JobContext(manager, job_id)), priority=priority)
+        logger.info(f"Queued {name} as {job_id} ({resource}, priority {priority}, {manager.pending_count()} waiting)")
+        return job_id
+
+    def _find(self, job_id: str) -> Tuple[TaskManager, TaskInfo]:
+        for manager in self.managers.values():
+            info = manager.get_task_status(job_id)
+            if info is not None:
+                return manager, info
+        raise ValueError(f"Unknown job: {job_id}")
+
+    def get(self, job_id: str) -> TaskInfo:
+        return self._find(job_id)[1]
+
+    def status(self, job_id: str) -> Dict[str, Any]:
+        """作业状态（不含结果）"""
+        manager, info = self._find(job_id)
+        status = {
+            "job_id": job_id,
+            "name": info.metadata.get("name"),
+            "status": info.status.value,
+            "resource": info.metadata.get("resource"),
+            "priority": info.metadata.get("priority"),
+            "progress": round(info.progress, 3),
+            "message": info.message,
+            "created_at": info.created_at.isoformat(),
+            "started_at": info.started_at.isoformat() if info.started_at else None,
+            "completed_at": info.completed_at.isoformat() if info.completed_at else None,
+        }
+        if info.status == TaskStatus.PENDING:
+            status["queue_position"] = manager.queue_position(job_id)
+        if info.error_message:
+            status["error"] = info.error_message
+            status["error_type"] = info.error_type.value if info.error_type else None
+        return status
+
+    async def wait(self, job_id: str, timeout: Optional[float] = None) -> TaskInfo:
+        """等待作业结束（最多 timeout 秒），返回作业信息；超时不抛异常，状态仍为 pending/running"""
+        manager, _ = self._find(job_id)
+        return await manager.wait(job_id, timeout)
+
+    def subscribe(self, job_id: str) -> AsyncIterator[Dict[str, Any]]:
+        """异步迭代作业的状态和进度事件，作业结束后停止"""
+        manager, _ = self._find(job_id)
+        return manager.subscribe(job_id)
+
+    async def run(self, func: Callable[[JobContext], Awaitable[Any]], resource: str = "llm",
+                  priority: int = PRIORITY_NORMAL, name: Optional[str] = None) -> Any:
+        """提交并等待结果，失败时抛出原错误信息；调用方被取消时作业也一并取消"""
+        job_id = await self.submit(func, resource, priority, name)
+        try:
+            info = await self.wait(job_id)
+        except asyncio.CancelledError:
+            self.cancel(job_id)
+            raise
+        if info.status == TaskStatus.COMPLETED:
+            return info.result
+        if info.status == TaskStatus.CANCELLED:
+            raise asyncio.CancelledError()
+        raise ScreenCoderError(info.error_message or "Job failed",
+                               info.error_type or ErrorType.PROCESSING_ERROR)
+
+    def cancel(self, job_id: str) -> bool:
+        """取消排队中或运行中的作业"""
+        manager, _ = self._find(job_id)
+        return manager.cancel_task(job_id)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            resource: {
+                "limit": manager.max_concurrent_tasks,
+                "running": manager.running_count(),
+                "queued": manager.pending_count(),
+            }
+            for resource, manager in self.managers.items()
+        }
+
+    async def close(self):
+        """取消所有未完成的作业"""
+        await asyncio.gather(*(manager.shutdown() for manager in self.managers.values()))
+
+
+def format_status(status: Dict[str, Any]) -> str:
+    """MCP 工具返回的状态文本"""
+    lines = [f"作业 {status['job_id']} ({status['name']}): {status['status']}，进度 {status['progress'] * 100:.0f}%"]
+    if status.get("queue_position"):
+        lines.append(f"排队位置: {status['queue_position']}")
+    if status.get("message"):
+        lines.append(f"当前步骤: {status['message']}")
+    if status.get("error"):
+        lines.append(f"错误: {status['error']}")
+    return "\n".join(lines)
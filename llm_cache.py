@@ -0,0 +1,333 @@
+"""
+Content-addressed response cache for LLM calls.
+
+Keys are a SHA-256 over (provider, model, prompt, image bytes, sampling params),
+so re-running a batch with identical prompts and crops is served locally.
+Two tiers: an in-memory LRU in front of an on-disk SQLite store with TTL and
+size-based eviction. `NearDuplicateCache` adds an opt-in perceptual-hash layer
+for region crops that differ only slightly (a clock, a badge) between runs.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+
+def cache_key(provider: str, model: str, prompt: str, image_encoding: Optional[str] = None,
+              params: Optional[Dict[str, Any]] = None) -> str:
+    """Stable hash of everything that determines a (deterministic) response"""
+    h = hashlib.sha256()
+    header = json.dumps({"provider": provider, "model": model, "params": params or {}},
+                        sort_keys=True, ensure_ascii=False)
+    for part in (header, prompt, image_encoding or ""):
+        data = part.encode("utf-8")
+        # length-prefix every field so different splits never collide
+        h.update(len(data).to_bytes(8, "big"))
+        h.update(data)
+    return h.hexdigest()
+
+
+class MemoryLRU:
+    """Thread-safe in-memory LRU tier"""
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, created = item
+            if self.ttl is not None and time.time() - created > self.ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, created: Optional[float] = None):
+        with self._lock:
+            self._data[key] = (value, created if created is not None else time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class DiskCache:
+    """
+    SQLite-backed tier with TTL and least-recently-used eviction above `max_bytes`.
+
+    The total stored size is read once on open and then tracked per write, so a
+    `set` never scans the whole table. Access times of hits are buffered in memory
+    and written together with the next `set`, or once `flush_every` of them or
+    `flush_interval` seconds have piled up, so a hit does not commit a transaction.
+    """
+
+    def __init__(self, path: Path, max_bytes: int = 512 * 1024 * 1024, ttl: Optional[float] = 30 * 24 * 3600,
+                 flush_every: int = 64, flush_interval: float = 30.0):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._accessed: Dict[str, float] = {}
+        self._flushed_at = time.time()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_created ON responses(created)")
+        self._conn.commit()
+        self._total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def _delete(self, key: str, size: int):
+        self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+        self._accessed.pop(key, None)
+        self._total -= size
+
+    def _write_accessed(self, now: float):
+        """Write the buffered access times (the caller commits)"""
+        if self._accessed:
+            self._conn.executemany("UPDATE responses SET accessed = ? WHERE key = ?",
+                                   [(accessed, key) for key, accessed in self._accessed.items()])
+            self._accessed.clear()
+        self._flushed_at = now
+
+    def get(self, key: str) -> Optional[tuple]:
+        """Return (value, created) or None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created, size FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if self.ttl is not None and now - row[1] > self.ttl:
+                self._delete(key, row[2])
+                self._conn.commit()
+                return None
+            self._accessed[key] = now
+            if len(self._accessed) >= self.flush_every or now - self._flushed_at >= self.flush_interval:
+                self._write_accessed(now)
+                self._conn.commit()
+            return row[0], row[1]
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if old is not None:
+                self._total -= old[0]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self._total += size
+            self._accessed.pop(key, None)
+            self._write_accessed(now)  # eviction orders by accessed
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        if self.ttl is not None:
+            # only the expired rows are visited (created is indexed)
+            for key, size in self._conn.execute("SELECT key, size FROM responses WHERE created < ?",
+                                                (now - self.ttl,)).fetchall():
+                self._delete(key, size)
+        if self._total <= self.max_bytes:
+            return
+        cursor = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed")
+        while self._total > self.max_bytes:
+            rows = cursor.fetchmany(64)
+            if not rows:
+                break
+            for key, size in rows:
+                if self._total <= self.max_bytes:
+                    break
+                self._delete(key, size)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self._accessed.clear()
+            self._total = 0
+
+    def close(self):
+        with self._lock:
+            self._write_accessed(time.time())
+            self._conn.commit()
+            self._conn.close()
+
+
+class ResponseCache:
+    """Memory LRU in front of an optional disk tier"""
+
+    def __init__(self, disk_path: Optional[Path] = None, max_memory_entries: int = 1024,
+                 max_disk_bytes: int = 512 * 1024 * 1024, ttl: Optional[float] = 30 * 24 * 3600):
+        self.memory = MemoryLRU(max_memory_entries, ttl)
+        self.disk = DiskCache(disk_path, max_disk_bytes, ttl) if disk_path else None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()  # bots call the cache from worker threads
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            item = self.disk.get(key)
+            if item is not None:
+                value, created = item
+                self.memory.set(key, value, created)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: str):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+
+def dhash(image, hash_size: int = 8) -> int:
+    """
+    Difference hash of a PIL image: grayscale, shrink to (hash_size + 1) x hash_size
+    and compare horizontally adjacent pixels. Small local changes such as a clock or
+    a badge flip only a few of the 64 bits.
+    """
+    from PIL import Image
+
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def near_duplicate_context(bot, prompt: str) -> str:
+    """
+    Everything besides the crop that decides a region's code: provider, model(s) and
+    the full prompt (which carries the custom instructions). Near-duplicate entries
+    are only shared between calls with the same context.
+    """
+    models = [getattr(b, "model", None) for b in getattr(bot, "bots", [bot])]
+    return cache_key(getattr(bot, "provider", None), json.dumps(models), prompt)
+
+
+class NearDuplicateCache:
+    """
+    Reuses generated HTML for region crops that look (almost) the same as one seen before.
+
+    Opt-in per region type: only types listed in `enabled_types` are looked up or stored.
+    Entries are grouped by (region type, context) where the context is
+    `near_duplicate_context(bot, prompt)`, so a different model or prompt never gets
+    old code. A crop is a hit when the Hamming distance between its dHash and a stored
+    one is at most `max_distance`. Storing an identical hash replaces the entry, and
+    each group keeps at most `max_entries` (oldest dropped first), which bounds the
+    linear scan of a lookup. Hit/miss counters are kept per region type.
+    """
+
+    def __init__(self, enabled_types=(), max_distance: int = 4, disk_path: Optional[Path] = None,
+                 max_entries: int = 256):
+        self.enabled_types = set(enabled_types)
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self._entries: Dict[tuple, "OrderedDict[int, str]"] = {}
+        self._lock = threading.Lock()
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+        self._conn = None
+        if disk_path:
+            Path(disk_path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(disk_path), check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS near_duplicates (region_type TEXT NOT NULL, context TEXT NOT NULL,"
+                " phash TEXT NOT NULL, code TEXT NOT NULL, created REAL NOT NULL,"
+                " PRIMARY KEY (region_type, context, phash))"
+            )
+            self._conn.commit()
+            rows = self._conn.execute("SELECT region_type, context, phash, code FROM near_duplicates ORDER BY created")
+            for region_type, context, phash, code in rows:
+                self._add((region_type, context), int(phash, 16), code)
+
+    def enabled(self, region_type: Optional[str]) -> bool:
+        return region_type in self.enabled_types
+
+    def _add(self, group: tuple, phash: int, code: str) -> list:
+        """Insert or refresh an entry; returns the hashes dropped to stay within max_entries"""
+        entries = self._entries.setdefault(group, OrderedDict())
+        entries[phash] = code
+        entries.move_to_end(phash)
+        dropped = []
+        while len(entries) > self.max_entries:
+            dropped.append(entries.popitem(last=False)[0])
+        return dropped
+
+    def lookup(self, region_type: Optional[str], image, context: str = "") -> Optional[str]:
+        """Stored code for a near-identical crop of this region type and context, or None"""
+        if not self.enabled(region_type):
+            return None
+        phash = dhash(image)
+        best_code, best_distance = None, self.max_distance + 1
+        with self._lock:
+            for stored_hash, code in self._entries.get((region_type, context), {}).items():
+                distance = (phash ^ stored_hash).bit_count()
+                if distance < best_distance:
+                    best_code, best_distance = code, distance
+            counter = self.hits if best_code is not None else self.misses
+            counter[region_type] = counter.get(region_type, 0) + 1
+        return best_code
+
+    def store(self, region_type: Optional[str], image, code: str, context: str = ""):
+        if not self.enabled(region_type):
+            return
+        phash = dhash(image)
+        with self._lock:
+            dropped = self._add((region_type, context), phash, code)
+            if self._conn is not None:
+                self._conn.execute("INSERT OR REPLACE INTO near_duplicates (region_type, context, phash, code, created)"
+                                   " VALUES (?, ?, ?, ?, ?)",
+                                   (region_type, context, f"{phash:016x}", code, time.time()))
+                self._conn.executemany("DELETE FROM near_duplicates WHERE region_type = ? AND context = ? AND phash = ?",
+                                       [(region_type, context, f"{h:016x}") for h in dropped])
+                self._conn.commit()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {t: {"hits": self.hits.get(t, 0), "misses": self.misses.get(t, 0)}
+                    for t in sorted(set(self.hits) | set(self.misses))}
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
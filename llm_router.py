@@ -0,0 +1,160 @@
+"""
+Latency-aware routing over several provider bots.
+
+Each provider keeps a rolling window of call latencies and outcomes. Requests go to
+the fastest healthy provider; providers whose recent error rate is too high are
+skipped for a cool-down period. Optionally a request is hedged: if the primary has
+not answered within its p90 latency, the same request is sent to the runner-up and
+whichever answers first wins while the other is cancelled.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import List, Optional
+
+
+class ProviderStats:
+    """Rolling latency / error statistics for one provider"""
+
+    def __init__(self, window: int = 50):
+        self.latencies = deque(maxlen=window)  # successful calls only
+        self.outcomes = deque(maxlen=window)   # True for success
+        self.ejected_until = 0.0
+
+    def record(self, latency: float, ok: bool):
+        self.outcomes.append(ok)
+        if ok:
+            self.latencies.append(latency)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return 1 - sum(self.outcomes) / len(self.outcomes)
+
+    def summary(self) -> dict:
+        return {"p50": self.percentile(0.5), "p90": self.percentile(0.9),
+                "error_rate": self.error_rate, "samples": len(self.outcomes)}
+
+
+class ProviderRouter:
+    """
+    Bot-compatible front for several bots (Doubao/Qwen/GPT/Gemini).
+
+    Exposes `ask` / `ask_async` like a single Bot, so it can be handed to
+    html_generator or ScreenCoderPipeline unchanged.
+    """
+
+    provider = "router"
+
+    def __init__(self, bots: List, hedge: bool = False, window: int = 50, min_samples: int = 5,
+                 max_error_rate: float = 0.5, cooldown: float = 60.0, default_hedge_delay: float = 15.0):
+        if not bots:
+            raise ValueError("ProviderRouter needs at least one bot")
+        self.bots = list(bots)
+        self.hedge = hedge
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self.default_hedge_delay = default_hedge_delay
+        self.stats = {self._name(bot): ProviderStats(window) for bot in self.bots}
+
+    @staticmethod
+    def _name(bot) -> str:
+        return f"{bot.provider}:{getattr(bot, 'model', None)}"
+
+    def ranked(self) -> List:
+        """Healthy bots, fastest median first; providers without samples are tried first."""
+        now = time.monotonic()
+        healthy = [bot for bot in self.bots if self.stats[self._name(bot)].ejected_until <= now]
+        if not healthy:
+            # everything is cooling down: fall back to the least failing provider
+            healthy = sorted(self.bots, key=lambda bot: self.stats[self._name(bot)].error_rate)[:1]
+        return sorted(healthy, key=lambda bot: self.stats[self._name(bot)].percentile(0.5) or 0.0)
+
+    def _record(self, bot, latency: float, ok: bool):
+        stats = self.stats[self._name(bot)]
+        stats.record(latency, ok)
+        if len(stats.outcomes) >= self.min_samples and stats.error_rate > self.max_error_rate:
+            stats.ejected_until = time.monotonic() + self.cooldown
+            stats.outcomes.clear()
+            print(f"Router: {self._name(bot)} unhealthy, skipping it for {self.cooldown:.0f}s")
+
+    def _hedge_delay(self, bot) -> float:
+        return self.stats[self._name(bot)].percentile(0.9) or self.default_hedge_delay
+
+    async def _timed_async(self, bot, question, image_encoding, verbose, use_cache):
+        start = time.monotonic()
+        try:
+            response = await bot.ask_async(question, image_encoding, verbose, use_cache=use_cache)
+        except asyncio.CancelledError:
+            raise  # the hedge loser is not a failure
+        except Exception:
+            self._record(bot, time.monotonic() - start, ok=False)
+            raise
+        self._record(bot, time.monotonic() - start, ok=True)
+        return response
+
+    def ask(self, question, image_encoding=None, verbose=False, use_cache=True):
+        """Blocking ask on the fastest healthy provider, failing over to the next one."""
+        last_error = None
+        for bot in self.ranked():
+            start = time.monotonic()
+            try:
+                response = bot.ask(question, image_encoding, verbose, use_cache=use_cache)
+            except Exception as e:
+                self._record(bot, time.monotonic() - start, ok=False)
+                print(f"Router: {self._name(bot)} failed ({e}), trying next provider")
+                last_error = e
+                continue
+            self._record(bot, time.monotonic() - start, ok=True)
+            return response
+        raise last_error
+
+    async def ask_async(self, question, image_encoding=None, verbose=False, use_cache=True):
+        candidates = self.ranked()
+        primary = candidates[0]
+        call = lambda bot: self._timed_async(bot, question, image_encoding, verbose, use_cache)
+
+        if not self.hedge or len(candidates) < 2:
+            try:
+                return await call(primary)
+            except Exception:
+                if len(candidates) < 2:
+                    raise
+                return await call(candidates[1])
+
+        first = asyncio.ensure_future(call(primary))
+        done, _ = await asyncio.wait({first}, timeout=self._hedge_delay(primary))
+        if done and not first.exception():
+            return first.result()
+
+        # primary is slow (or already failed): race it against the runner-up
+        second = asyncio.ensure_future(call(candidates[1]))
+        pending = {second} if done else {first, second}
+        last_error = first.exception() if done else None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    last_error = task.exception()
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def ask_stream_async(self, question, image_encoding=None, use_cache=True):
+        """Routed answer as a single chunk, so the router can stand in for a streaming bot"""
+        yield await self.ask_async(question, image_encoding, use_cache=use_cache)
+
+    def summary(self) -> dict:
+        return {name: stats.summary() for name, stats in self.stats.items()}
@@ -0,0 +1,224 @@
+"""
+Async request scheduler for the per-component LLM calls.
+
+Every provider gets its own concurrency cap and token-bucket rate limiter, so a
+page with many leaf regions no longer fires one request per region at once.
+Failed attempts with a retryable status (429 / 5xx), timeouts or SDK transport
+errors are retried with jittered exponential backoff, and each request can carry
+an absolute deadline. Timed-out attempts are cancelled through the providers'
+native async clients; calls that can only run in a thread keep their slot until
+the thread returns, so the per-provider cap counts real in-flight requests. The
+time left for an attempt is published through `request_timeout()`, which the bots
+pass to their SDK call, so a call running in a thread also ends on time.
+"""
+
+import asyncio
+import contextvars
+import functools
+import importlib
+import random
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+_request_timeout: contextvars.ContextVar = contextvars.ContextVar("request_timeout", default=None)
+
+# Transport-level failures (no HTTP status) of the provider SDKs; none of these
+# derive from the builtin ConnectionError, so they are matched by type.
+TRANSIENT_ERRORS = [
+    ("httpx", "TransportError"),  # connect/read timeouts, network errors
+    ("openai", "APIConnectionError"),  # includes APITimeoutError
+    ("volcenginesdkarkruntime._exceptions", "ArkAPIConnectionError"),
+    ("requests.exceptions", "ConnectionError"),
+    ("requests.exceptions", "Timeout"),
+]
+
+
+@dataclass
+class ProviderLimits:
+    """Scheduling limits for one provider"""
+    max_concurrency: int = 4
+    requests_per_second: float = 2.0
+    burst: int = 4
+    max_retries: int = 4
+    base_delay: float = 1.0
+    max_delay: float = 30.0
+    request_timeout: float = 180.0  # per attempt, in seconds
+
+
+DEFAULT_LIMITS: Dict[str, ProviderLimits] = {
+    "doubao": ProviderLimits(max_concurrency=4, requests_per_second=1.0, burst=4),
+    "qwen": ProviderLimits(max_concurrency=4, requests_per_second=2.0, burst=4),
+    "gpt": ProviderLimits(max_concurrency=8, requests_per_second=4.0, burst=8),
+    "gemini": ProviderLimits(max_concurrency=4, requests_per_second=1.0, burst=2),
+}
+
+
+def request_timeout() -> Optional[float]:
+    """Seconds left for the current RequestScheduler attempt, or None outside of one"""
+    return _request_timeout.get()
+
+
+class TokenBucket:
+    """Token-bucket rate limiter: `rate` tokens per second, at most `capacity` stored"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def status_code_of(error: BaseException) -> Optional[int]:
+    """Best-effort HTTP status of a provider SDK exception (openai/ark, google api_core, requests)"""
+    for candidate in (getattr(error, "status_code", None),
+                      getattr(error, "code", None),
+                      getattr(getattr(error, "response", None), "status_code", None)):
+        if isinstance(candidate, int):
+            return candidate
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def transient_error_types() -> tuple:
+    """TRANSIENT_ERRORS of the SDKs that are installed, plus the builtin timeout/connection errors"""
+    types = [asyncio.TimeoutError, TimeoutError, ConnectionError]
+    for module_name, name in TRANSIENT_ERRORS:
+        try:
+            error_type = getattr(importlib.import_module(module_name), name, None)
+        except ImportError:
+            continue
+        if isinstance(error_type, type):
+            types.append(error_type)
+    return tuple(types)
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, transient_error_types()):
+        return True
+    status = status_code_of(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    message = str(error).lower()
+    return "rate_limit" in message or "rate limit" in message or "429" in message
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class RequestScheduler:
+    """
+    Schedules async provider calls under per-provider limits.
+
+    Semaphores and locks bind to the running event loop, so create one
+    scheduler per loop (e.g. per `asyncio.run`).
+    """
+
+    def __init__(self, limits: Optional[Dict[str, ProviderLimits]] = None):
+        self.limits = {**DEFAULT_LIMITS, **(limits or {})}
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def limits_for(self, provider: str) -> ProviderLimits:
+        if provider not in self.limits:
+            self.limits[provider] = ProviderLimits()
+        return self.limits[provider]
+
+    def _semaphore(self, provider: str) -> asyncio.Semaphore:
+        if provider not in self._semaphores:
+            self._semaphores[provider] = asyncio.Semaphore(self.limits_for(provider).max_concurrency)
+        return self._semaphores[provider]
+
+    def _bucket(self, provider: str) -> TokenBucket:
+        if provider not in self._buckets:
+            limits = self.limits_for(provider)
+            self._buckets[provider] = TokenBucket(limits.requests_per_second, limits.burst)
+        return self._buckets[provider]
+
+    async def submit(self, provider: str, call: Callable[[], Awaitable],
+                     deadline: Optional[float] = None):
+        """
+        Run `call()` under the provider's limits and retry policy.
+
+        `deadline` is an absolute `time.monotonic()` timestamp; once it passes no
+        further attempt is made and `asyncio.TimeoutError` is raised.
+        """
+        limits = self.limits_for(provider)
+        semaphore = self._semaphore(provider)
+        bucket = self._bucket(provider)
+
+        for attempt in range(limits.max_retries + 1):
+            timeout = limits.request_timeout
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.monotonic())
+                if timeout <= 0:
+                    raise asyncio.TimeoutError(f"{provider} request deadline exceeded")
+
+            try:
+                async with semaphore:
+                    await bucket.acquire()
+                    if deadline is not None:
+                        timeout = min(timeout, deadline - time.monotonic())
+                    token = _request_timeout.set(max(timeout, 0.001))
+                    try:
+                        return await asyncio.wait_for(call(), timeout=timeout)
+                    finally:
+                        _request_timeout.reset(token)
+            except Exception as e:
+                if attempt >= limits.max_retries or not is_retryable(e):
+                    raise
+                # full jitter, but never sooner than the provider asked us to wait
+                delay = random.uniform(0, min(limits.max_delay, limits.base_delay * 2 ** attempt))
+                delay = max(delay, _retry_after(e) or 0)
+                if deadline is not None:
+                    delay = min(delay, max(0.0, deadline - time.monotonic()))
+                print(f"{provider} request failed ({e}), retrying in {delay:.1f}s "
+                      f"(attempt {attempt + 1}/{limits.max_retries})")
+                await asyncio.sleep(delay)
+
+
+async def run_blocking(func, *args):
+    """
+    asyncio.to_thread that stays accountable when cancelled.
+
+    A worker thread cannot be interrupted, so on cancellation (e.g. a wait_for
+    timeout in RequestScheduler.submit) this waits for the thread to return
+    before re-raising; the caller's concurrency slot is held until the HTTP
+    call has really ended. The thread runs in a copy of the caller's context, so
+    it sees `request_timeout()`.
+    """
+    context = contextvars.copy_context()
+    future = asyncio.get_running_loop().run_in_executor(None, functools.partial(context.run, func, *args))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await asyncio.wait([future])
+        if not future.cancelled():
+            future.exception()  # the caller has given up on the result; retrieve it so it is not logged
+        raise
+
+
+async def ask_bot(bot, question, image_encoding=None):
+    """Await a bot answer without blocking the event loop (natively async where the bot supports it)"""
+    if hasattr(bot, "ask_async"):
+        return await bot.ask_async(question, image_encoding)
+    return await run_blocking(bot.ask, question, image_encoding)
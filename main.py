@@ -1,3 +1,5 @@
+import argparse
+import asyncio
 import subprocess
 import sys
 import os
@@ -36,10 +38,8 @@ def run_script(script_path):
         print(f"An unexpected error occurred while running '{script_path}': {e}")
         sys.exit(1)
 
-def main():
-    """Main function to run the entire Screencoder workflow."""
-    print("Starting the Screencoder full workflow...")
-
+def run_legacy_workflow():
+    """The original workflow: every stage as a separate script, exchanging files under data/tmp."""
     # --- Part 1: Initial Generation with Placeholders ---
     print("\n--- Part 1: Initial Generation with Placeholders ---")
     run_script("block_parsor.py")
@@ -52,7 +52,30 @@ def main():
     run_script("mapping.py")
     run_script("image_replacer.py")
 
+def main():
+    """Main function to run the entire Screencoder workflow."""
+    parser = argparse.ArgumentParser(description="Run the entire Screencoder workflow")
+    parser.add_argument("--image", default="data/input/test1.png")
+    parser.add_argument("--output-html", default="data/output/test1_layout_final.html")
+    parser.add_argument("--api-key", default="doubao_api.txt")
+    parser.add_argument("--legacy", action="store_true", help="run the stages as separate scripts (subprocesses)")
+    args = parser.parse_args()
+
+    print("Starting the Screencoder full workflow...")
+
+    if args.legacy:
+        run_legacy_workflow()
+    else:
+        # All stages in this process; UIED runs concurrently with the LLM stages
+        from pipeline import run_pipeline
+        from llm_cache import ResponseCache
+        from utils import Doubao
+
+        cache = ResponseCache(disk_path="data/cache/llm_responses.sqlite")
+        bot = Doubao(args.api_key, cache=cache)  # Change your models according to your needs: Qwen, GPT, Gemini
+        asyncio.run(run_pipeline(args.image, bot, args.output_html))
+
     print("\nScreencoder workflow completed successfully!")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -10,6 +10,13 @@ from scipy.spatial.distance import cdist
 from scipy.optimize import linear_sum_assignment
 import sys
 
+from image_handle import ImageHandle
+
+UIED_DIR = Path(__file__).resolve().parent / "UIED"
+if str(UIED_DIR) not in sys.path:
+    sys.path.insert(0, str(UIED_DIR))
+import detect_compo.lib_ip.file_utils as file_utils
+
 CIOU_STRICT = -0.9      # Min CIoU score for a valid one-to-one mapping
 FILTER_MIN_WH = 10     # UIED filter: ignore boxes smaller than this
 
@@ -73,25 +80,60 @@ def load_regions_and_placeholders(p: Path, W_img, H_img):
     proportional bbox values, which are converted to absolute pixel values.
     """
     data = json.loads(p.read_text())
+    regions, placeholders = regions_and_placeholders_to_pixels(data, W_img, H_img)
     
+    if not regions or not placeholders:
+        print(f"Warning: JSON file {p} does not contain 'regions' or 'placeholders' keys.")
+        
+    return regions, placeholders
+
+def regions_and_placeholders_to_pixels(data, W_img, H_img):
+    """Same as load_regions_and_placeholders for an in-memory {'regions', 'placeholders'} dict"""
     def to_pixels(b):
         return (b['x']*W_img, b['y']*H_img, b['w']*W_img, b['h']*H_img)
 
     regions = [{**d, "bbox": to_pixels(d)} for d in data.get("regions", [])]
     placeholders = [{**d, "bbox": to_pixels(d)} for d in data.get("placeholders", [])]
-    
-    if not regions or not placeholders:
-        print(f"Warning: JSON file {p} does not contain 'regions' or 'placeholders' keys.")
-        
     return regions, placeholders
 
+def pixel_boxes(boxes):
+    """Attach an (x, y, w, h) 'bbox' to boxes already in screenshot pixels (image_box_detection.scale_to_screenshot)"""
+    return [{**b, "bbox": (b["x"], b["y"], b["w"], b["h"])} for b in boxes]
+
 def load_uied_boxes(p: Path):
     """
     Loads UIED component detection data.
     The JSON file is expected to contain the shape of the image that was
     processed, which is crucial for calculating scaling factors later.
     """
-    data = json.loads(p.read_text())
+    return uied_boxes_from_data(load_uied_data(p))
+
+def load_uied_data(p: Path):
+    """A UIED result file in any of UIED's output formats (JSON, msgpack or records; file_utils.save_output)"""
+    return file_utils.load_output(p)
+
+# fixed-width row layout of a UIED component table (see artifact_store), shared
+# with the records output format of UIED's file_utils
+UIED_DTYPE = file_utils.COMPO_DTYPE
+
+def uied_records(data):
+    """UIED result (file_utils.corners_dict) -> UIED_DTYPE record array"""
+    compos = data.get("compos", [])
+    records = np.zeros(len(compos), dtype=UIED_DTYPE)
+    for i, c in enumerate(compos):
+        records[i] = (c["id"], str(c.get("class", "")).encode()[:16], c["column_min"], c["row_min"],
+                      c["column_max"], c["row_max"], c["width"], c["height"])
+    return records
+
+def uied_data_from_records(records, img_shape):
+    """Inverse of uied_records: the corners_dict structure the mapping and cropping code take"""
+    compos = [{"id": i, "class": cls.decode(), "column_min": x1, "row_min": y1, "column_max": x2, "row_max": y2,
+               "width": w, "height": h}
+              for i, cls, x1, y1, x2, y2, w, h in records.tolist()]
+    return {"img_shape": list(img_shape) if img_shape is not None else None, "compos": compos}
+
+def uied_boxes_from_data(data):
+    """Same as load_uied_boxes for an in-memory UIED result (file_utils.corners_dict)"""
     compos = data.get("compos", [])
     shape = data.get("img_shape")  # e.g., [800, 571, 3]
 
@@ -192,9 +234,11 @@ def generate_debug_overlay(img_path, all_uied_boxes, region_results, uied_shape,
     """
     Generates a debug image by drawing the mapped UIED boxes on the original screenshot.
     This version uses a simple scaling based on image dimensions, without any translation.
+    `img_path` may also be an already decoded ImageHandle.
     """
-    canvas = cv2.imread(str(img_path))
-    if canvas is None:
+    try:
+        canvas = ImageHandle.coerce(img_path).bgr.copy()
+    except ValueError:
         print(f"Error: Could not read debug source image at {img_path}.")
         return
 
@@ -227,26 +271,11 @@ def generate_debug_overlay(img_path, all_uied_boxes, region_results, uied_shape,
     cv2.imwrite(str(out_png), canvas)
 
 
-def main(args):
-    # 1. Load the original screenshot to get its absolute dimensions
-    if not args.debug_src or not args.debug_src.exists():
-        sys.exit("Error: A valid --debug-src image path must be provided for coordinate conversion.")
-    
-    orig_img = cv2.imread(str(args.debug_src))
-    if orig_img is None:
-        sys.exit(f"Error: Could not read debug source image at {args.debug_src}.")
-    H_orig, W_orig, _ = orig_img.shape
-
-    # 2. Load proportional data and convert to absolute pixel coordinates
-    pixel_regions, pixel_placeholders = load_regions_and_placeholders(args.gray, W_orig, H_orig)
-    
-    # 3. Load UIED data
-    all_uied_boxes, uied_shape = load_uied_boxes(args.uied)
-    
-    if not pixel_placeholders or not all_uied_boxes:
-        print("Error: Could not proceed without placeholder and UIED data.")
-        return
-
+def compute_mapping(pixel_regions, pixel_placeholders, all_uied_boxes, uied_shape, W_orig, H_orig):
+    """
+    Map placeholders to UIED boxes region by region.
+    Returns {region_id: {'transform': {...}, 'mapping': {placeholder_id: uied_id}}}.
+    """
     # 4. Estimate a GLOBAL transform for rough, initial alignment of all UIED boxes
     g_scale_x, g_scale_y, g_dx, g_dy = estimate_global_transform(pixel_placeholders, all_uied_boxes, uied_shape, W_orig, H_orig)
     print(f"Estimated Global Transform: scale_x={g_scale_x:.3f}, scale_y={g_scale_y:.3f}, dx={g_dx:.1f}, dy={g_dy:.1f}")
@@ -291,9 +320,35 @@ def main(args):
                 "mapping": region_mapping
             }
 
-    # 6. Report and save results
     print(f"Successfully created {total_mappings_count} one-to-one mappings out of {total_placeholders_count} placeholders.")
+    return final_results
+
+
+def main(args):
+    # 1. Load the original screenshot to get its absolute dimensions
+    if not args.debug_src or not args.debug_src.exists():
+        sys.exit("Error: A valid --debug-src image path must be provided for coordinate conversion.")
+    
+    try:
+        orig_img = ImageHandle.open(args.debug_src)
+    except ValueError:
+        sys.exit(f"Error: Could not read debug source image at {args.debug_src}.")
+    W_orig, H_orig = orig_img.size
+
+    # 2. Load proportional data and convert to absolute pixel coordinates
+    pixel_regions, pixel_placeholders = load_regions_and_placeholders(args.gray, W_orig, H_orig)
+    
+    # 3. Load UIED data
+    all_uied_boxes, uied_shape = load_uied_boxes(args.uied)
+    
+    if not pixel_placeholders or not all_uied_boxes:
+        print("Error: Could not proceed without placeholder and UIED data.")
+        return
+
+    # 4-5. Global alignment, then per-region matching
+    final_results = compute_mapping(pixel_regions, pixel_placeholders, all_uied_boxes, uied_shape, W_orig, H_orig)
 
+    # 6. Report and save results
     args.out.write_text(json.dumps(final_results, indent=2, ensure_ascii=False))
     print(f"Mapping data written to {args.out}")
     
@@ -301,7 +356,7 @@ def main(args):
         if not args.debug_src or not args.debug_src.exists():
             print("Error: A valid --debug-src image path must be provided when using --debug.")
             return
-        generate_debug_overlay(args.debug_src, all_uied_boxes, final_results, uied_shape, args.debug)
+        generate_debug_overlay(orig_img, all_uied_boxes, final_results, uied_shape, args.debug)
         print(f"Debug image written to {args.debug}")
 
 if __name__ == "__main__":
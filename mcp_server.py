@@ -31,7 +31,10 @@ from mcp.types import (
 )
 
 # ScreenCoder 核心模块导入
-from screencoder_core import ScreenCoderPipeline, ScreenCoderConfig
+from screencoder_core import ScreenCoderManager, ScreenCoderConfig
+from job_queue import JobQueue, PRIORITY_NORMAL, format_status
+from error_handler import TaskStatus
+from utils import client_registry
 
 # 设置日志
 logging.basicConfig(level=logging.INFO)
@@ -40,7 +43,10 @@ logger = logging.getLogger(__name__)
 class ScreenCoderMCPServer:
     def __init__(self):
         self.server = Server("screencoder")
-        self.pipeline = None
+        # 管道池：并发调用各自借出管道，工作目录互相隔离
+        self.manager = ScreenCoderManager()
+        # 转换作业排队执行，按资源类别限制并发
+        self.jobs = JobQueue()
         self.setup_handlers()
     
     def setup_handlers(self):
@@ -75,6 +81,16 @@ class ScreenCoderMCPServer:
                                         "navigation": {"type": "string"},
                                         "main_content": {"type": "string"}
                                     }
+                                },
+                                "background": {
+                                    "type": "boolean",
+                                    "description": "后台执行：立即返回作业ID，之后用 job_status / job_result 查询",
+                                    "default": False
+                                },
+                                "priority": {
+                                    "type": "integer",
+                                    "description": "作业优先级，数值越小越先执行",
+                                    "default": PRIORITY_NORMAL
                                 }
                             },
                             "required": ["image"]
@@ -116,6 +132,33 @@ class ScreenCoderMCPServer:
                             },
                             "required": ["image", "component_type"]
                         }
+                    ),
+                    Tool(
+                        name="job_status",
+                        description="查询后台作业的状态和进度",
+                        inputSchema={
+                            "type": "object",
+                            "properties": {
+                                "job_id": {"type": "string", "description": "作业ID"}
+                            },
+                            "required": ["job_id"]
+                        }
+                    ),
+                    Tool(
+                        name="job_result",
+                        description="获取后台作业的结果，可等待作业完成",
+                        inputSchema={
+                            "type": "object",
+                            "properties": {
+                                "job_id": {"type": "string", "description": "作业ID"},
+                                "wait_seconds": {
+                                    "type": "number",
+                                    "description": "最多等待的秒数，期间作业完成则直接返回结果",
+                                    "default": 0
+                                }
+                            },
+                            "required": ["job_id"]
+                        }
                     )
                 ]
             )
@@ -130,6 +173,10 @@ class ScreenCoderMCPServer:
                     return await self._analyze_layout(request.arguments)
                 elif request.name == "generate_component_code":
                     return await self._generate_component_code(request.arguments)
+                elif request.name == "job_status":
+                    return self._job_status(request.arguments)
+                elif request.name == "job_result":
+                    return await self._job_result(request.arguments)
                 else:
                     raise ValueError(f"Unknown tool: {request.name}")
             
@@ -152,25 +199,33 @@ class ScreenCoderMCPServer:
                 custom_instructions=args.get("custom_instructions", {})
             )
             
-            # 初始化管道
-            if not self.pipeline:
-                self.pipeline = ScreenCoderPipeline(config)
+            async def convert(ctx):
+                # 执行转换，组件代码逐个完成时上报进度
+                def report_progress(event):
+                    message = f"组件 {event['type']} 已生成 ({event['completed']}/{event['total']})"
+                    ctx.progress(0.1 + 0.8 * event["completed"] / event["total"], message)
+                    logger.info(message)
+                
+                ctx.progress(0.0, "开始转换")
+                async with self.manager.lease(config) as pipeline:
+                    result = await pipeline.process_screenshot(image, progress_callback=report_progress)
+                if not result["success"]:
+                    raise RuntimeError(result["error"])
+                
+                return CallToolResult(
+                    content=[
+                        TextContent(
+                            type="text", 
+                            text=f"✅ 成功生成HTML代码！\n\n**布局分析结果:**\n{result['layout_info']}\n\n**生成的HTML文件:** {result['html_path']}"
+                        ),
+                        TextContent(
+                            type="text",
+                            text=f"```html\n{result['html_content']}\n```"
+                        )
+                    ]
+                )
             
-            # 执行转换
-            result = await self.pipeline.process_screenshot(image)
-            
-            return CallToolResult(
-                content=[
-                    TextContent(
-                        type="text", 
-                        text=f"✅ 成功生成HTML代码！\n\n**布局分析结果:**\n{result['layout_info']}\n\n**生成的HTML文件:** {result['html_path']}"
-                    ),
-                    TextContent(
-                        type="text",
-                        text=f"```html\n{result['html_content']}\n```"
-                    )
-                ]
-            )
+            return await self._submit(convert, args, "llm", "screenshot_to_html")
             
         except Exception as e:
             logger.error(f"Screenshot to HTML error: {str(e)}")
@@ -188,12 +243,12 @@ class ScreenCoderMCPServer:
             # 配置参数
             config = ScreenCoderConfig(model=args.get("model", "doubao"))
             
-            # 初始化管道
-            if not self.pipeline:
-                self.pipeline = ScreenCoderPipeline(config)
-            
             # 执行布局分析
-            layout_result = await self.pipeline.analyze_layout_only(image)
+            async def analyze(ctx):
+                async with self.manager.lease(config) as pipeline:
+                    return await pipeline.analyze_layout_only(image)
+            
+            layout_result = await self.jobs.run(analyze, "llm", name="analyze_layout")
             
             return CallToolResult(
                 content=[
@@ -220,22 +275,22 @@ class ScreenCoderMCPServer:
             # 配置参数
             config = ScreenCoderConfig(model=args.get("model", "doubao"))
             
-            # 初始化管道
-            if not self.pipeline:
-                self.pipeline = ScreenCoderPipeline(config)
-            
             # 生成组件代码
-            component_result = await self.pipeline.generate_component_code(
-                image, 
-                args["component_type"],
-                args.get("custom_instruction", "")
-            )
+            async def generate(ctx):
+                async with self.manager.lease(config) as pipeline:
+                    return await pipeline.generate_component_code(
+                        image, 
+                        args["component_type"],
+                        args.get("custom_instruction", "")
+                    )
+            
+            component_result = await self.jobs.run(generate, "llm", name="generate_component_code")
             
             return CallToolResult(
                 content=[
                     TextContent(
                         type="text",
-                        text=f"[object Object]args['component_type']} 组件代码生成完成**"
+                        text=f"🧩 **{args['component_type']} 组件代码生成完成**"
                     ),
                     TextContent(
                         type="text",
@@ -250,6 +305,37 @@ class ScreenCoderMCPServer:
                 content=[TextContent(type="text", text=f"❌ 组件代码生成失败: {str(e)}")]
             )
     
+    async def _submit(self, job, args: Dict[str, Any], resource: str, name: str) -> CallToolResult:
+        """提交到作业队列；background 时立即返回作业ID，否则等待结果"""
+        priority = int(args.get("priority", PRIORITY_NORMAL))
+        if args.get("background"):
+            job_id = await self.jobs.submit(job, resource, priority, name)
+            return CallToolResult(
+                content=[TextContent(type="text", text=f"⏳ 已提交后台作业 {job_id}，可用 job_status / job_result 查询进度和结果")]
+            )
+        return await self.jobs.run(job, resource, priority, name)
+    
+    def _job_status(self, args: Dict[str, Any]) -> CallToolResult:
+        """查询作业状态"""
+        try:
+            status = self.jobs.status(args["job_id"])
+            return CallToolResult(content=[TextContent(type="text", text=format_status(status))])
+        except ValueError as e:
+            return CallToolResult(content=[TextContent(type="text", text=f"❌ {str(e)}")])
+    
+    async def _job_result(self, args: Dict[str, Any]) -> CallToolResult:
+        """获取作业结果，未完成时返回当前状态"""
+        try:
+            info = await self.jobs.wait(args["job_id"], float(args.get("wait_seconds", 0)))
+        except ValueError as e:
+            return CallToolResult(content=[TextContent(type="text", text=f"❌ {str(e)}")])
+        
+        if info.status == TaskStatus.COMPLETED:
+            return info.result
+        return CallToolResult(
+            content=[TextContent(type="text", text=format_status(self.jobs.status(args["job_id"])))]
+        )
+    
     async def _configure_api_keys(self, args: Dict[str, Any]) -> CallToolResult:
         """配置API密钥"""
         try:
@@ -283,19 +369,26 @@ async def main():
     server_instance = ScreenCoderMCPServer()
     
     # 使用stdio运行服务器
-    async with stdio_server() as (read_stream, write_stream):
-        await server_instance.server.run(
-            read_stream,
-            write_stream,
-            InitializationOptions(
-                server_name="screencoder",
-                server_version="1.0.0",
-                capabilities=server_instance.server.get_capabilities(
-                    notification_options=None,
-                    experimental_capabilities=None,
+    try:
+        async with stdio_server() as (read_stream, write_stream):
+            await server_instance.server.run(
+                read_stream,
+                write_stream,
+                InitializationOptions(
+                    server_name="screencoder",
+                    server_version="1.0.0",
+                    capabilities=server_instance.server.get_capabilities(
+                        notification_options=None,
+                        experimental_capabilities=None,
+                    )
                 )
             )
-        )
+    finally:
+        # 取消未完成的作业，关闭共享的浏览器、清理池中管道的工作目录
+        await server_instance.jobs.close()
+        await server_instance.manager.aclose()
+        # 关闭所有机器人共享的连接池
+        await client_registry.aclose()
 
 if __name__ == "__main__":
     asyncio.run(main())
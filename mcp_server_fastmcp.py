@@ -11,12 +11,16 @@ import os
 import tempfile
 from pathlib import Path
 from typing import Any, Dict, List
-from PIL import Image, ImageDraw, ImageFont
 import cv2
 import numpy as np
 
 from mcp.server.fastmcp import FastMCP
 
+from job_queue import JobQueue, PRIORITY_NORMAL, format_status
+from image_handle import ImageHandle
+from image_workers import run_on_image, save_crop, draw_region_overlay, shutdown_pool
+from error_handler import TaskStatus
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -25,20 +29,70 @@ logger = logging.getLogger(__name__)
 WORK_DIR = Path(tempfile.mkdtemp(prefix="screencoder_session_"))
 logger.info(f"工作目录已创建: {WORK_DIR}")
 
+# 图像处理作业排队执行（CPU 类别，限制同时处理的图片数）
+JOBS = JobQueue()
+
 # 创建FastMCP服务器
 mcp = FastMCP("ScreenCoder")
 
 @mcp.tool()
-def process_image_from_path(image_path: str) -> str:
+async def process_image_from_path(image_path: str, background: bool = False, priority: int = PRIORITY_NORMAL) -> str:
     """
     处理本地文件路径指定的UI截图，分析布局，裁剪区域，并返回一个包含所有文件路径的任务清单。
     
     Args:
         image_path: 要处理的图片的本地绝对文件路径
+        background: 后台执行，立即返回作业ID，之后用 job_status / job_result 查询
+        priority: 作业优先级，数值越小越先执行
         
     Returns:
         包含任务清单的JSON字符串
     """
+    async def process(ctx):
+        return await _process_image(image_path, ctx.progress)
+    
+    try:
+        if background:
+            job_id = await JOBS.submit(process, "cpu", priority, "process_image_from_path")
+            return f"已提交后台作业 {job_id}，可用 job_status / job_result 查询进度和结果"
+        return await JOBS.run(process, "cpu", priority, "process_image_from_path")
+    except Exception as e:
+        logger.error(f"Processing error: {str(e)}")
+        return f"处理失败: {str(e)}"
+
+@mcp.tool()
+def job_status(job_id: str) -> str:
+    """
+    查询后台作业的状态和进度
+    
+    Args:
+        job_id: 作业ID
+    """
+    try:
+        return format_status(JOBS.status(job_id))
+    except ValueError as e:
+        return f"错误：{str(e)}"
+
+@mcp.tool()
+async def job_result(job_id: str, wait_seconds: float = 0) -> str:
+    """
+    获取后台作业的结果，未完成时返回当前状态
+    
+    Args:
+        job_id: 作业ID
+        wait_seconds: 最多等待的秒数，期间作业完成则直接返回结果
+    """
+    try:
+        info = await JOBS.wait(job_id, wait_seconds)
+    except ValueError as e:
+        return f"错误：{str(e)}"
+    if info.status == TaskStatus.COMPLETED:
+        return info.result
+    return format_status(JOBS.status(job_id))
+
+async def _process_image(image_path: str, progress=None) -> str:
+    """图像处理本体：每次调用写入工作目录下独立的子目录；裁剪和绘制在进程池中执行"""
+    progress = progress or (lambda fraction, message=None: None)
     try:
         # 1. 从本地路径加载图片
         img_path = Path(image_path)
@@ -47,17 +101,17 @@ def process_image_from_path(image_path: str) -> str:
         
         logger.info(f"开始处理图片: {img_path}")
         
-        # 加载图片
-        image = cv2.imread(str(img_path))
-        if image is None:
+        # 加载图片（解码放到线程中，只解码一次，放入共享内存）
+        try:
+            image = await asyncio.to_thread(ImageHandle.open, img_path, shared=True)
+        except ValueError:
             return f"错误：无法加载图片: {image_path}"
         
-        height, width = image.shape[:2]
+        width, height = image.size
         logger.info(f"图片尺寸: {width}x{height}")
+        progress(0.1, "图片已加载")
         
         # 2. 图像布局分析 - 简化版本，检测主要区域
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        
         # 使用简单的区域分割
         regions = [
             {"name": "header", "bbox": [0, 0, width, height//6]},
@@ -65,54 +119,45 @@ def process_image_from_path(image_path: str) -> str:
             {"name": "main_content", "bbox": [width//4, height//6, width*3//4, height*5//6]},
             {"name": "sidebar", "bbox": [width*3//4, height//6, width, height*5//6]}
         ]
+        for region in regions:
+            # 确保坐标在图片范围内
+            x1, y1, x2, y2 = region["bbox"]
+            region["bbox"] = [max(0, x1), max(0, y1), min(width, x2), min(height, y2)]
         
-        # 3. 裁剪并保存区域图片
-        cropped_dir = WORK_DIR / "cropped_images"
+        # 3. 裁剪并保存区域图片（每次调用独立的子目录，并发作业互不覆盖）
+        job_dir = Path(tempfile.mkdtemp(prefix="job_", dir=WORK_DIR))
+        cropped_dir = job_dir / "cropped_images"
         cropped_dir.mkdir(exist_ok=True)
         
         cropped_files = []
         for i, region in enumerate(regions):
             x1, y1, x2, y2 = region["bbox"]
-            # 确保坐标在图片范围内
-            x1, y1 = max(0, x1), max(0, y1)
-            x2, y2 = min(width, x2), min(height, y2)
-            
             if x2 > x1 and y2 > y1:  # 确保区域有效
-                cropped = image[y1:y2, x1:x2]
-                crop_filename = f"region_{i}_{region['name']}.png"
-                crop_path = cropped_dir / crop_filename
-                cv2.imwrite(str(crop_path), cropped)
-                
+                crop_path = cropped_dir / f"region_{i}_{region['name']}.png"
                 cropped_files.append({
                     "region_id": i,
                     "name": region["name"],
                     "file_path": str(crop_path),
                     "bbox": [x1, y1, x2, y2]
                 })
-                logger.info(f"保存裁剪图片: {crop_path}")
-        
-        # 4. 创建并保存manifest图片（带标注的原图）
-        manifest_image = image.copy()
-        for i, region in enumerate(regions):
-            x1, y1, x2, y2 = region["bbox"]
-            x1, y1 = max(0, x1), max(0, y1)
-            x2, y2 = min(width, x2), min(height, y2)
-            
-            # 绘制边框
-            cv2.rectangle(manifest_image, (x1, y1), (x2, y2), (0, 255, 0), 2)
-            # 添加标签
-            cv2.putText(manifest_image, f"{i}: {region['name']}", 
-                       (x1, y1-10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
         
-        manifest_path = WORK_DIR / "layout_manifest.png"
-        cv2.imwrite(str(manifest_path), manifest_image)
+        # 4. 创建并保存manifest图片（带标注的原图），与裁剪在不同的进程中并行执行
+        manifest_path = job_dir / "layout_manifest.png"
+        with image:
+            await asyncio.gather(
+                *(run_on_image(image, save_crop, crop["bbox"], crop["file_path"]) for crop in cropped_files),
+                run_on_image(image, draw_region_overlay, regions, str(manifest_path)),
+            )
+        for crop in cropped_files:
+            logger.info(f"保存裁剪图片: {crop['file_path']}")
         logger.info(f"保存manifest图片: {manifest_path}")
+        progress(0.9, "区域图片和清单图片已保存")
         
         # 5. 创建任务清单
         task_manifest = {
             "original_image": str(img_path),
             "manifest_image": str(manifest_path),
-            "work_directory": str(WORK_DIR),
+            "work_directory": str(job_dir),
             "regions": cropped_files,
             "total_regions": len(cropped_files)
         }
@@ -130,6 +175,7 @@ if __name__ == "__main__":
         mcp.run()
     except KeyboardInterrupt:
         logger.info("服务器已关闭。")
+        shutdown_pool()
         import shutil
         if WORK_DIR.exists():
             shutil.rmtree(WORK_DIR)
@@ -11,8 +11,7 @@ import os
 import tempfile
 from pathlib import Path
 from typing import Any, Dict, List
-from PIL import Image, ImageDraw, ImageFont
-import cv2
+from PIL import Image
 import numpy as np
 
 # MCP 相关导入
@@ -28,10 +27,18 @@ from mcp.types import (
     ToolsCapability
 )
 
+from job_queue import JobQueue, PRIORITY_NORMAL, format_status
+from image_handle import ImageHandle
+from image_workers import run_on_image, detect_contour_regions, save_crop, draw_labeled_regions, shutdown_pool
+from error_handler import TaskStatus
+
 # 设置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 图像处理作业排队执行（CPU 类别，限制同时处理的图片数）
+JOBS = JobQueue()
+
 # 创建一个全局的工作目录 - 使用项目目录而不是临时目录
 PROJECT_ROOT = Path(__file__).parent
 WORK_DIR = PROJECT_ROOT / "data" / "output"
@@ -59,10 +66,47 @@ class ScreenCoderMCPServer:
                                 "image_path": {
                                     "type": "string",
                                     "description": "要处理的图片的本地绝对文件路径。例如: 'C:\\Users\\Test\\Desktop\\screenshot.png'"
+                                },
+                                "background": {
+                                    "type": "boolean",
+                                    "description": "后台执行：立即返回作业ID，之后用 job_status / job_result 查询",
+                                    "default": False
+                                },
+                                "priority": {
+                                    "type": "integer",
+                                    "description": "作业优先级，数值越小越先执行",
+                                    "default": PRIORITY_NORMAL
                                 }
                             },
                             "required": ["image_path"]
                         }
+                    ),
+                    Tool(
+                        name="job_status",
+                        description="查询后台作业的状态和进度",
+                        inputSchema={
+                            "type": "object",
+                            "properties": {
+                                "job_id": {"type": "string", "description": "作业ID"}
+                            },
+                            "required": ["job_id"]
+                        }
+                    ),
+                    Tool(
+                        name="job_result",
+                        description="获取后台作业的结果，可等待作业完成",
+                        inputSchema={
+                            "type": "object",
+                            "properties": {
+                                "job_id": {"type": "string", "description": "作业ID"},
+                                "wait_seconds": {
+                                    "type": "number",
+                                    "description": "最多等待的秒数，期间作业完成则直接返回结果",
+                                    "default": 0
+                                }
+                            },
+                            "required": ["job_id"]
+                        }
                     )
                 ]
         
@@ -71,10 +115,20 @@ class ScreenCoderMCPServer:
             """处理工具调用请求"""
             try:
                 if name == "process_image_from_path":
-                    result = await _process_image_from_path(arguments)
+                    result = await _submit_process_image(arguments)
                     return CallToolResult(
                         content=[TextContent(type="text", text=result)]
                     )
+                elif name == "job_status":
+                    return CallToolResult(
+                        content=[TextContent(type="text", text=format_status(JOBS.status(arguments["job_id"])))]
+                    )
+                elif name == "job_result":
+                    info = await JOBS.wait(arguments["job_id"], float(arguments.get("wait_seconds", 0)))
+                    text = info.result if info.status == TaskStatus.COMPLETED else format_status(JOBS.status(arguments["job_id"]))
+                    return CallToolResult(
+                        content=[TextContent(type="text", text=text)]
+                    )
                 else:
                     raise ValueError(f"Unknown tool: {name}")
             
@@ -84,71 +138,62 @@ class ScreenCoderMCPServer:
                     content=[TextContent(type="text", text=f"Error: {str(e)}")]
                 )
 
-async def _process_image_from_path(args: Dict[str, Any]) -> str:
-    """一次性完成所有图像处理，并返回任务清单"""
+async def _submit_process_image(args: Dict[str, Any]) -> str:
+    """把图像处理提交到作业队列；background 时立即返回作业ID，否则等待任务清单"""
+    async def process(ctx):
+        return await _process_image_from_path(args, ctx.progress)
+    
+    priority = int(args.get("priority", PRIORITY_NORMAL))
+    if args.get("background"):
+        job_id = await JOBS.submit(process, "cpu", priority, "process_image_from_path")
+        return f"已提交后台作业 {job_id}，可用 job_status / job_result 查询进度和结果"
+    return await JOBS.run(process, "cpu", priority, "process_image_from_path")
+
+def _load_image(image_path: Path) -> ImageHandle:
+    """解码图片一次，放入共享内存供进程池中的各步骤挂载"""
+    with Image.open(image_path) as original_image:
+        return ImageHandle.from_pil(original_image, shared=True)
+
+async def _process_image_from_path(args: Dict[str, Any], progress=None) -> str:
+    """一次性完成所有图像处理，并返回任务清单；CPU 密集的步骤在进程池中执行"""
+    progress = progress or (lambda fraction, message=None: None)
     try:
-        # 1. 从本地路径加载图片
+        # 1. 从本地路径加载图片（解码放到线程中，只解码一次）
         image_path = Path(args["image_path"])
         if not image_path.exists() or not image_path.is_file():
             raise FileNotFoundError(f"指定的图片路径不存在或不是一个文件: {image_path}")
         
-        original_image = Image.open(image_path)
+        shared = await asyncio.to_thread(_load_image, image_path)
         logger.info(f"成功从路径加载图片: {image_path}")
+        progress(0.1, "图片已加载")
 
-        # 2. 分析布局
-        width, height = original_image.size
-        cv_image = cv2.cvtColor(np.array(original_image), cv2.COLOR_RGB2BGR)
-        gray = cv2.cvtColor(cv_image, cv2.COLOR_BGR2GRAY)
-        edges = cv2.Canny(gray, 50, 150)
-        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        potential_regions = []
-        for contour in contours:
-            x, y, w, h = cv2.boundingRect(contour)
-            if w * h > (width * height * 0.01) and w > 50 and h > 50:
-                potential_regions.append({"x": x, "y": y, "width": w, "height": h})
-        
-        potential_regions.sort(key=lambda p: p['width'] * p['height'], reverse=True)
-        detected_regions = potential_regions[:5] # 只取最大的5个区域
-
-        # 3. 为这次处理创建唯一的子目录
-        import time
-        session_id = f"session_{int(time.time())}"
-        session_dir = WORK_DIR / session_id
-        session_dir.mkdir(exist_ok=True)
-        
-        # 4. 裁剪区域并保存
-        crop_dir = session_dir / "cropped_regions"
-        crop_dir.mkdir(exist_ok=True)
-        cropped_info = []
-        for i, region in enumerate(detected_regions):
-            name = f"region_{i+1}"
-            x, y, w, h = region['x'], region['y'], region['width'], region['height']
-            
-            cropped = original_image.crop((x, y, x + w, y + h))
-            crop_path = crop_dir / f"{name}.png"
-            cropped.save(crop_path)
+        with shared:
+            # 2. 分析布局
+            detected_regions = await run_on_image(shared, detect_contour_regions)  # 只取最大的5个区域
+            progress(0.4, f"检测到 {len(detected_regions)} 个区域")
+
+            # 3. 为这次处理创建唯一的子目录（同一秒内的并发作业也互不覆盖）
+            import time
+            session_dir = Path(tempfile.mkdtemp(prefix=f"session_{int(time.time())}_", dir=WORK_DIR))
             
-            cropped_info.append({"name": name, "path": str(crop_path), "coords": f"{x},{y},{w},{h}"})
-
-        # 5. 创建并保存清单图片 (Manifest Image)
-        manifest_image = original_image.copy()
-        draw = ImageDraw.Draw(manifest_image)
-        try:
-            font = ImageFont.truetype("arial.ttf", 40)
-        except IOError:
-            font = ImageFont.load_default()
-
-        for i, region in enumerate(cropped_info):
-            name = region["name"]
-            coords = list(map(int, region["coords"].split(',')))
-            x, y, w, h = coords[0], coords[1], coords[2], coords[3]
-            draw.rectangle([x, y, x + w, y + h], outline="red", width=5)
-            draw.text((x + 10, y + 10), name, fill="red", font=font)
-
-        manifest_image_path = session_dir / "layout_manifest.png"
-        manifest_image.save(manifest_image_path)
+            # 4. 裁剪区域并保存，5. 创建并保存清单图片 (Manifest Image)，在不同的进程中并行执行
+            crop_dir = session_dir / "cropped_regions"
+            crop_dir.mkdir(exist_ok=True)
+            cropped_info = []
+            for i, region in enumerate(detected_regions):
+                region["name"] = f"region_{i+1}"
+                x, y, w, h = region['x'], region['y'], region['width'], region['height']
+                crop_path = crop_dir / f"{region['name']}.png"
+                cropped_info.append({"name": region["name"], "path": str(crop_path), "coords": f"{x},{y},{w},{h}"})
+
+            manifest_image_path = session_dir / "layout_manifest.png"
+            await asyncio.gather(
+                *(run_on_image(shared, save_crop, (r["x"], r["y"], r["x"] + r["width"], r["y"] + r["height"]), info["path"])
+                  for r, info in zip(detected_regions, cropped_info)),
+                run_on_image(shared, draw_labeled_regions, detected_regions, str(manifest_image_path)),
+            )
         logger.info(f"清单图片已保存到: {manifest_image_path}")
+        progress(0.9, "区域图片和清单图片已保存")
 
         # 6. 构建并返回最终的JSON任务清单
         task_manifest = {
@@ -168,17 +213,22 @@ async def main():
     """启动MCP服务器"""
     server_instance = ScreenCoderMCPServer()
     
-    async with stdio_server() as (read_stream, write_stream):
-        capabilities = ServerCapabilities(tools=ToolsCapability(listChanged=False))
-        await server_instance.server.run(
-            read_stream,
-            write_stream,
-            InitializationOptions(
-                server_name="screencoder",
-                server_version="4.0.0-local-path",
-                capabilities=capabilities
+    try:
+        async with stdio_server() as (read_stream, write_stream):
+            capabilities = ServerCapabilities(tools=ToolsCapability(listChanged=False))
+            await server_instance.server.run(
+                read_stream,
+                write_stream,
+                InitializationOptions(
+                    server_name="screencoder",
+                    server_version="4.0.0-local-path",
+                    capabilities=capabilities
+                )
             )
-        )
+    finally:
+        # 取消未完成的作业，关闭图像处理进程池
+        await JOBS.close()
+        shutdown_pool()
 
 if __name__ == "__main__":
     try:
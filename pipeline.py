@@ -0,0 +1,259 @@
+"""
+In-process ScreenCoder workflow.
+
+Runs the same stages main.py used to chain as six Python subprocesses, but as
+function calls that hand images, dicts and the in-memory LayoutDocument to each
+other instead of JSON/PNG files under data/tmp. UIED component detection only
+needs the screenshot, so it runs in a worker thread while the layout and
+code-generation LLM calls are in flight. The screenshot is decoded once into an
+ImageHandle; stages share its lazily converted BGR/RGB/gray views. The stages
+and the values they exchange are declared as a StageGraph, so each one starts as
+soon as its inputs exist; every stage is timed and the critical path is reported.
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+from artifact_store import ArtifactStore, artifact_name
+from block_parsor import PROMPT_MERGE, resolve_containment, stream_bboxes
+from html_generator import generate_html, generate_code_async
+from image_box_detection import extract_placeholder_layout, check_tailwind_css, DEFAULT_TAILWIND_CACHE
+from image_replacer import crop_mapped_images, materialize_crops, order_placeholder_ids, replace_placeholders
+from llm_scheduler import RequestScheduler
+from image_handle import ImageHandle
+from mapping import uied_boxes_from_data, compute_mapping, pixel_boxes, uied_records, uied_data_from_records
+from stage_graph import StageGraph, StageTimer
+from utils import encode_image, encoding_policy_for
+
+UIED_DIR = Path(__file__).resolve().parent / "UIED"
+
+# same parameters as UIED/run_single.py
+UIED_PARAMS = {'min-grad': 10, 'ffl-block': 5, 'min-ele-area': 50,
+               'merge-contained-ele': True, 'merge-line-to-paragraph': False, 'remove-bar': True}
+
+
+UIED_ARTIFACT = artifact_name("uied", UIED_PARAMS)
+
+
+def uied_resize_height(shape, resize_length=800):
+    """UIED/run_single.py's resize_height_by_longest_edge, from an array shape"""
+    height, width = shape[:2]
+    if height > width:
+        return resize_length
+    return int(resize_length * (height / width))
+
+
+def run_uied(image_bgr, params=UIED_PARAMS, output_root=None):
+    """UIED compo_detection on a decoded screenshot; returns the ip/<name>.json structure"""
+    if str(UIED_DIR) not in sys.path:
+        sys.path.insert(0, str(UIED_DIR))
+    import detect_compo.ip_region_proposal as ip
+    import detect_compo.lib_ip.file_utils as file_utils
+
+    compos = ip.compo_detection(None, output_root, params,
+                                resize_by_height=uied_resize_height(image_bgr.shape), input_img=image_bgr)
+    return file_utils.corners_dict(compos)
+
+
+def detect_uied(image, store=None):
+    """run_uied on an ImageHandle; with an ArtifactStore the component table is reused across runs"""
+    if store is not None and store.has(UIED_ARTIFACT):
+        records, meta = store.get_table(UIED_ARTIFACT)
+        return uied_data_from_records(records, meta["img_shape"])
+    uied_data = run_uied(image.bgr)
+    if store is not None:
+        store.put_table(UIED_ARTIFACT, uied_records(uied_data), img_shape=uied_data["img_shape"])
+    return uied_data
+
+
+def layout_tree(bboxes, width, height):
+    """Root node over the screenshot with one child per 0-1000 region box, ids in pre-order"""
+    root = {"id": 0, "bbox": [0, 0, width, height], "children": []}
+    for index, (component_name, norm_bbox) in enumerate(bboxes.items(), 1):
+        root["children"].append({
+            "id": index,
+            "bbox": [int(norm_bbox[0] * width / 1000), int(norm_bbox[1] * height / 1000),
+                     int(norm_bbox[2] * width / 1000), int(norm_bbox[3] * height / 1000)],
+            "children": [],
+            "type": component_name,
+        })
+    return root
+
+
+async def analyze_layout(image, bot):
+    """Layout boxes of an ImageHandle from the streamed LLM answer"""
+    encoding = await asyncio.to_thread(lambda: encode_image(image.to_pil(), encoding_policy_for(bot.provider, "layout")))
+    bboxes = {name: bbox async for name, bbox in stream_bboxes(bot, PROMPT_MERGE, encoding)}
+    return resolve_containment(bboxes)
+
+
+def run_ocr(image, output_root, method="paddle"):
+    """UIED text detection on an ImageHandle; writes ocr/<name> under output_root and returns its path"""
+    if str(UIED_DIR) not in sys.path:
+        sys.path.insert(0, str(UIED_DIR))
+    import detect_text.text_detection as text
+
+    output_root = Path(output_root)
+    (output_root / "ocr").mkdir(parents=True, exist_ok=True)
+    return Path(text.text_detection(image.path, str(output_root), show=False, method=method, input_img=image.bgr))
+
+
+# Stage functions: keyword arguments are the values a stage consumes, the return
+# value is what it produces (see pipeline_graph for the wiring).
+
+def load_screenshot(image_path):
+    # decoded once; stages take the BGR/RGB views they need from the handle
+    image = ImageHandle.open(image_path)
+    return image, image.size
+
+
+def store_stage(image, artifact_root):
+    return ArtifactStore.for_image(image, artifact_root) if artifact_root else None
+
+
+async def layout_stage(image, bot):
+    bboxes = await analyze_layout(image, bot)
+    if not bboxes:
+        raise ValueError("No valid bounding boxes found in layout analysis")
+    return bboxes
+
+
+def skeleton_stage(bboxes, size):
+    root = layout_tree(bboxes, *size)
+    return root, generate_html(root)
+
+
+async def codegen_stage(root, image, bot, document, scheduler_limits, near_duplicates):
+    return await generate_code_async(root, image, bot, document,
+                                     scheduler=RequestScheduler(scheduler_limits),
+                                     near_duplicates=near_duplicates)
+
+
+async def placeholders_stage(document, size, code_dict, tailwind_css_path, browser):
+    # code_dict is only waited on: placeholders exist once the region code is in the document
+    return await extract_placeholder_layout(*size, html_content=document.render(),
+                                            tailwind_css_path=tailwind_css_path, browser=browser)
+
+
+def mapping_stage(regions, placeholders, uied_data, size):
+    uied_boxes, uied_shape = uied_boxes_from_data(uied_data)
+    if not placeholders or not uied_boxes:
+        print("No placeholders or UIED boxes to map, keeping the gray placeholders")
+        return {}
+    return compute_mapping(pixel_boxes(regions), pixel_boxes(placeholders), uied_boxes, uied_shape, *size)
+
+
+def replace_stage(mapping_data, uied_data, image, document, output_html, store):
+    if not mapping_data:
+        return 0
+    crop_dir = Path(output_html).parent / "cropped_images"
+    crop_dir.mkdir(exist_ok=True)
+    count = materialize_crops(crop_mapped_images(mapping_data, uied_data, image.bgr), crop_dir, store)
+    replace_placeholders(document.fragments(), order_placeholder_ids(mapping_data), crop_dir.name)
+    return count
+
+
+def write_stage(document, output_html, **_after):
+    document.save(output_html)
+    print(f"Final HTML generated at {Path(output_html).resolve()}")
+    return Path(output_html)
+
+
+def pipeline_graph(include_images=True, ocr=False):
+    """
+    Stage wiring of the workflow.
+
+    Only the LLM chain layout -> skeleton -> codegen -> placeholders -> mapping -> replace
+    is sequential; layout, UIED and OCR only need the decoded screenshot and start at once.
+    """
+    graph = StageGraph()
+    graph.add("load", load_screenshot, ["image_path"], ["image", "size"], thread=True)
+    graph.add("layout", layout_stage, ["image", "bot"], ["bboxes"])
+    graph.add("skeleton", skeleton_stage, ["bboxes", "size"], ["root", "document"])
+    graph.add("codegen", codegen_stage,
+              ["root", "image", "bot", "document", "scheduler_limits", "near_duplicates"], ["code_dict"])
+    write_inputs = ["document", "output_html", "code_dict"]
+    if include_images:
+        graph.add("store", store_stage, ["image", "artifact_root"], ["store"], thread=True)
+        graph.add("uied", detect_uied, ["image", "store"], ["uied_data"], thread=True)
+        graph.add("placeholders", placeholders_stage,
+                  ["document", "size", "code_dict", "tailwind_css_path", "browser"], ["regions", "placeholders"])
+        graph.add("mapping", mapping_stage, ["regions", "placeholders", "uied_data", "size"], ["mapping_data"])
+        graph.add("replace", replace_stage,
+                  ["mapping_data", "uied_data", "image", "document", "output_html", "store"], ["replaced"])
+        write_inputs.append("replaced")
+    if ocr:
+        graph.add("ocr", run_ocr, ["image", "ocr_root"], ["ocr_json"], thread=True)
+    graph.add("write", write_stage, write_inputs, ["html_path"])
+    return graph
+
+
+async def run_pipeline(image_path, bot, output_html, include_images=True, near_duplicates=None,
+                       tailwind_css_path=DEFAULT_TAILWIND_CACHE, scheduler_limits=None, ocr=False, browser=None,
+                       artifact_root=None):
+    """
+    Screenshot -> final HTML in one process.
+
+    Returns {'html_path', 'code_dict', 'mapping', 'timings', 'critical_path'}; cropped
+    images are written next to `output_html` in cropped_images/, OCR results (ocr=True,
+    needs PaddleOCR) in ocr/. `browser` is an image_box_detection.ReusableBrowser to
+    render placeholders in; by default one is launched for this run. With an
+    `artifact_root`, the UIED table and encoded crops are kept in an ArtifactStore
+    there and reused by later runs on the same screenshot. Placeholders
+    are rendered offline with the Tailwind copy at `tailwind_css_path`, which must exist
+    (image_box_detection.check_tailwind_css).
+    """
+    if include_images:
+        check_tailwind_css(tailwind_css_path)
+    output_html = Path(output_html)
+    output_html.parent.mkdir(parents=True, exist_ok=True)
+
+    graph = pipeline_graph(include_images, ocr)
+    timer = StageTimer()
+    values = await graph.run({
+        "image_path": Path(image_path),
+        "bot": bot,
+        "output_html": output_html,
+        "scheduler_limits": scheduler_limits,
+        "near_duplicates": near_duplicates,
+        "tailwind_css_path": tailwind_css_path,
+        "browser": browser,
+        "ocr_root": output_html.parent,
+        "artifact_root": artifact_root,
+    }, timer)
+    timings = timer.report()
+    critical_path = graph.critical_path(timer)
+    print(f"Critical path: {' -> '.join(critical_path)}")
+
+    return {
+        "html_path": values["html_path"],
+        "code_dict": values["code_dict"],
+        "mapping": values.get("mapping_data", {}),
+        "timings": timings,
+        "critical_path": critical_path,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    from llm_cache import ResponseCache
+    from utils import Doubao
+
+    parser = argparse.ArgumentParser(description="Run the full ScreenCoder workflow in one process")
+    parser.add_argument("--image", type=Path, default=Path("data/input/test1.png"))
+    parser.add_argument("--output-html", type=Path, default=Path("data/output/test1_layout_final.html"))
+    parser.add_argument("--api-key", type=Path, default=Path("doubao_api.txt"))
+    parser.add_argument("--no-images", action="store_true", help="skip UIED detection and image replacement")
+    parser.add_argument("--ocr", action="store_true", help="also run UIED text detection (needs PaddleOCR)")
+    parser.add_argument("--artifacts", type=Path, default=None,
+                        help="cache UIED tables and crops in this content-addressed artifact store")
+    parser.add_argument("--tailwind-css", type=Path, default=DEFAULT_TAILWIND_CACHE,
+                        help="local copy of the pinned Tailwind stylesheet used to render placeholders offline")
+    args = parser.parse_args()
+
+    cache = ResponseCache(disk_path="data/cache/llm_responses.sqlite")
+    bot = Doubao(str(args.api_key), cache=cache)  # Change your models according to your needs: Qwen, GPT, Gemini
+    asyncio.run(run_pipeline(args.image, bot, args.output_html, include_images=not args.no_images,
+                             ocr=args.ocr, artifact_root=args.artifacts,
+                             tailwind_css_path=args.tailwind_css))
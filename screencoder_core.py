@@ -4,25 +4,44 @@ ScreenCoder 核心功能模块
 """
 
 import asyncio
+import itertools
 import json
 import os
+import shutil
 import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import asdict
 from pathlib import Path
-from typing import Dict, Any, Optional, List, Tuple
+from typing import Dict, Any, Optional, List, Tuple, Callable
 import cv2
 import numpy as np
 from PIL import Image
 import subprocess
 import sys
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 # 导入原有模块
-from utils import Doubao, Qwen, GPT, Gemini, encode_image, image_mask
-from block_parsor import parse_bboxes, resolve_containment, draw_bboxes, save_bboxes_to_json
-from html_generator import generate_html, generate_code_parallel, code_substitution
-from image_box_detection import extract_bboxes_from_html
-from mapping import load_regions_and_placeholders, load_uied_boxes, find_local_mapping_and_transform
-from image_replacer import main as image_replacer_main
+from utils import Doubao, Qwen, GPT, Gemini, encode_image, encoding_policy_for, EncodingReport, image_mask
+from block_parsor import resolve_containment, draw_bboxes, save_bboxes_to_json, stream_bboxes
+from html_generator import generate_html, generate_code_parallel, code_substitution, collect_leaves, LayoutDocument
+from image_box_detection import extract_placeholder_layout, check_tailwind_css, ReusableBrowser, DEFAULT_TAILWIND_CACHE
+from image_handle import ImageHandle
+from mapping import uied_boxes_from_data, compute_mapping, pixel_boxes
+from image_replacer import crop_mapped_images, materialize_crops, order_placeholder_ids, replace_placeholders
+from pipeline import detect_uied
+from artifact_store import ArtifactStore
+from llm_cache import ResponseCache, NearDuplicateCache, near_duplicate_context
+from llm_router import ProviderRouter
+from stage_graph import StageGraph, StageTimer
+
+def crop_view(frame: np.ndarray, bbox) -> np.ndarray:
+    """(x1, y1, x2, y2) 区域在解码后数组上的切片视图，不拷贝像素"""
+    x1, y1, x2, y2 = bbox
+    return frame[max(0, y1):y2, max(0, x1):x2]
 
 @dataclass
 class ScreenCoderConfig:
@@ -33,78 +52,223 @@ class ScreenCoderConfig:
     api_key_path: Optional[str] = None
     output_dir: str = "output"
     temp_dir: str = "tmp"
+    use_cache: bool = True  # LLM 响应缓存；默认开启，并持久化到用户主目录（见 cache_path），不需要时设为 False
+    cache_path: Optional[str] = None  # 默认 ~/.screencoder/llm_cache.sqlite，跨运行、跨工作目录共享
+    near_duplicate_types: List[str] = field(default_factory=list)  # 按区域类型开启近似重复复用
+    near_duplicate_distance: int = 4
+    fallback_models: List[str] = field(default_factory=list)  # 备用模型，配置后按延迟自动路由
+    hedge_requests: bool = False  # 主模型超过 p90 延迟未返回时向备用模型发起对冲请求
+    max_concurrent_regions: int = 4  # 同时生成代码的区域数上限
+    artifact_dir: Optional[str] = None  # 设置后 UIED 组件表和裁剪图按截图内容缓存在此目录（artifact_store）
+    tailwind_css_path: str = str(DEFAULT_TAILWIND_CACHE)  # 离线渲染占位框用的 Tailwind 样式表，不会自动下载
     
     def __post_init__(self):
         if self.custom_instructions is None:
             self.custom_instructions = {}
 
+class SharedResources:
+    """
+    多个管道共享的AI客户端、缓存和浏览器
+    
+    按决定资源的配置字段取值，首次请求时创建，之后复用
+    """
+    
+    def __init__(self):
+        self._resources: Dict[Tuple, Any] = {}
+        self._lock = threading.RLock()  # 工厂函数会嵌套获取其它共享资源（客户端 -> 缓存）
+        self.browser = ReusableBrowser()
+    
+    def get(self, kind: str, key: Tuple, factory: Callable[[], Any]) -> Any:
+        with self._lock:
+            if (kind, key) not in self._resources:
+                self._resources[(kind, key)] = factory()
+            return self._resources[(kind, key)]
+
+
 class ScreenCoderPipeline:
     """ScreenCoder 主处理管道"""
     
-    def __init__(self, config: ScreenCoderConfig):
+    def __init__(self, config: ScreenCoderConfig, work_dir: Optional[Path] = None,
+                 shared: Optional[SharedResources] = None):
+        """work_dir 默认新建临时目录；传入 shared 时AI客户端、缓存和浏览器与其它管道共享"""
         self.config = config
-        self.work_dir = Path(tempfile.mkdtemp(prefix="screencoder_"))
-        self.output_dir = self.work_dir / config.output_dir
-        self.temp_dir = self.work_dir / config.temp_dir
+        self.shared = shared
+        if config.include_images:
+            # 启动时检查，缺少样式表时直接报错，而不是在处理到一半时失败
+            check_tailwind_css(config.tailwind_css_path)
+        self.use_work_dir(work_dir or Path(tempfile.mkdtemp(prefix="screencoder_")))
+        
+        # 初始化AI客户端
+        client_key = (config.model, str(config.api_key_path), tuple(config.fallback_models),
+                      config.hedge_requests, config.use_cache, str(config.cache_path))
+        self.ai_client = self._shared("client", client_key, self._init_ai_client)
+        
+        # 统计图片压缩节省的上传字节数
+        self.encoding_report = EncodingReport()
+        
+        # 近似重复区域复用（按区域类型显式开启）
+        near_dup_path = None
+        if config.use_cache and config.near_duplicate_types:
+            near_dup_path = Path(config.cache_path or Path.home() / ".screencoder" / "llm_cache.sqlite").with_name("near_duplicates.sqlite")
+        self.near_duplicates = self._shared(
+            "near_duplicates", (tuple(config.near_duplicate_types), config.near_duplicate_distance, str(near_dup_path)),
+            lambda: NearDuplicateCache(config.near_duplicate_types, config.near_duplicate_distance,
+                                       disk_path=near_dup_path))
+        
+        # 限制同时生成代码的区域数（包括流式布局分析时提前开始的区域），每个事件循环一个；
+        # 以循环对象为弱引用键，循环关闭回收后条目自动消失，同时运行的多个循环互不影响
+        self._region_limits: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = \
+            weakref.WeakKeyDictionary()
+        
+        # 提取占位框的浏览器在多次调用间复用，首次使用时启动
+        self.browser = shared.browser if shared is not None else ReusableBrowser()
+    
+    def _shared(self, kind: str, key: Tuple, factory: Callable[[], Any]) -> Any:
+        return factory() if self.shared is None else self.shared.get(kind, key, factory)
+    
+    def use_work_dir(self, work_dir: Path):
+        """切换工作目录（池中的管道每次请求使用独立的目录）"""
+        self.work_dir = Path(work_dir)
+        self.output_dir = self.work_dir / self.config.output_dir
+        self.temp_dir = self.work_dir / self.config.temp_dir
         
         # 创建工作目录
         self.output_dir.mkdir(parents=True, exist_ok=True)
         self.temp_dir.mkdir(parents=True, exist_ok=True)
-        
-        # 初始化AI客户端
-        self.ai_client = self._init_ai_client()
     
     def _init_ai_client(self):
-        """初始化AI客户端"""
-        api_key_path = self.config.api_key_path
+        """初始化AI客户端；配置了备用模型时返回按延迟路由的 ProviderRouter"""
+        # 相同提示词和图片的响应走缓存
+        cache = None
+        if self.config.use_cache:
+            cache_path = Path(self.config.cache_path or Path.home() / ".screencoder" / "llm_cache.sqlite")
+            cache = self._shared("cache", (str(cache_path),), lambda: ResponseCache(disk_path=cache_path))
+        
+        if not self.config.fallback_models:
+            return self._create_bot(self.config.model, self.config.api_key_path, cache)
+        
+        bots = [self._create_bot(self.config.model, self.config.api_key_path, cache)]
+        for model in self.config.fallback_models:
+            try:
+                bots.append(self._create_bot(model, None, cache))
+            except FileNotFoundError as e:
+                print(f"Skipping fallback model {model}: {e}")
+        return ProviderRouter(bots, hedge=self.config.hedge_requests)
+    
+    def _create_bot(self, model: str, api_key_path: Optional[str], cache: Optional[ResponseCache]):
+        """按模型名创建单个客户端"""
         if not api_key_path:
             # 尝试从默认位置加载API密钥
             config_dir = Path.home() / ".screencoder"
-            api_key_path = config_dir / f"{self.config.model}_api.txt"
+            api_key_path = config_dir / f"{model}_api.txt"
             
             if not api_key_path.exists():
                 # 尝试项目根目录
-                api_key_path = Path(f"{self.config.model}_api.txt")
+                api_key_path = Path(f"{model}_api.txt")
         
         if not Path(api_key_path).exists():
-            raise FileNotFoundError(f"API key file not found for {self.config.model}")
+            raise FileNotFoundError(f"API key file not found for {model}")
         
         # 根据模型类型创建客户端
-        if self.config.model == "doubao":
-            return Doubao(str(api_key_path))
-        elif self.config.model == "qwen":
-            return Qwen(str(api_key_path))
-        elif self.config.model == "gpt":
-            return GPT(str(api_key_path))
-        elif self.config.model == "gemini":
-            return Gemini(str(api_key_path))
+        if model == "doubao":
+            return Doubao(str(api_key_path), cache=cache)
+        elif model == "qwen":
+            return Qwen(str(api_key_path), cache=cache)
+        elif model == "gpt":
+            return GPT(str(api_key_path), cache=cache)
+        elif model == "gemini":
+            return Gemini(str(api_key_path), cache=cache)
         else:
-            raise ValueError(f"Unsupported model: {self.config.model}")
+            raise ValueError(f"Unsupported model: {model}")
     
-    async def process_screenshot(self, image: Image.Image) -> Dict[str, Any]:
-        """处理截图的完整流程"""
+    async def process_screenshot(self, image: Image.Image,
+                                 progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """
+        处理截图的完整流程
+        
+        progress_callback: 每个组件代码注入文档后调用，事件格式同 html_generator.generate_code_incremental
+        """
         try:
-            # 保存输入图片
-            image_path = self.temp_dir / "input.png"
-            image.save(image_path)
+            # 各步骤声明输入输出，由 StageGraph 按依赖调度并计时
+            early_tasks = {}
+            width, height = image.size
+            # 截图只解码一次：布局检测、区域裁剪、UIED、映射和裁剪共用这个 ImageHandle，
+            # RGB 视图即原数组，BGR/灰度视图在第一次使用时转换并缓存
+            handle = ImageHandle.from_pil(image, path=self.temp_dir / "input.png")
+            frame = handle.rgb
+            
+            def save_input(image):
+                image_path = self.temp_dir / "input.png"
+                image.save(image_path)
+                return image_path
             
-            # 步骤1: 布局分析
-            layout_result = await self._analyze_layout(image_path)
+            def open_store(handle):
+                # 按截图内容寻址的中间结果目录，重复处理同一截图时复用
+                if not self.config.artifact_dir:
+                    return None
+                return ArtifactStore.for_image(handle, Path(self.config.artifact_dir).expanduser())
             
-            # 步骤2: 生成初始HTML
-            html_result = await self._generate_initial_html(image_path, layout_result)
+            def detect_components(handle, store):
+                return detect_uied(handle, store)
             
-            # 步骤3: 如果需要包含真实图片，进行图片替换
+            def to_pixels(norm_bbox):
+                return [int(norm_bbox[0] * width / 1000), int(norm_bbox[1] * height / 1000),
+                        int(norm_bbox[2] * width / 1000), int(norm_bbox[3] * height / 1000)]
+            
+            def start_region(name, norm_bbox):
+                bbox = to_pixels(norm_bbox)
+                previous = early_tasks.pop(name, None)
+                if previous is not None:
+                    previous[1].cancel()
+                early_tasks[name] = (bbox, asyncio.ensure_future(self._component_code(crop_view(frame, bbox), name)))
+            
+            async def cancel_early(names):
+                # 取消并等待结束，取回异常，避免 "exception was never retrieved"
+                tasks = [early_tasks.pop(name)[1] for name in names]
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+            
+            async def layout_stage(handle):
+                # 步骤1: 布局分析（流式），每解析出一个区域就提前开始生成它的代码
+                return await self._analyze_layout(handle, on_region=start_region)
+            
+            async def html_stage(layout_result, frame):
+                # 被 resolve_containment 去掉或改了bbox的区域，提前开始的任务不会被使用，先取消以免占用名额
+                bboxes = layout_result["bboxes"]
+                await cancel_early([name for name, (bbox, _) in early_tasks.items()
+                                    if name not in bboxes or to_pixels(bboxes[name]) != bbox])
+                # 步骤2: 生成初始HTML
+                return await self._generate_initial_html(frame, layout_result, progress_callback, early_tasks)
+            
+            graph = StageGraph()
+            graph.add("save", save_input, ["image"], ["image_path"], thread=True)
+            graph.add("layout", layout_stage, ["handle"], ["layout_result"])
+            graph.add("html", html_stage, ["layout_result", "frame"], ["html_result"])
             if self.config.include_images:
-                final_result = await self._replace_images(image_path, html_result)
-            else:
-                final_result = html_result
+                # UIED 组件检测只依赖截图，与布局分析、代码生成同时进行
+                graph.add("store", open_store, ["handle"], ["store"], thread=True)
+                graph.add("uied", detect_components, ["handle", "store"], ["uied_data"], thread=True)
+                # 步骤3: 如果需要包含真实图片，进行图片替换
+                graph.add("images", self._replace_images, ["html_result", "uied_data", "handle", "store"], ["final_result"])
+            
+            timer = StageTimer()
+            try:
+                values = await graph.run({"image": image, "handle": handle, "frame": frame}, timer)
+            finally:
+                # 出错时未被消费的提前任务
+                await cancel_early(list(early_tasks))
             
+            final_result = values.get("final_result", values["html_result"])
+            timings = dict(timer.timings)
+            timings.update({f"images.{name}": seconds for name, seconds in final_result.get("timings", {}).items()})
             return {
                 "success": True,
-                "layout_info": layout_result["summary"],
+                "layout_info": values["layout_result"]["summary"],
                 "html_path": str(final_result["html_path"]),
                 "html_content": final_result["html_content"],
+                "timings": timings,
+                "critical_path": graph.critical_path(timer),
                 "work_dir": str(self.work_dir)
             }
             
@@ -120,7 +284,7 @@ class ScreenCoderPipeline:
         image_path = self.temp_dir / "input.png"
         image.save(image_path)
         
-        return await self._analyze_layout(image_path)
+        return await self._analyze_layout(ImageHandle.from_pil(image, path=image_path))
     
     async def generate_component_code(self, image: Image.Image, component_type: str, custom_instruction: str = "") -> Dict[str, Any]:
         """为单个组件生成代码"""
@@ -148,24 +312,37 @@ class ScreenCoderPipeline:
                 "error": str(e)
             }
     
-    async def _analyze_layout(self, image_path: Path) -> Dict[str, Any]:
-        """分析图片布局"""
+    async def _analyze_layout(self, image: ImageHandle,
+                              on_region: Optional[Callable[[str, Tuple[int, int, int, int]], None]] = None) -> Dict[str, Any]:
+        """
+        分析图片布局
+        
+        image: 解码一次的截图 (ImageHandle)
+        on_region: 流式解析出每个区域时立即调用 (name, 归一化bbox)，不必等待完整回答
+        """
         # 使用原有的block_parsor逻辑
         prompt = "Return the bounding boxes of the sidebar, main content, header, and navigation in this webpage screenshot. Please only return the corresponding bounding boxes. Note: 1. The areas should not overlap; 2. All text information and other content should be framed inside; 3. Try to keep it compact without leaving a lot of blank space; 4. Output a label and the corresponding bounding box for each line."
         
-        # 调用AI模型
-        bbox_content = self.ai_client.ask(prompt, encode_image(str(image_path)))
+        # 调用AI模型（异步流式，不阻塞事件循环）
+        # 归一化坐标(0-1000)与缩放无关，可以安全地压缩上传
+        image_encoding = await asyncio.to_thread(lambda: encode_image(image.to_pil(),
+                                                                      encoding_policy_for(self.ai_client.provider, "layout"),
+                                                                      self.encoding_report))
+        bboxes = {}
+        async for name, bbox in stream_bboxes(self.ai_client, prompt, image_encoding):
+            bboxes[name] = bbox
+            if on_region is not None:
+                on_region(name, bbox)
         
-        # 解析边界框
-        bboxes = parse_bboxes(bbox_content, str(image_path))
+        # 去除互相包含的区域
         bboxes = resolve_containment(bboxes)
         
         if not bboxes:
             raise ValueError("No valid bounding boxes found in layout analysis")
         
         # 保存结果
-        json_path = save_bboxes_to_json(bboxes, str(image_path))
-        draw_bboxes(str(image_path), bboxes)
+        json_path = save_bboxes_to_json(bboxes, image, str(self.temp_dir))
+        await asyncio.to_thread(draw_bboxes, image, bboxes, str(self.temp_dir))
         
         # 生成摘要
         regions_summary = f"检测到 {len(bboxes)} 个区域: {', '.join(bboxes.keys())}"
@@ -178,13 +355,13 @@ class ScreenCoderPipeline:
             "regions_summary": regions_summary
         }
     
-    async def _generate_initial_html(self, image_path: Path, layout_result: Dict[str, Any]) -> Dict[str, Any]:
-        """生成初始HTML"""
+    async def _generate_initial_html(self, frame: np.ndarray, layout_result: Dict[str, Any],
+                                     progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                                     early_tasks: Optional[Dict[str, Tuple[List[int], asyncio.Future]]] = None) -> Dict[str, Any]:
+        """生成初始HTML；early_tasks 为流式布局分析时已提前开始的组件代码任务"""
         bboxes = layout_result["bboxes"]
         
-        # 读取图片尺寸
-        with Image.open(image_path) as img:
-            width, height = img.size
+        height, width = frame.shape[:2]
         
         # 创建根节点
         root = {
@@ -210,51 +387,93 @@ class ScreenCoderPipeline:
         # 分配ID
         self._assign_ids(root, 0)
         
-        # 生成HTML骨架
-        html_path = self.temp_dir / "layout.html"
-        generate_html(root, str(html_path))
-        
-        # 生成组件代码
-        code_dict = await self._generate_components_code(root, image_path)
+        # 在内存中生成HTML骨架
+        document = generate_html(root)
         
-        # 注入代码
-        code_substitution(str(html_path), code_dict)
+        # 生成组件代码，每个组件完成后立即注入文档
+        code_dict = await self._generate_components_code(root, frame, document, progress_callback, early_tasks)
         
-        # 读取生成的HTML内容
-        html_content = html_path.read_text()
+        # 只序列化并写入一次
+        html_content = document.render()
+        html_path = self.temp_dir / "layout.html"
+        html_path.write_text(html_content)
         
         return {
             "html_path": html_path,
             "html_content": html_content,
+            "document": document,
             "root": root,
             "code_dict": code_dict
         }
     
-    async def _generate_components_code(self, root: Dict[str, Any], image_path: Path) -> Dict[str, str]:
-        """生成所有组件的代码"""
+    async def _generate_components_code(self, root: Dict[str, Any], frame: np.ndarray,
+                                        document: Optional[LayoutDocument] = None,
+                                        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                                        early_tasks: Optional[Dict[str, Tuple[List[int], asyncio.Future]]] = None) -> Dict[str, str]:
+        """
+        并发生成所有叶子组件的代码，并在每个组件完成时注入文档、上报进度
+        
+        frame 为解码一次的 RGB 数组，各区域只取切片视图；并发数由 max_concurrent_regions 限制
+        """
         code_dict = {}
+        leaves = collect_leaves(root)
+        total = len(leaves)
+        early_tasks = early_tasks if early_tasks is not None else {}
         
-        def _process_node(node):
-            if not node.get("children"):  # 叶子节点
-                component_type = node.get("type")
-                if component_type:
-                    # 裁剪图片
-                    with Image.open(image_path) as img:
-                        bbox = node["bbox"]
-                        cropped_img = img.crop(bbox)
-                        
-                        # 生成代码
-                        code = self._generate_component_code_sync(cropped_img, component_type)
-                        code_dict[node["id"]] = code
+        async def _process_leaf(node):
+            component_type = node["type"]
+            # 布局流式解析时已经开始生成的区域（同一个bbox）直接等待结果
+            early = early_tasks.get(component_type)
+            if early is not None and early[0] == list(node["bbox"]):
+                del early_tasks[component_type]
+                code = await early[1]
             else:
-                for child in node["children"]:
-                    _process_node(child)
+                code = await self._component_code(crop_view(frame, node["bbox"]), component_type)
+            code_dict[node["id"]] = code
+            
+            if document is not None:
+                document.set_code(node["id"], code)
+            if progress_callback is not None:
+                progress_callback({
+                    "node_id": node["id"],
+                    "type": component_type,
+                    "code": code,
+                    "completed": len(code_dict),
+                    "total": total,
+                    "document": document,
+                })
         
-        _process_node(root)
+        tasks = [asyncio.ensure_future(_process_leaf(node)) for node in leaves if node.get("type")]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # 某个区域失败时取消其余区域
+            for task in tasks:
+                task.cancel()
         return code_dict
     
-    def _generate_component_code_sync(self, image: Image.Image, component_type: str) -> str:
-        """同步生成组件代码"""
+    def _region_limit(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        limit = self._region_limits.get(loop)
+        if limit is None:
+            limit = self._region_limits[loop] = asyncio.Semaphore(max(1, self.config.max_concurrent_regions))
+        return limit
+    
+    async def _component_code(self, crop, component_type: str) -> str:
+        """生成组件代码，近似重复的区域直接复用；crop 可以是 PIL 图像或 RGB 数组视图"""
+        async with self._region_limit():
+            if isinstance(crop, np.ndarray):
+                # 视图只在真正需要时拷贝成该区域大小的 PIL 图像
+                crop = await asyncio.to_thread(Image.fromarray, crop)
+            context = near_duplicate_context(self.ai_client, self._component_prompt(component_type))
+            code = self.near_duplicates.lookup(component_type, crop, context)
+            if code is None:
+                code = await self._generate_component_code(crop, component_type)
+                self.near_duplicates.store(component_type, crop, code, context)
+            return code
+    
+    def _component_prompt(self, component_type: str) -> str:
+        """区域类型对应的提示词（包含该类型的自定义指令）"""
         # 获取自定义指令
         custom_instruction = self.config.custom_instructions.get(component_type, "")
         
@@ -268,9 +487,17 @@ class ScreenCoderPipeline:
         
         prompt = prompts.get(component_type, f"请为这个{component_type}组件生成HTML和Tailwind CSS代码。")
         prompt += "\n\n<div>\nyour code here\n</div>\n\n只需返回<div>和</div>标签内的代码"
+        return prompt
+    
+    async def _generate_component_code(self, image: Image.Image, component_type: str) -> str:
+        """异步生成组件代码"""
+        prompt = self._component_prompt(component_type)
         
         # 调用AI模型
-        code = self.ai_client.ask(prompt, encode_image(image))
+        image_encoding = await asyncio.to_thread(encode_image, image,
+                                                 encoding_policy_for(self.ai_client.provider, component_type),
+                                                 self.encoding_report)
+        code = await self.ai_client.ask_async(prompt, image_encoding)
         
         # 清理代码
         code = code.replace("```html", "").replace("```", "").strip()
@@ -280,25 +507,58 @@ class ScreenCoderPipeline:
     async def _generate_single_component_code(self, image_path: Path, component_type: str) -> str:
         """为单个组件生成代码"""
         with Image.open(image_path) as image:
-            return self._generate_component_code_sync(image, component_type)
+            return await self._generate_component_code(image, component_type)
     
-    async def _replace_images(self, image_path: Path, html_result: Dict[str, Any]) -> Dict[str, Any]:
-        """替换HTML中的图片占位符"""
+    async def _replace_images(self, html_result: Dict[str, Any], uied_data: Dict[str, Any],
+                              handle: ImageHandle, store: Optional[ArtifactStore] = None) -> Dict[str, Any]:
+        """
+        替换HTML中的图片占位符
+        
+        浏览器提取占位框 → 按区域映射到UIED组件(find_local_mapping_and_transform) → NumPy 切片裁剪，
+        全程使用同一份解码后的截图，每一步单独计时；传入 store 时编码后的裁剪图在其中缓存
+        """
+        timer = StageTimer()
         try:
-            # 这里需要实现UIED检测和图片替换逻辑
-            # 由于UIED比较复杂，暂时返回原始HTML
-            # 在实际实现中，需要调用UIED模块并执行mapping和image_replacer的逻辑
+            W, H = handle.size
+            document = html_result["document"]
+            
+            with timer.stage("placeholders"):
+                regions, placeholders = await extract_placeholder_layout(
+                    W, H, html_content=html_result["html_content"],
+                    tailwind_css_path=self.config.tailwind_css_path, browser=self.browser)
+            
+            mapping_data = {}
+            uied_boxes, uied_shape = uied_boxes_from_data(uied_data)
+            if placeholders and uied_boxes:
+                with timer.stage("mapping"):
+                    mapping_data = compute_mapping(pixel_boxes(regions), pixel_boxes(placeholders),
+                                                   uied_boxes, uied_shape, W, H)
+                
+                with timer.stage("crop"):
+                    crop_dir = self.output_dir / "cropped_images"
+                    crop_dir.mkdir(exist_ok=True)
+                    materialize_crops(crop_mapped_images(mapping_data, uied_data, handle.bgr), crop_dir, store)
+                
+                with timer.stage("replace"):
+                    replace_placeholders(document.fragments(), order_placeholder_ids(mapping_data), crop_dir.name)
+            else:
+                print("没有可映射的占位框或UIED组件，保留灰色占位符")
             
-            final_html_path = self.output_dir / "final.html"
-            final_html_path.write_text(html_result["html_content"])
+            with timer.stage("write"):
+                html_content = document.render()
+                final_html_path = self.output_dir / "final.html"
+                final_html_path.write_text(html_content)
             
             return {
                 "html_path": final_html_path,
-                "html_content": html_result["html_content"]
+                "html_content": html_content,
+                "mapping": mapping_data,
+                "timings": timer.timings
             }
             
         except Exception as e:
             # 如果图片替换失败，返回原始HTML
+            print(f"图片替换失败，使用占位符版本: {e}")
             return html_result
     
     def _assign_ids(self, node: Dict[str, Any], current_id: int) -> int:
@@ -311,35 +571,145 @@ class ScreenCoderPipeline:
         
         return current_id
     
-    def cleanup(self):
-        """清理临时文件"""
-        import shutil
+    async def aclose(self):
+        """关闭复用的浏览器（共享的浏览器由 ScreenCoderManager 关闭）"""
+        if self.shared is None:
+            await self.browser.close()
+    
+    async def cleanup(self):
+        """关闭自己的浏览器（等待其真正关闭）后再删除临时文件"""
+        await self.aclose()
         if self.work_dir.exists():
-            shutil.rmtree(self.work_dir)
+            await asyncio.to_thread(shutil.rmtree, self.work_dir)
 
 class ScreenCoderManager:
-    """ScreenCoder 管理器，用于管理多个处理实例"""
+    """
+    ScreenCoder 管理器，用于管理多个处理实例
     
-    def __init__(self):
+    lease() 从池中借出预热好的管道：同一配置的空闲管道直接复用，AI客户端、缓存和浏览器
+    在所有管道间共享；每次请求在同一根目录下使用独立的工作目录，并发请求互不覆盖文件。
+    池中管道数不超过 max_pipelines，空闲超过 idle_timeout 秒的管道被淘汰，
+    根目录下最多保留最近 keep_runs 次请求的输出。
+    """
+    
+    def __init__(self, max_pipelines: int = 4, idle_timeout: float = 600.0,
+                 root_dir: Optional[Path] = None, keep_runs: int = 32):
         self.active_pipelines: Dict[str, ScreenCoderPipeline] = {}
+        self.shared = SharedResources()
+        self.max_pipelines = max(1, max_pipelines)
+        self.idle_timeout = idle_timeout
+        self.keep_runs = max(keep_runs, self.max_pipelines)
+        self.root_dir = Path(root_dir) if root_dir else Path(tempfile.mkdtemp(prefix="screencoder_"))
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+        
+        self._ids = itertools.count()
+        self._run_ids = itertools.count()
+        self._runs: deque = deque()
+        self._idle: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()  # pipeline_id -> (配置键, 归还时间)
+        self._busy: Dict[str, str] = {}  # pipeline_id -> 配置键
+        self._condition: Optional[asyncio.Condition] = None
+    
+    @staticmethod
+    def _config_key(config: ScreenCoderConfig) -> str:
+        return json.dumps(asdict(config), sort_keys=True, default=str)
     
     def create_pipeline(self, config: ScreenCoderConfig) -> str:
         """创建新的处理管道"""
-        pipeline_id = f"pipeline_{len(self.active_pipelines)}"
-        self.active_pipelines[pipeline_id] = ScreenCoderPipeline(config)
+        pipeline_id = f"pipeline_{next(self._ids)}"
+        self.active_pipelines[pipeline_id] = ScreenCoderPipeline(config, self.root_dir / pipeline_id, self.shared)
         return pipeline_id
     
     def get_pipeline(self, pipeline_id: str) -> Optional[ScreenCoderPipeline]:
         """获取处理管道"""
         return self.active_pipelines.get(pipeline_id)
     
-    def cleanup_pipeline(self, pipeline_id: str):
+    @asynccontextmanager
+    async def lease(self, config: ScreenCoderConfig):
+        """借出一个管道，退出时归还到池中"""
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        pipeline_id, reused = await self._acquire(config)
+        pipeline = self.active_pipelines[pipeline_id]
+        try:
+            if reused:
+                # 配置键相同；换成本次请求的配置对象和新的工作目录
+                pipeline.config = config
+                pipeline.use_work_dir(self._new_run_dir())
+            yield pipeline
+        finally:
+            async with self._condition:
+                self._idle[pipeline_id] = (self._busy.pop(pipeline_id), time.monotonic())
+                self._evict_idle()
+                self._condition.notify_all()
+    
+    async def _acquire(self, config: ScreenCoderConfig) -> Tuple[str, bool]:
+        key = self._config_key(config)
+        async with self._condition:
+            while True:
+                self._evict_idle()
+                for pipeline_id, (idle_key, _) in self._idle.items():
+                    if idle_key == key:
+                        del self._idle[pipeline_id]
+                        self._busy[pipeline_id] = key
+                        return pipeline_id, True
+                
+                if len(self._idle) + len(self._busy) >= self.max_pipelines and self._idle:
+                    # 池已满：淘汰最久未用的其它配置的空闲管道
+                    self._discard(next(iter(self._idle)))
+                
+                if len(self._idle) + len(self._busy) < self.max_pipelines:
+                    pipeline_id = f"pipeline_{next(self._ids)}"
+                    self.active_pipelines[pipeline_id] = ScreenCoderPipeline(config, self._new_run_dir(), self.shared)
+                    self._busy[pipeline_id] = key
+                    return pipeline_id, False
+                
+                await self._condition.wait()
+    
+    def _evict_idle(self):
+        """淘汰空闲超时的管道"""
+        now = time.monotonic()
+        for pipeline_id, (_, released) in list(self._idle.items()):
+            if now - released > self.idle_timeout:
+                self._discard(pipeline_id)
+    
+    def _discard(self, pipeline_id: str):
+        # 只移出池，输出目录按 keep_runs 轮转删除，调用方可能仍在读取
+        self._idle.pop(pipeline_id, None)
+        self.active_pipelines.pop(pipeline_id, None)
+    
+    def _new_run_dir(self) -> Path:
+        """根目录下新的请求工作目录，超出 keep_runs 时删除最早的（仍在使用的除外）"""
+        run_dir = self.root_dir / f"run_{next(self._run_ids)}"
+        self._runs.append(run_dir)
+        in_use = {self.active_pipelines[pipeline_id].work_dir for pipeline_id in self._busy
+                  if pipeline_id in self.active_pipelines}
+        for _ in range(len(self._runs)):
+            if len(self._runs) <= self.keep_runs:
+                break
+            oldest = self._runs.popleft()
+            if oldest in in_use:
+                self._runs.append(oldest)
+            else:
+                shutil.rmtree(oldest, ignore_errors=True)
+        return run_dir
+    
+    def stats(self) -> Dict[str, int]:
+        return {"idle": len(self._idle), "busy": len(self._busy), "runs": len(self._runs)}
+    
+    async def cleanup_pipeline(self, pipeline_id: str):
         """清理处理管道"""
-        if pipeline_id in self.active_pipelines:
-            self.active_pipelines[pipeline_id].cleanup()
-            del self.active_pipelines[pipeline_id]
+        pipeline = self.active_pipelines.pop(pipeline_id, None)
+        if pipeline is not None:
+            self._idle.pop(pipeline_id, None)
+            await pipeline.cleanup()
     
-    def cleanup_all(self):
+    async def cleanup_all(self):
         """清理所有管道"""
         for pipeline_id in list(self.active_pipelines.keys()):
-            self.cleanup_pipeline(pipeline_id)
+            await self.cleanup_pipeline(pipeline_id)
+        await asyncio.to_thread(shutil.rmtree, self.root_dir, ignore_errors=True)
+    
+    async def aclose(self):
+        """关闭共享的浏览器并清理所有管道（管道自己的 aclose 不会关闭共享浏览器）"""
+        await self.shared.browser.close()
+        await self.cleanup_all()
@@ -0,0 +1,154 @@
+"""
+Small DAG executor for pipeline stages.
+
+Each stage declares the named values it consumes and produces. A stage starts as
+soon as all of its inputs exist, so independent stages (UIED detection, the layout
+LLM call) overlap and wall-clock time comes down to the critical path. Every stage
+is timed; `critical_path()` reports the chain of stages that determined the total.
+"""
+
+import asyncio
+import inspect
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+
+class StageTimer:
+    """Start/end offsets of each named stage; stages may overlap"""
+
+    def __init__(self):
+        self.spans: Dict[str, Tuple[float, float]] = {}
+        self._start = time.perf_counter()
+
+    @property
+    def timings(self) -> Dict[str, float]:
+        return {name: end - start for name, (start, end) in self.spans.items()}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter() - self._start
+        try:
+            yield
+        finally:
+            end = time.perf_counter() - self._start
+            self.spans[name] = (start, end)
+            print(f"[{name}] {end - start:.2f}s")
+
+    def report(self):
+        total = time.perf_counter() - self._start
+        print("\n=== Stage timings ===")
+        for name, (start, end) in self.spans.items():
+            print(f"{name:>14}: {end - start:7.2f}s  ({start:6.2f}s -> {end:6.2f}s)")
+        print(f"{'wall clock':>14}: {total:7.2f}s")
+        return {**self.timings, "total": total}
+
+
+@dataclass
+class Stage:
+    name: str
+    func: Callable
+    inputs: Tuple[str, ...] = ()
+    outputs: Tuple[str, ...] = ()
+    thread: bool = False  # run a blocking function in a worker thread
+
+
+class StageGraph:
+    """
+    Stages keyed by name; values keyed by the output names that produce them.
+
+    A stage function is called with its inputs as keyword arguments. With one output it
+    returns the value itself, with several a tuple in `outputs` order. Coroutine
+    functions are awaited; plain functions run inline, or in a thread with thread=True.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, Stage] = {}
+        self._producers: Dict[str, str] = {}
+
+    def add(self, name: str, func: Callable, inputs: Sequence[str] = (), outputs: Sequence[str] = (),
+            thread: bool = False) -> "StageGraph":
+        if name in self.stages:
+            raise ValueError(f"Duplicate stage: {name}")
+        for output in outputs:
+            if output in self._producers:
+                raise ValueError(f"'{output}' is already produced by stage '{self._producers[output]}'")
+            self._producers[output] = name
+        self.stages[name] = Stage(name, func, tuple(inputs), tuple(outputs), thread)
+        return self
+
+    def validate(self, initial: Sequence[str] = ()):
+        """Every input must be initial or produced by a stage, and there must be no cycles"""
+        available = set(initial)
+        for stage in self.stages.values():
+            missing = [i for i in stage.inputs if i not in available and i not in self._producers]
+            if missing:
+                raise ValueError(f"Stage '{stage.name}' needs {missing}, which nothing provides")
+
+        visiting, done = set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Stage graph has a cycle through '{name}'")
+            visiting.add(name)
+            for value in self.stages[name].inputs:
+                if value in self._producers and value not in available:
+                    visit(self._producers[value])
+            visiting.discard(name)
+            done.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    async def run(self, initial: Optional[Dict[str, Any]] = None, timer: Optional[StageTimer] = None) -> Dict[str, Any]:
+        """Run every stage as soon as its inputs are ready; returns all values"""
+        initial = dict(initial or {})
+        self.validate(initial)
+        timer = timer or StageTimer()
+        loop = asyncio.get_running_loop()
+        values: Dict[str, asyncio.Future] = {}
+        for name in list(initial) + list(self._producers):
+            values.setdefault(name, loop.create_future())
+        for name, value in initial.items():
+            values[name].set_result(value)
+
+        async def run_stage(stage: Stage):
+            kwargs = {name: await values[name] for name in stage.inputs}
+            with timer.stage(stage.name):
+                if inspect.iscoroutinefunction(stage.func):
+                    result = await stage.func(**kwargs)
+                elif stage.thread:
+                    result = await asyncio.to_thread(stage.func, **kwargs)
+                else:
+                    result = stage.func(**kwargs)
+            results = (result,) if len(stage.outputs) == 1 else (result or ())
+            if len(results) != len(stage.outputs):
+                raise ValueError(f"Stage '{stage.name}' returned {len(results)} values for outputs {stage.outputs}")
+            for name, value in zip(stage.outputs, results):
+                values[name].set_result(value)
+
+        tasks = [asyncio.ensure_future(run_stage(stage)) for stage in self.stages.values()]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        self.timer = timer
+        return {name: future.result() for name, future in values.items()}
+
+    def critical_path(self, timer: Optional[StageTimer] = None) -> List[str]:
+        """Stages on the longest chain: from the last stage to finish, follow the input that finished last"""
+        spans = (timer or self.timer).spans
+        if not spans:
+            return []
+        path = [max(spans, key=lambda name: spans[name][1])]
+        while True:
+            producers = [self._producers[value] for value in self.stages[path[-1]].inputs
+                         if value in self._producers and self._producers[value] in spans]
+            if not producers:
+                break
+            path.append(max(producers, key=lambda name: spans[name][1]))
+        return list(reversed(path))
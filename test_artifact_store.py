@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+ArtifactStore round-trip tests: tables, crop packs and json artifacts
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from artifact_store import ArtifactStore, artifact_name, atomic_write
+from image_handle import ImageHandle
+from mapping import UIED_DTYPE
+
+
+def test_table_round_trip(tmp_path):
+    store = ArtifactStore("key", tmp_path)
+    rows = np.zeros(3, dtype=UIED_DTYPE)
+    rows["id"] = [1, 2, 3]
+    rows["column_min"] = [10, 20, 30]
+
+    store.put_table("uied", rows, img_shape=[600, 800, 3])
+    assert store.has("uied")
+
+    loaded, meta = store.get_table("uied")
+    assert isinstance(loaded, np.memmap)
+    assert not loaded.flags.writeable
+    assert loaded.dtype == UIED_DTYPE
+    np.testing.assert_array_equal(loaded, rows)
+    assert meta == {"kind": "table", "rows": 3, "img_shape": [600, 800, 3]}
+
+    copied, _ = store.get_table("uied", mmap=False)
+    assert not isinstance(copied, np.memmap)
+    np.testing.assert_array_equal(copied, rows)
+
+
+def test_empty_table(tmp_path):
+    store = ArtifactStore("key", tmp_path)
+    store.put_table("uied", np.zeros(0, dtype=UIED_DTYPE))
+    loaded, meta = store.get_table("uied")
+    assert len(loaded) == 0 and meta["rows"] == 0
+
+
+def test_pack_round_trip(tmp_path):
+    store = ArtifactStore("key", tmp_path)
+    blobs = {"1": b"first crop", "2": b"", "10": bytes(range(256))}
+    store.put_pack("crops", blobs, format="png")
+
+    assert store.meta("crops") == {"kind": "pack", "count": 3, "size": 266, "format": "png"}
+    assert {blob_id: bytes(blob) for blob_id, blob in store.iter_pack("crops")} == blobs
+    assert store.get_blob("crops", "10") == blobs["10"]
+    assert store.get_blob("crops", "2") == b""
+    assert store.get_blob("crops", "missing") is None
+
+    assert store.extract_pack("crops", tmp_path / "out", ".png") == 3
+    assert (tmp_path / "out" / "1.png").read_bytes() == blobs["1"]
+
+
+def test_empty_pack(tmp_path):
+    store = ArtifactStore("key", tmp_path)
+    store.put_pack("crops", {})
+    assert list(store.iter_pack("crops")) == []
+    assert store.extract_pack("crops", tmp_path / "out") == 0
+
+
+def test_json_and_missing(tmp_path):
+    store = ArtifactStore("key", tmp_path)
+    assert not store.has("layout")
+    store.put_json("layout", {"regions": ["header", "侧边栏"]})
+    assert store.get_json("layout") == {"regions": ["header", "侧边栏"]}
+    with pytest.raises(FileNotFoundError):
+        store.get_table("uied")
+
+
+def test_atomic_write_leaves_no_temp_files(tmp_path):
+    target = tmp_path / "nested" / "file.bin"
+    atomic_write(target, b"one")
+    atomic_write(target, "two")
+
+    def failing(f):
+        f.write(b"partial")
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        atomic_write(target, failing)
+    assert target.read_bytes() == b"two"
+    assert [p.name for p in target.parent.iterdir()] == ["file.bin"]
+
+
+def test_content_key_and_names(tmp_path):
+    pixels = np.zeros((4, 5, 3), dtype=np.uint8)
+    same = ArtifactStore.for_image(ImageHandle.from_array(pixels.copy()), tmp_path)
+    assert same.key == ArtifactStore.for_image(ImageHandle.from_array(pixels.copy()), tmp_path).key
+    pixels[0, 0, 0] = 1
+    assert ArtifactStore.for_image(ImageHandle.from_array(pixels), tmp_path).key != same.key
+
+    assert artifact_name("uied") == "uied"
+    assert artifact_name("uied", {"a": 1, "b": 2}) == artifact_name("uied", {"b": 2, "a": 1})
+    assert artifact_name("uied", {"a": 1}) != artifact_name("uied", {"a": 2})
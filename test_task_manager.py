@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+TaskManager / JobQueue 调度测试：优先级、背压、取消、已结束任务的淘汰
+"""
+
+import asyncio
+import gc
+import sys
+import warnings
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from error_handler import TaskManager, TaskStatus
+from job_queue import JobQueue, QueueFullError
+
+
+def test_priority_order():
+    """名额按优先级分配，同优先级先来先得"""
+    async def scenario():
+        manager = TaskManager(max_concurrent_tasks=1)
+        gate = asyncio.Event()
+        order = []
+
+        async def job(name):
+            await gate.wait()
+            order.append(name)
+
+        for name, priority in [("first", 5), ("low", 10), ("high", 0), ("normal_a", 5), ("normal_b", 5)]:
+            await manager.start_task(manager.create_task(name), job(name), priority=priority)
+        gate.set()
+        await asyncio.gather(*manager.running_tasks.values())
+        return order
+
+    assert asyncio.run(scenario()) == ["first", "high", "normal_a", "normal_b", "low"]
+
+
+def test_backpressure_counts_only_waiting_jobs():
+    """排队数只算等待名额的作业，刚拿到名额的不算"""
+    async def scenario():
+        queue = JobQueue(limits={"llm": 1}, max_queue_depth=3)
+        gate = asyncio.Event()
+
+        async def job(ctx):
+            await gate.wait()
+
+        running = await queue.submit(job)
+        waiting = [await queue.submit(job) for _ in range(3)]
+        assert queue.status(running).get("queue_position") is None
+        assert [queue.status(job_id)["queue_position"] for job_id in waiting] == [1, 2, 3]
+        with pytest.raises(QueueFullError):
+            await queue.submit(job)
+
+        gate.set()
+        for job_id in [running] + waiting:
+            assert (await queue.wait(job_id)).status == TaskStatus.COMPLETED
+        assert queue.managers["llm"].running_count() == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancel_before_start_closes_coroutine():
+    """还没开始执行就被取消的作业：协程被关闭、名额和排队位置被释放"""
+    async def scenario():
+        manager = TaskManager(max_concurrent_tasks=1)
+        gate = asyncio.Event()
+
+        async def job():
+            await gate.wait()
+
+        started = manager.create_task("started")
+        queued = manager.create_task("queued")
+        await manager.start_task(started, job())
+        await manager.start_task(queued, job())
+        assert manager.cancel_task(started)
+        assert manager.cancel_task(queued)
+        assert manager.pending_count() == 0
+
+        await asyncio.gather(*manager.running_tasks.values(), return_exceptions=True)
+        await asyncio.sleep(0)
+        assert manager.tasks[started].status == TaskStatus.CANCELLED
+        assert manager.tasks[queued].status == TaskStatus.CANCELLED
+        assert manager.running_tasks == {}
+        assert manager.running_count() == 0
+
+        follow_up = manager.create_task("follow_up")
+        gate.set()
+        await manager.start_task(follow_up, job())
+        assert (await manager.wait(follow_up)).status == TaskStatus.COMPLETED
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        asyncio.run(scenario())
+        gc.collect()
+    assert not [w for w in caught if "never awaited" in str(w.message)]
+
+
+def test_cancel_running_task_hands_slot_to_next():
+    """取消运行中的任务后，名额交给下一个排队的任务"""
+    async def scenario():
+        manager = TaskManager(max_concurrent_tasks=1)
+
+        async def forever():
+            await asyncio.Event().wait()
+
+        async def quick():
+            return "done"
+
+        first = manager.create_task("first")
+        second = manager.create_task("second")
+        await manager.start_task(first, forever())
+        await manager.start_task(second, quick())
+        await asyncio.sleep(0)
+        assert manager.tasks[first].status == TaskStatus.RUNNING
+        assert manager.queue_position(second) == 1
+
+        manager.cancel_task(first)
+        info = await manager.wait(second, timeout=1)
+        assert info.status == TaskStatus.COMPLETED and info.result == "done"
+        assert manager.tasks[first].status == TaskStatus.CANCELLED
+
+    asyncio.run(scenario())
+
+
+def test_finished_tasks_evicted_by_lru():
+    """已结束任务超过 max_finished_tasks 时淘汰最久未访问的"""
+    async def scenario():
+        manager = TaskManager(max_concurrent_tasks=4, max_finished_tasks=3)
+
+        async def job():
+            return 1
+
+        ids = [manager.create_task(f"t{i}") for i in range(3)]
+        for task_id in ids:
+            await manager.start_task(task_id, job())
+        await asyncio.gather(*manager.running_tasks.values())
+        manager.get_task_status(ids[0])  # 刚访问过，不应被淘汰
+
+        await manager.start_task(manager.create_task("t3"), job())
+        await asyncio.gather(*manager.running_tasks.values())
+        await asyncio.sleep(0)
+        return list(manager.tasks)
+
+    assert asyncio.run(scenario()) == ["t2", "t0", "t3"]
+
+
+def test_finished_tasks_evicted_by_ttl():
+    """已结束任务超过 finished_ttl 秒后淘汰"""
+    async def scenario():
+        manager = TaskManager(max_concurrent_tasks=2, finished_ttl=0.05)
+
+        async def job():
+            return 1
+
+        old = manager.create_task("old")
+        await manager.start_task(old, job())
+        await manager.wait(old)
+        await asyncio.sleep(0.1)
+        manager.create_task("new")
+        return list(manager.tasks)
+
+    assert asyncio.run(scenario()) == ["new"]
+
+
+def test_run_cancels_job_when_caller_is_cancelled():
+    """等待 run 的调用方被取消时，作业也被取消并让出名额"""
+    async def scenario():
+        queue = JobQueue(limits={"llm": 1})
+        started = asyncio.Event()
+
+        async def job(ctx):
+            started.set()
+            await asyncio.Event().wait()
+
+        caller = asyncio.create_task(queue.run(job))
+        await started.wait()
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+
+        manager = queue.managers["llm"]
+        (job_id,) = manager.tasks
+        assert (await queue.wait(job_id, timeout=1)).status == TaskStatus.CANCELLED
+        assert manager.running_count() == 0
+
+    asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+UIED result file format tests: every output format reads back as the dict the json format holds
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent / "UIED"))
+
+import detect_compo.lib_ip.file_utils as file_utils
+
+COMPOS = {
+    "img_shape": [600, 800, 3],
+    "compos": [
+        {"id": 1, "class": "Compo", "column_min": 10, "row_min": 20, "column_max": 110, "row_max": 70,
+         "width": 100, "height": 50},
+        {"id": 2, "class": "Block", "column_min": 0, "row_min": 0, "column_max": 800, "row_max": 600,
+         "width": 800, "height": 600},
+    ],
+}
+
+TEXTS = {
+    "img_shape": [600, 800, 3],
+    "texts": [
+        {"id": 0, "content": "Sign in", "column_min": 5, "row_min": 6, "column_max": 60, "row_max": 20,
+         "width": 55, "height": 14},
+        {"id": 1, "content": "用户名", "column_min": 5, "row_min": 30, "column_max": 50, "row_max": 44,
+         "width": 45, "height": 14},
+    ],
+}
+
+ELEMENTS = {
+    "compos": [
+        {"id": 0, "class": "Block", "height": 600, "width": 800,
+         "position": {"column_min": 0, "row_min": 0, "column_max": 800, "row_max": 600},
+         "children": [1, 2]},
+        {"id": 1, "class": "Text", "height": 14, "width": 55,
+         "position": {"column_min": 5, "row_min": 6, "column_max": 60, "row_max": 20},
+         "text_content": "Sign in", "parent": 0},
+        {"id": 2, "class": "Compo", "height": 50, "width": 100,
+         "position": {"column_min": 10, "row_min": 20, "column_max": 110, "row_max": 70}, "parent": 0},
+    ],
+    "img_shape": [600, 800, 3],
+}
+
+EMPTY = {"img_shape": [600, 800, 3], "compos": []}
+
+
+def available_formats():
+    formats = ["json", "records"]
+    for output_format, module in [("orjson", "orjson"), ("msgpack", "msgpack")]:
+        try:
+            __import__(module)
+            formats.append(output_format)
+        except ImportError:
+            pass
+    return formats
+
+
+@pytest.mark.parametrize("output_format", available_formats())
+@pytest.mark.parametrize("output", [COMPOS, TEXTS, ELEMENTS, EMPTY], ids=["compos", "texts", "elements", "empty"])
+def test_round_trip(tmp_path, output_format, output):
+    written = file_utils.save_output(str(tmp_path / "result.json"), output, output_format)
+    assert written.endswith(file_utils.OUTPUT_SUFFIXES[output_format])
+    assert file_utils.load_output(written) == output
+    # readers that still ask for <name>.json find the result in any format
+    assert file_utils.load_output(str(tmp_path / "result.json")) == output
+
+
+def test_records_are_memory_mapped(tmp_path):
+    written = file_utils.save_output(str(tmp_path / "result.json"), ELEMENTS, "records")
+    header, arrays = file_utils.load_records(written)
+    assert header["kind"] == "elements"
+    assert isinstance(arrays["rows"], np.memmap)
+    assert arrays["rows"].dtype == file_utils.element_dtype(len("Sign in"))
+    assert arrays["children"].tolist() == [1, 2]
+    for spec in header["arrays"].values():
+        assert spec["offset"] % file_utils.RECORDS_ALIGN == 0
+
+    _, copied = file_utils.load_records(written, mmap=False)
+    assert not isinstance(copied["rows"], np.memmap)
+    np.testing.assert_array_equal(copied["rows"], arrays["rows"])
+
+
+def test_find_output_prefers_newest_format(tmp_path):
+    stale = file_utils.save_output(str(tmp_path / "result.json"), EMPTY, "json")
+    fresh = file_utils.save_output(str(tmp_path / "result.json"), COMPOS, "records")
+    os.utime(stale, (1, 1))
+    assert file_utils.find_output(str(tmp_path / "result.json")) == fresh
+    assert file_utils.load_output(str(tmp_path / "result.json")) == COMPOS
+
+    with pytest.raises(FileNotFoundError):
+        file_utils.find_output(str(tmp_path / "missing.json"))
+
+
+def test_unknown_format(tmp_path):
+    with pytest.raises(ValueError):
+        file_utils.save_output(str(tmp_path / "result.json"), EMPTY, "xml")
@@ -1,30 +1,167 @@
 import os
+import json
 import time
-from openai import OpenAI
+import asyncio
+import atexit
+import threading
+import httpx
+from openai import OpenAI, AsyncOpenAI
 import google.generativeai as genai
-from volcenginesdkarkruntime import Ark
+from volcenginesdkarkruntime import Ark, AsyncArk
 import base64
 import io
 from PIL import Image, ImageDraw
 import cv2
 import numpy as np
+from dataclasses import dataclass, field, replace
+from typing import Optional
+from llm_cache import cache_key
+from llm_scheduler import run_blocking, request_timeout
 
 
-def encode_image(image):
-    if type(image) == str:
-        try: 
-            with open(image, "rb") as image_file:
-                encoding = base64.b64encode(image_file.read()).decode('utf-8')
-        except Exception as e:
-            print(e)
-            with open(image, "r", encoding="utf-8") as image_file:
-                encoding = base64.b64encode(image_file.read()).decode('utf-8')
-        return encoding
-    
+@dataclass
+class EncodingPolicy:
+    """How an image is compacted before upload (see encode_image)"""
+    max_edge: Optional[int] = None  # longest edge in pixels, None keeps full resolution
+    format: str = "auto"            # "png", "jpeg", "webp" or "auto" (PNG for flat UI, JPEG for photos)
+    quality: int = 90               # JPEG/WebP quality
+
+
+# Longest edge each provider actually uses; anything larger is downscaled on their side anyway.
+PROVIDER_MAX_EDGE = {
+    "doubao": 2048,
+    "qwen": 2048,
+    "gpt": 2048,
+    "gemini": 3072,
+    "router": 2048,  # ProviderRouter may pick any of the above, so use the smallest cap
+}
+
+# The layout call needs crisp text and edges, so it stays lossless; region crops may go lossy.
+REGION_ENCODING_POLICIES = {
+    "layout": EncodingPolicy(format="png"),
+    "header": EncodingPolicy(format="auto"),
+    "sidebar": EncodingPolicy(format="auto"),
+    "navigation": EncodingPolicy(format="auto"),
+    "main content": EncodingPolicy(format="auto", quality=85),
+}
+
+
+def encoding_policy_for(provider=None, region_type=None) -> EncodingPolicy:
+    """Region policy capped at the provider's maximum edge"""
+    policy = REGION_ENCODING_POLICIES.get(region_type, EncodingPolicy())
+    max_edge = PROVIDER_MAX_EDGE.get(provider)
+    if max_edge is not None and (policy.max_edge is None or policy.max_edge > max_edge):
+        policy = replace(policy, max_edge=max_edge)
+    return policy
+
+
+@dataclass
+class EncodingReport:
+    """Accumulates how many bytes the encoding policies saved (thread-safe: encodes run in worker threads)"""
+    count: int = 0
+    original_bytes: int = 0
+    encoded_bytes: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
+
+    def add(self, original_bytes: int, encoded_bytes: int):
+        with self._lock:
+            self.count += 1
+            self.original_bytes += original_bytes
+            self.encoded_bytes += encoded_bytes
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - self.encoded_bytes
+
+
+def _looks_photographic(image: Image.Image, max_flat_colors: int = 1024) -> bool:
+    """UI chrome uses few distinct colors; photos and gradients use many."""
+    thumb = image.convert("RGB")
+    thumb.thumbnail((128, 128))
+    return len(thumb.getcolors(maxcolors=128 * 128) or ()) > max_flat_colors
+
+
+def compact_image(image: Image.Image, policy: EncodingPolicy):
+    """Re-encode per policy, dropping metadata. Returns (bytes, scale)."""
+    scale = 1.0
+    if policy.max_edge and max(image.size) > policy.max_edge:
+        # uniform scale keeps the aspect ratio, so 0-1000 normalized boxes stay valid
+        scale = policy.max_edge / max(image.size)
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                             Image.Resampling.LANCZOS)
+
+    fmt = policy.format
+    if fmt == "auto":
+        fmt = "jpeg" if _looks_photographic(image) else "png"
+
+    buffered = io.BytesIO()
+    if fmt == "png":
+        if image.mode not in ("RGB", "RGBA", "L", "P"):
+            image = image.convert("RGBA")
+        image.save(buffered, format="PNG", optimize=True)
+    else:
+        if image.mode in ("RGBA", "LA", "P"):
+            # flatten transparency onto white; lossy formats here are RGB only
+            rgba = image.convert("RGBA")
+            flattened = Image.new("RGB", rgba.size, (255, 255, 255))
+            flattened.paste(rgba, mask=rgba.split()[-1])
+            image = flattened
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        image.save(buffered, format=fmt.upper(), quality=policy.quality, optimize=True)
+    return buffered.getvalue(), scale
+
+
+def image_mime_type(image_encoding: str) -> str:
+    """MIME type of a base64 encoded image, from its magic bytes"""
+    if image_encoding.startswith("/9j/"):
+        return "image/jpeg"
+    if image_encoding.startswith("UklGR"):
+        return "image/webp"
+    return "image/png"
+
+
+def encode_image(image, policy: Optional[EncodingPolicy] = None, report: Optional[EncodingReport] = None):
+    """
+    Base64-encode an image path or PIL image.
+
+    Without a policy the bytes are sent as before (file contents, or lossless PNG).
+    With an EncodingPolicy the image is downscaled to `max_edge`, re-encoded as PNG or
+    JPEG/WebP and stripped of metadata. Pass an EncodingReport to collect bytes saved
+    (this costs one extra lossless encode for in-memory images).
+    """
+    if policy is None:
+        if type(image) == str:
+            try: 
+                with open(image, "rb") as image_file:
+                    encoding = base64.b64encode(image_file.read()).decode('utf-8')
+            except Exception as e:
+                print(e)
+                with open(image, "r", encoding="utf-8") as image_file:
+                    encoding = base64.b64encode(image_file.read()).decode('utf-8')
+            return encoding
+        
+        else:
+            buffered = io.BytesIO()
+            image.save(buffered, format="PNG")
+            return base64.b64encode(buffered.getvalue()).decode('utf-8')
+
+    if isinstance(image, (str, os.PathLike)):
+        original_bytes = os.path.getsize(image) if report is not None else 0
+        with Image.open(image) as img:
+            img.load()
+            data, _ = compact_image(img, policy)
     else:
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG")
-        return base64.b64encode(buffered.getvalue()).decode('utf-8')
+        original_bytes = 0
+        if report is not None:
+            buffered = io.BytesIO()
+            image.save(buffered, format="PNG")
+            original_bytes = buffered.tell()
+        data, _ = compact_image(image, policy)
+
+    if report is not None:
+        report.add(original_bytes, len(data))
+    return base64.b64encode(data).decode('utf-8')
 
 def image_mask(image_path: str, bbox_normalized: tuple[int, int, int, int]) -> Image.Image:
     """Creates a mask on the image in the specified normalized bounding box."""
@@ -90,6 +227,17 @@ def projection_analysis(image_path: str, bbox_normalized: tuple[int, int, int, i
         'bbox_normalized': bbox_normalized,
     }
 
+def find_runs(mask: np.ndarray, min_span: int = 0) -> np.ndarray:
+    """
+    Contiguous True runs of a 1-D boolean array as an (n, 2) array of inclusive
+    (start, end) indices, keeping runs with end - start >= min_span.
+    """
+    padded = np.concatenate(([False], np.asarray(mask, dtype=bool), [False]))
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    starts, ends = edges[0::2], edges[1::2] - 1
+    keep = ends - starts >= min_span
+    return np.column_stack((starts[keep], ends[keep]))
+
 def _find_groups_and_normalize(projection: np.ndarray, direction: str, 
                                bbox_normalized: tuple[int, int, int, int],
                                image_width: int, image_height: int,
@@ -98,23 +246,12 @@ def _find_groups_and_normalize(projection: np.ndarray, direction: str,
     Finds contiguous groups from projection data and returns them in normalized coordinates.
     """
     threshold = np.max(projection) * threshold_ratio
-    non_zero_indices = np.where(projection > threshold)[0]
+    groups_px = find_runs(projection > threshold, min_group_size_px)
     
-    if len(non_zero_indices) == 0:
+    if len(groups_px) == 0:
         return []
     
-    groups_px = []
-    start_px = non_zero_indices[0]
-    for i in range(1, len(non_zero_indices)):
-        if non_zero_indices[i] > non_zero_indices[i-1] + 1:
-            if non_zero_indices[i-1] - start_px >= min_group_size_px:
-                groups_px.append((start_px, non_zero_indices[i-1]))
-            start_px = non_zero_indices[i]
-    if non_zero_indices[-1] - start_px >= min_group_size_px:
-        groups_px.append((start_px, non_zero_indices[-1]))
-    
     # Convert pixel groups (relative to ROI) to normalized coordinates (relative to full image)
-    norm_groups = []
     roi_x1_norm, roi_y1_norm, roi_x2_norm, roi_y2_norm = bbox_normalized
     roi_w_norm = roi_x2_norm - roi_x1_norm
     roi_h_norm = roi_y2_norm - roi_y1_norm
@@ -122,17 +259,107 @@ def _find_groups_and_normalize(projection: np.ndarray, direction: str,
     roi_w_px = int(roi_w_norm * image_width / 1000)
     roi_h_px = int(roi_h_norm * image_height / 1000)
 
-    for start_px, end_px in groups_px:
-        if direction == 'horizontal':
-            start_norm = roi_y1_norm + int(start_px * roi_h_norm / roi_h_px)
-            end_norm = roi_y1_norm + int(end_px * roi_h_norm / roi_h_px)
-            norm_groups.append((roi_x1_norm, roi_x2_norm, start_norm, end_norm))
-        else: # vertical
-            start_norm = roi_x1_norm + int(start_px * roi_w_norm / roi_w_px)
-            end_norm = roi_x1_norm + int(end_px * roi_w_norm / roi_w_px)
-            norm_groups.append((start_norm, end_norm, roi_y1_norm, roi_y2_norm))
-            
-    return norm_groups
+    if direction == 'horizontal':
+        norm = roi_y1_norm + (groups_px * roi_h_norm // roi_h_px)
+        return [(roi_x1_norm, roi_x2_norm, int(start), int(end)) for start, end in norm]
+    # vertical
+    norm = roi_x1_norm + (groups_px * roi_w_norm // roi_w_px)
+    return [(int(start), int(end), roi_y1_norm, roi_y2_norm) for start, end in norm]
+
+def _ink_mask(image: np.ndarray) -> np.ndarray:
+    """Boolean foreground mask (dark content on light background), as in projection_analysis"""
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return binary > 0
+
+def _cut_segments(has_ink: np.ndarray, min_gap: int) -> np.ndarray:
+    """Split an axis at blank gaps of at least `min_gap` pixels; returns inclusive (start, end) segments"""
+    ink_runs = find_runs(has_ink)
+    if len(ink_runs) < 2:
+        return ink_runs
+    # a gap between consecutive ink runs separates segments only if it is wide enough
+    gaps = ink_runs[1:, 0] - ink_runs[:-1, 1] - 1
+    breaks = np.flatnonzero(gaps >= min_gap)
+    starts = np.concatenate(([ink_runs[0, 0]], ink_runs[breaks + 1, 0]))
+    ends = np.concatenate((ink_runs[breaks, 1], [ink_runs[-1, 1]]))
+    return np.column_stack((starts, ends))
+
+def xy_cut(mask: np.ndarray, bbox: tuple[int, int, int, int], min_gap: int = 8, min_size: int = 12,
+           max_depth: int = 8, depth: int = 0) -> dict:
+    """
+    Recursive XY-cut of `bbox` (pixel x1, y1, x2, y2) over a boolean foreground mask.
+
+    Each node is tightened to its content and split along the axis with the wider
+    blank gap; segments smaller than `min_size` in both directions are dropped.
+    Returns {'bbox': [x1, y1, x2, y2], 'children': [...], 'direction': 'rows' | 'columns' | None}.
+    """
+    x1, y1, x2, y2 = bbox
+    region = mask[y1:y2, x1:x2]
+    rows, cols = region.any(axis=1), region.any(axis=0)
+    if not rows.any():
+        return {"bbox": [x1, y1, x2, y2], "children": [], "direction": None}
+
+    # tighten to content
+    row_idx, col_idx = np.flatnonzero(rows), np.flatnonzero(cols)
+    x1, x2 = x1 + int(col_idx[0]), x1 + int(col_idx[-1]) + 1
+    y1, y2 = y1 + int(row_idx[0]), y1 + int(row_idx[-1]) + 1
+    node = {"bbox": [x1, y1, x2, y2], "children": [], "direction": None}
+    if depth >= max_depth:
+        return node
+
+    rows, cols = rows[row_idx[0]:row_idx[-1] + 1], cols[col_idx[0]:col_idx[-1] + 1]
+    row_segments, col_segments = _cut_segments(rows, min_gap), _cut_segments(cols, min_gap)
+
+    def widest_gap(segments):
+        return int((segments[1:, 0] - segments[:-1, 1]).max()) if len(segments) > 1 else 0
+
+    if widest_gap(row_segments) == 0 and widest_gap(col_segments) == 0:
+        return node
+    if widest_gap(row_segments) >= widest_gap(col_segments):
+        node["direction"] = "rows"
+        boxes = [(x1, y1 + int(start), x2, y1 + int(end) + 1) for start, end in row_segments]
+    else:
+        node["direction"] = "columns"
+        boxes = [(x1 + int(start), y1, x1 + int(end) + 1, y2) for start, end in col_segments]
+
+    for child_box in boxes:
+        if child_box[2] - child_box[0] < min_size and child_box[3] - child_box[1] < min_size:
+            continue
+        node["children"].append(xy_cut(mask, child_box, min_gap, min_size, max_depth, depth + 1))
+    return node
+
+def projection_tree(image_path: str, bbox_normalized: tuple[int, int, int, int] = (0, 0, 1000, 1000),
+                    min_gap: int = 8, min_size: int = 12, max_depth: int = 8) -> dict:
+    """
+    Hierarchical XY-cut segmentation of a normalized region in one call.
+
+    Returns a nested tree with pixel 'bbox' (what generate_html expects), the
+    matching 'bbox_normalized', and pre-order 'id's; the root spans the whole image.
+    """
+    image = cv2.imread(image_path)
+    if image is None:
+        print(f"Error: Failed to read image {image_path}")
+        return {}
+    h, w = image.shape[:2]
+    region_px = (int(bbox_normalized[0] * w / 1000), int(bbox_normalized[1] * h / 1000),
+                 int(bbox_normalized[2] * w / 1000), int(bbox_normalized[3] * h / 1000))
+
+    mask = np.zeros((h, w), dtype=bool)
+    x1, y1, x2, y2 = region_px
+    mask[y1:y2, x1:x2] = _ink_mask(image[y1:y2, x1:x2])
+    region_tree = xy_cut(mask, region_px, min_gap, min_size, max_depth)
+
+    root = {"bbox": [0, 0, w, h], "children": [region_tree], "direction": None}
+    next_id = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        node["id"] = next_id
+        next_id += 1
+        bx1, by1, bx2, by2 = node["bbox"]
+        node["bbox_normalized"] = [int(bx1 * 1000 / w), int(by1 * 1000 / h), int(bx2 * 1000 / w), int(by2 * 1000 / h)]
+        stack.extend(reversed(node["children"]))
+    return root
 
 def visualize_projection_analysis(image_path: str, analysis_result: dict, 
                                  save_path: str = None) -> str:
@@ -203,18 +430,219 @@ def visualize_projection_analysis(image_path: str, analysis_result: dict,
 
 
 
+class ClientRegistry:
+    """
+    Process-wide registry of provider SDK clients keyed by (provider, key, base_url).
+
+    All sync clients share one pooled keep-alive httpx.Client, so every bot instance
+    reuses warm TCP/TLS connections instead of paying the handshake per request.
+    Async clients are pooled per event loop (httpx async pools cannot cross loops).
+    Gemini models are cached instead of being rebuilt on every call. The Gemini SDK
+    keeps its API key in process-wide state (genai.configure), so only one Gemini
+    key can be used per process; asking for a second one raises ValueError.
+
+    The SDK clients do not retry on their own (max_retries=0): retries are left to
+    RequestScheduler, which would otherwise multiply with the SDK's.
+    """
+
+    def __init__(self, max_connections=32, max_keepalive_connections=16, keepalive_expiry=90.0,
+                 timeout=300.0, connect_timeout=15.0):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self._lock = threading.Lock()
+        self._http = None
+        self._async_http = {}   # event loop -> httpx.AsyncClient
+        self._clients = {}
+        self._gemini_key = None
+
+    def configure(self, **settings):
+        """Tune pool size / timeouts; only affects clients created afterwards."""
+        for name, value in settings.items():
+            if not hasattr(self, name) or name.startswith("_"):
+                raise ValueError(f"Unknown client registry setting: {name}")
+            setattr(self, name, value)
+
+    def _limits(self):
+        return httpx.Limits(max_connections=self.max_connections,
+                            max_keepalive_connections=self.max_keepalive_connections,
+                            keepalive_expiry=self.keepalive_expiry)
+
+    def _timeout(self):
+        return httpx.Timeout(self.timeout, connect=self.connect_timeout)
+
+    def _sync_http(self):
+        if self._http is None:
+            self._http = httpx.Client(limits=self._limits(), timeout=self._timeout())
+        return self._http
+
+    def _loop_http(self, loop):
+        if loop not in self._async_http:
+            # drop pools that belonged to finished event loops
+            for stale in [l for l in self._async_http if l.is_closed()]:
+                del self._async_http[stale]
+                for key in [k for k in self._clients if k[0] is stale]:
+                    del self._clients[key]
+            self._async_http[loop] = httpx.AsyncClient(limits=self._limits(), timeout=self._timeout())
+        return self._async_http[loop]
+
+    def _get(self, key, factory):
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = factory()
+            return self._clients[key]
+
+    def openai(self, api_key, base_url=None):
+        return self._get((None, "openai", api_key, base_url),
+                         lambda: OpenAI(api_key=api_key, base_url=base_url, http_client=self._sync_http(),
+                                        max_retries=0))
+
+    def async_openai(self, api_key, base_url=None):
+        loop = asyncio.get_running_loop()
+        return self._get((loop, "openai", api_key, base_url),
+                         lambda: AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=self._loop_http(loop),
+                                             max_retries=0))
+
+    def ark(self, api_key):
+        return self._get((None, "ark", api_key, None),
+                         lambda: Ark(api_key=api_key, http_client=self._sync_http(), max_retries=0))
+
+    def async_ark(self, api_key):
+        loop = asyncio.get_running_loop()
+        return self._get((loop, "ark", api_key, None),
+                         lambda: AsyncArk(api_key=api_key, http_client=self._loop_http(loop), max_retries=0))
+
+    def gemini(self, api_key, model):
+        def _create():
+            # called under self._lock, so the key check and genai.configure cannot interleave
+            if self._gemini_key is None:
+                genai.configure(api_key=api_key)
+                self._gemini_key = api_key
+            elif self._gemini_key != api_key:
+                raise ValueError("A different Gemini API key is already configured in this process; "
+                                 "genai.configure is process-wide, so Gemini bots must share one key")
+            return genai.GenerativeModel(model)
+        return self._get((None, "gemini", api_key, model), _create)
+
+    def close(self):
+        """Close pooled connections; registered with atexit."""
+        with self._lock:
+            self._clients.clear()
+            if self._http is not None:
+                self._http.close()
+                self._http = None
+            for loop, client in list(self._async_http.items()):
+                if not loop.is_closed() and not loop.is_running():
+                    loop.run_until_complete(client.aclose())
+            self._async_http.clear()
+
+    async def aclose(self):
+        """Close pooled connections from inside a running event loop (e.g. server shutdown)."""
+        loop = asyncio.get_running_loop()
+        client = self._async_http.pop(loop, None)
+        if client is not None:
+            await client.aclose()
+        self.close()
+
+
+# shared by every Bot instance in the process
+client_registry = ClientRegistry()
+atexit.register(client_registry.close)
+
+
 class Bot:
-    def __init__(self, key_path, patience=3) -> None:
+    """
+    Base class for the provider bots.
+
+    `image_encoding` may be a single base64 string or a list of them; a list is sent
+    as several images in one multimodal message.
+    """
+    provider = None
+    sampling = {}
+    supports_batch_api = False
+
+    def __init__(self, key_path, patience=3, cache=None) -> None:
         if os.path.exists(key_path):
             with open(key_path, "r") as f:
                 self.key = f.read().replace("\n", "")
         else:
             self.key = key_path
         self.patience = patience
-    
-    def ask(self):
+        self.cache = cache  # llm_cache.ResponseCache or None
+        self.model = None
+
+    def _ask(self, question, image_encoding=None, verbose=False):
         raise NotImplementedError
+
+    async def _ask_async(self, question, image_encoding=None, verbose=False):
+        """Non-blocking request; subclasses override this with their provider's async client."""
+        return await run_blocking(self._ask, question, image_encoding, verbose)
+
+    def _cache_key(self, question, image_encoding):
+        if isinstance(image_encoding, (list, tuple)):
+            image_encoding = "\n".join(image_encoding)
+        return cache_key(self.provider, self.model, question, image_encoding, self.sampling)
     
+    def ask(self, question, image_encoding=None, verbose=False, use_cache=True):
+        key = self._cache_key(question, image_encoding) if use_cache and self.cache is not None else None
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        response = self._ask(question, image_encoding, verbose)
+        if key is not None and response is not None:
+            self.cache.set(key, response)
+        return response
+
+    async def ask_async(self, question, image_encoding=None, verbose=False, use_cache=True):
+        key = self._cache_key(question, image_encoding) if use_cache and self.cache is not None else None
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        response = await self._ask_async(question, image_encoding, verbose)
+        if key is not None and response is not None:
+            self.cache.set(key, response)
+        return response
+    
+    def _ask_stream(self, question, image_encoding=None):
+        """Text chunks as the provider produces them; providers without streaming yield one chunk."""
+        yield self._ask(question, image_encoding)
+
+    async def _ask_stream_async(self, question, image_encoding=None):
+        yield await self._ask_async(question, image_encoding)
+
+    def ask_stream(self, question, image_encoding=None, use_cache=True):
+        """Like `ask`, but yields the answer chunk by chunk; a cache hit is yielded whole."""
+        key = self._cache_key(question, image_encoding) if use_cache and self.cache is not None else None
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+        chunks = []
+        for chunk in self._ask_stream(question, image_encoding):
+            chunks.append(chunk)
+            yield chunk
+        if key is not None and chunks:
+            self.cache.set(key, "".join(chunks))
+
+    async def ask_stream_async(self, question, image_encoding=None, use_cache=True):
+        key = self._cache_key(question, image_encoding) if use_cache and self.cache is not None else None
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+        chunks = []
+        async for chunk in self._ask_stream_async(question, image_encoding):
+            chunks.append(chunk)
+            yield chunk
+        if key is not None and chunks:
+            self.cache.set(key, "".join(chunks))
+
     def try_ask(self, question, image_encoding=None, verbose=False):
         for i in range(self.patience):
             try:
@@ -224,155 +652,276 @@ class Bot:
                 time.sleep(5)
         return None
 
+    async def try_ask_async(self, question, image_encoding=None, verbose=False):
+        for i in range(self.patience):
+            try:
+                return await self.ask_async(question, image_encoding, verbose)
+            except Exception as e:
+                print(e, "waiting for 5 seconds")
+                await asyncio.sleep(5)
+        return None
+
+    def _log(self, question, response, seed=None):
+        print("####################################")
+        print("question:\n", question)
+        print("####################################")
+        print("response:\n", response)
+        if seed is not None:
+            print(f"seed used: {seed}")
+
+
+def timeout_option():
+    """`timeout` argument for an SDK request: the time left of the scheduler's attempt, if any"""
+    timeout = request_timeout()
+    return {"timeout": timeout} if timeout is not None else {}
+
+
+def chat_message(question, image_encoding=None):
+    """OpenAI-style user message with optional base64 image(s)"""
+    if not image_encoding:
+        return {"role": "user", "content": question}
+    encodings = image_encoding if isinstance(image_encoding, (list, tuple)) else [image_encoding]
+    return {
+        "role": "user",
+        "content": [{"type": "text", "text": question}] + [
+            {
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:{image_mime_type(encoding)};base64,{encoding}",
+                },
+            }
+            for encoding in encodings
+        ],
+    }
+
+
+def stream_text(stream):
+    """Text deltas of an OpenAI-style chat completion stream (reasoning deltas are skipped)"""
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+async def astream_text(pending_stream):
+    """Async counterpart of `stream_text`; takes the un-awaited `create(stream=True)` call"""
+    stream = await pending_stream
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+class OpenAIBatchMixin:
+    """
+    Asynchronous batch jobs for OpenAI-compatible endpoints (OpenAI, DashScope).
+
+    `submit_batch` uploads one JSONL line per request and returns the batch id right
+    away; `collect_batch` polls until the job finishes and returns {custom_id: answer}.
+    Requests the provider rejected are left out of the result.
+    """
+    supports_batch_api = True
+    batch_endpoint = "/v1/chat/completions"
+
+    def submit_batch(self, items, completion_window="24h"):
+        """items: iterable of (custom_id, question, image_encoding)"""
+        lines = [
+            json.dumps({"custom_id": str(custom_id), "method": "POST", "url": self.batch_endpoint,
+                        "body": self._request(question, image_encoding)}, ensure_ascii=False)
+            for custom_id, question, image_encoding in items
+        ]
+        batch_file = self.client.files.create(file=("batch.jsonl", "\n".join(lines).encode("utf-8")),
+                                              purpose="batch")
+        batch = self.client.batches.create(input_file_id=batch_file.id, endpoint=self.batch_endpoint,
+                                           completion_window=completion_window)
+        return batch.id
+
+    def collect_batch(self, batch_id, poll_interval=30.0, timeout=None):
+        start = time.monotonic()
+        while True:
+            batch = self.client.batches.retrieve(batch_id)
+            if batch.status == "completed":
+                break
+            if batch.status in ("failed", "expired", "cancelled"):
+                raise RuntimeError(f"{self.provider} batch {batch_id} {batch.status}")
+            if timeout is not None and time.monotonic() - start > timeout:
+                raise TimeoutError(f"{self.provider} batch {batch_id} still {batch.status} after {timeout}s")
+            time.sleep(poll_interval)
+
+        results = {}
+        if batch.output_file_id:
+            for line in self.client.files.content(batch.output_file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                response = record.get("response") or {}
+                if response.get("status_code") == 200:
+                    results[record["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+        return results
+
 class Doubao(Bot):
-    def __init__(self, key_path, patience=3, model="doubao-1.5-thinking-vision-pro-250428") -> None:
-        super().__init__(key_path, patience)
-        self.client = Ark(api_key=self.key)
+    provider = "doubao"
+    sampling = {"max_tokens": 4096, "temperature": 0}
+
+    def __init__(self, key_path, patience=3, model="doubao-1.5-thinking-vision-pro-250428", cache=None) -> None:
+        super().__init__(key_path, patience, cache)
+        self.client = client_registry.ark(self.key)
         self.model = model
-    
-    def ask(self, question, image_encoding=None, verbose=False):
 
-        if image_encoding:
-            messages = [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": question},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{image_encoding}",
-                            },
-                        },
-                    ],
-                }
-            ]
-        else:
-            messages = [{"role": "user", "content": question}]
-        response = self.client.chat.completions.create(
+    def _request(self, question, image_encoding):
+        return dict(
             model=self.model,
-            messages=messages,
-            max_tokens=4096,
-            temperature=0,
+            messages=[chat_message(question, image_encoding)],
+            **self.sampling,
         )
+    
+    def _ask(self, question, image_encoding=None, verbose=False):
+        response = self.client.chat.completions.create(**self._request(question, image_encoding), **timeout_option())
         response = response.choices[0].message.content
         if verbose:
-            print("####################################")
-            print("question:\n", question)
-            print("####################################")
-            print("response:\n", response)
-            # print("seed used: 42")
-            # img = base64.b64decode(image_encoding)
-            # img = Image.open(io.BytesIO(img))
-            # img.show()
+            self._log(question, response)
+        return response
+
+    async def _ask_async(self, question, image_encoding=None, verbose=False):
+        client = client_registry.async_ark(self.key)
+        response = await client.chat.completions.create(**self._request(question, image_encoding), **timeout_option())
+        response = response.choices[0].message.content
+        if verbose:
+            self._log(question, response)
         return response
 
-class Qwen(Bot):
-    def __init__(self, key_path, patience=3, model="qwen2.5-vl-32b-instruct") -> None:
-        super().__init__(key_path, patience)
-        self.client = OpenAI(api_key=self.key, base_url="https://dashscope.aliyuncs.com/compatible-mode/v1")
+    def _ask_stream(self, question, image_encoding=None):
+        return stream_text(self.client.chat.completions.create(stream=True, **self._request(question, image_encoding),
+                                                               **timeout_option()))
+
+    def _ask_stream_async(self, question, image_encoding=None):
+        client = client_registry.async_ark(self.key)
+        return astream_text(client.chat.completions.create(stream=True, **self._request(question, image_encoding),
+                                                           **timeout_option()))
+
+class Qwen(OpenAIBatchMixin, Bot):
+    provider = "qwen"
+    sampling = {"max_tokens": 4096, "temperature": 0, "seed": 42}
+
+    def __init__(self, key_path, patience=3, model="qwen2.5-vl-32b-instruct", cache=None) -> None:
+        super().__init__(key_path, patience, cache)
+        self.base_url = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+        self.client = client_registry.openai(self.key, self.base_url)
         self.name = model
+        self.model = model
 
-    def ask(self, question, image_encoding=None, verbose=False):
-        if image_encoding:
-            content = {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": question},
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/png;base64,{image_encoding}"
-                        }
-                    }
-                ]
-            }
-        else:
-            content = {"role": "user", "content": question} 
-        
-        response = self.client.chat.completions.create(
+    def _request(self, question, image_encoding):
+        return dict(
             model=self.name,
-            messages=[content],
-            max_tokens=4096,
-            temperature=0,
-            seed=42,
+            messages=[chat_message(question, image_encoding)],
+            **self.sampling,
         )
+
+    def _ask(self, question, image_encoding=None, verbose=False):
+        response = self.client.chat.completions.create(**self._request(question, image_encoding), **timeout_option())
         response = response.choices[0].message.content
         if verbose:
-            print("####################################")
-            print("question:\n", question)
-            print("####################################")
-            print("response:\n", response)
-            print("seed used: 42")
+            self._log(question, response, seed=42)
         return response
 
-class GPT(Bot):
-    def __init__(self, key_path, patience=3, model="gpt-4o") -> None:
-        super().__init__(key_path, patience)
-        self.client = OpenAI(api_key=self.key)
+    async def _ask_async(self, question, image_encoding=None, verbose=False):
+        client = client_registry.async_openai(self.key, self.base_url)
+        response = await client.chat.completions.create(**self._request(question, image_encoding), **timeout_option())
+        response = response.choices[0].message.content
+        if verbose:
+            self._log(question, response, seed=42)
+        return response
+
+    def _ask_stream(self, question, image_encoding=None):
+        return stream_text(self.client.chat.completions.create(stream=True, **self._request(question, image_encoding),
+                                                               **timeout_option()))
+
+    def _ask_stream_async(self, question, image_encoding=None):
+        client = client_registry.async_openai(self.key, self.base_url)
+        return astream_text(client.chat.completions.create(stream=True, **self._request(question, image_encoding),
+                                                           **timeout_option()))
+
+class GPT(OpenAIBatchMixin, Bot):
+    provider = "gpt"
+    sampling = {"max_tokens": 4096, "temperature": 0, "seed": 42}
+
+    def __init__(self, key_path, patience=3, model="gpt-4o", cache=None) -> None:
+        super().__init__(key_path, patience, cache)
+        self.base_url = None
+        self.client = client_registry.openai(self.key)
         self.name="gpt4"
         self.model = model
-        
-    def ask(self, question, image_encoding=None, verbose=False):
-        
-        if image_encoding:
-            content =    {
-            "role": "user",
-            "content": [
-                {"type": "text", "text": question},
-                {
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/png;base64,{image_encoding}",
-                },
-                },
-            ],
-            }
-        else:
-            content = {"role": "user", "content": question}
-        response = self.client.chat.completions.create(
-        model=self.model,
-        messages=[
-         content
-        ],
-        max_tokens=4096,
-        temperature=0,
-        seed=42,
+
+    def _request(self, question, image_encoding):
+        return dict(
+            model=self.model,
+            messages=[chat_message(question, image_encoding)],
+            **self.sampling,
         )
+        
+    def _ask(self, question, image_encoding=None, verbose=False):
+        response = self.client.chat.completions.create(**self._request(question, image_encoding), **timeout_option())
         response = response.choices[0].message.content
         if verbose:
-            print("####################################")
-            print("question:\n", question)
-            print("####################################")
-            print("response:\n", response)
-            print("seed used: 42")
-            # img = base64.b64decode(image_encoding)
-            # img = Image.open(io.BytesIO(img))
-            # img.show()
+            self._log(question, response, seed=42)
         return response
 
+    async def _ask_async(self, question, image_encoding=None, verbose=False):
+        client = client_registry.async_openai(self.key, self.base_url)
+        response = await client.chat.completions.create(**self._request(question, image_encoding), **timeout_option())
+        response = response.choices[0].message.content
+        if verbose:
+            self._log(question, response, seed=42)
+        return response
+
+    def _ask_stream(self, question, image_encoding=None):
+        return stream_text(self.client.chat.completions.create(stream=True, **self._request(question, image_encoding),
+                                                               **timeout_option()))
+
+    def _ask_stream_async(self, question, image_encoding=None):
+        client = client_registry.async_openai(self.key, self.base_url)
+        return astream_text(client.chat.completions.create(stream=True, **self._request(question, image_encoding),
+                                                           **timeout_option()))
+
 class Gemini(Bot):
-    def __init__(self, key_path, patience=3, model="gemini-1.5-flash-latest") -> None:
-        super().__init__(key_path, patience)
-        GOOGLE_API_KEY= self.key
-        genai.configure(api_key=GOOGLE_API_KEY)
+    provider = "gemini"
+
+    def __init__(self, key_path, patience=3, model="gemini-1.5-flash-latest", cache=None) -> None:
+        super().__init__(key_path, patience, cache)
         self.name = "Gemini"
         self.model = model
         self.file_count = 0
+
+    def _contents(self, question, image_encoding):
+        if image_encoding:
+            encodings = image_encoding if isinstance(image_encoding, (list, tuple)) else [image_encoding]
+            return [question] + [Image.open(io.BytesIO(base64.b64decode(encoding))) for encoding in encodings]
+        return question
         
-    def ask(self, question, image_encoding=None, verbose=False):
-        model = genai.GenerativeModel(self.model)
+    def _ask(self, question, image_encoding=None, verbose=False):
+        model = client_registry.gemini(self.key, self.model)
 
         if verbose:
             print(f"##################{self.file_count}##################")
             print("question:\n", question)
 
-        if image_encoding:
-            img = base64.b64decode(image_encoding)
-            img = Image.open(io.BytesIO(img))
-            response = model.generate_content([question, img], request_options={"timeout": 3000}) 
-        else:    
-            response = model.generate_content(question, request_options={"timeout": 3000})
+        response = model.generate_content(self._contents(question, image_encoding),
+                                          request_options={"timeout": request_timeout() or 3000})
+
+        if verbose:
+            print("####################################")
+            print("response:\n", response.text)
+            self.file_count += 1
+
+        return response.text
+
+    async def _ask_async(self, question, image_encoding=None, verbose=False):
+        model = client_registry.gemini(self.key, self.model)
+
+        if verbose:
+            print(f"##################{self.file_count}##################")
+            print("question:\n", question)
+
+        response = await model.generate_content_async(self._contents(question, image_encoding),
+                                                      request_options={"timeout": request_timeout() or 3000})
 
         if verbose:
             print("####################################")
@@ -380,3 +929,18 @@ class Gemini(Bot):
             self.file_count += 1
 
         return response.text
+
+    def _ask_stream(self, question, image_encoding=None):
+        model = client_registry.gemini(self.key, self.model)
+        for chunk in model.generate_content(self._contents(question, image_encoding), stream=True,
+                                            request_options={"timeout": request_timeout() or 3000}):
+            if chunk.text:
+                yield chunk.text
+
+    async def _ask_stream_async(self, question, image_encoding=None):
+        model = client_registry.gemini(self.key, self.model)
+        response = await model.generate_content_async(self._contents(question, image_encoding), stream=True,
+                                                      request_options={"timeout": request_timeout() or 3000})
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text